@@ -0,0 +1,163 @@
+import asyncio
+import json
+import re
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import create_app
+from database.async_db import AsyncDatabase
+from services import api
+from services.eventi import bus, visibile, formatta_sse, PING
+
+
+# Entry point ASGI: uvicorn asgi:app
+# Le API JSON chiamate a ogni tasto/selezione dai form sono servite da handler
+# async sull'engine asincrono, così come lo stream SSE del resoconto; tutte le
+# altre rotte passano all'app Flask.
+
+flask_app = create_app()
+wsgi_app = WsgiToAsgi(flask_app)
+_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+
+
+def _sessione_flask(scope):
+    """Decodifica il cookie di sessione firmato da Flask (None se assente o non valido)."""
+    cookie = SimpleCookie()
+    for nome, valore in scope['headers']:
+        if nome == b'cookie':
+            cookie.load(valore.decode('latin-1'))
+    morsel = cookie.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return None
+    try:
+        return _serializer.loads(morsel.value,
+                                 max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except Exception:
+        return None
+
+
+async def _send(send, status, body=b'', headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-length', str(len(body)).encode()), *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _send_json(send, payload):
+    await _send(send, 200, json.dumps(payload).encode('utf-8'),
+                [(b'content-type', b'application/json')])
+
+
+async def _esegui(stmt, params, payload):
+    rows = await AsyncDatabase().execute_all(stmt, params) if stmt is not None else []
+    return payload(rows)
+
+
+async def indirizzi_scuola(sessione, query, codice_scuola):
+    return await _esegui(*api.api_indirizzi_scuola(codice_scuola))
+
+
+async def indirizzi_scuole(sessione, query, **_):
+    return await _esegui(*api.api_indirizzi_scuole(query.get('scuole', [''])[0]))
+
+
+async def cerca_attivita(sessione, query, **_):
+    return await _esegui(*api.api_cerca_attivita(query.get('q', [''])[0], sessione.get('struttura')))
+
+
+async def confronta_edizioni(sessione, query, **_):
+    return await _esegui(*api.api_confronta_edizioni(query.get('ids', [''])[0]))
+
+
+async def serie_edizioni(sessione, query, **_):
+    return await _esegui(*api.api_serie_edizioni(query.get('id', [''])[0], sessione.get('struttura')))
+
+
+ROTTE_ASYNC = [
+    (re.compile(r'^/api/indirizzi$'), indirizzi_scuole),
+    (re.compile(r'^/api/indirizzi/(?P<codice_scuola>[^/]+)$'), indirizzi_scuola),
+    (re.compile(r'^/api/cerca_attivita$'), cerca_attivita),
+    (re.compile(r'^/api/confronta_edizioni$'), confronta_edizioni),
+    (re.compile(r'^/api/serie_edizioni$'), serie_edizioni),
+]
+
+
+async def eventi_resoconto(sessione, receive, send):
+    """
+    Stream SSE servito sull'event loop: una connessione aperta non occupa un
+    thread. Gli eventi arrivano dal bus (thread di chi pubblica) tramite
+    call_soon_threadsafe; lo stream termina alla disconnessione del client.
+    """
+    loop = asyncio.get_running_loop()
+    coda = asyncio.Queue(maxsize=100)
+
+    def accoda(evento):
+        if not coda.full():
+            coda.put_nowait(evento)
+
+    def consegna(evento):
+        loop.call_soon_threadsafe(accoda, evento)
+
+    async def attendi_disconnessione():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                            (b'x-accel-buffering', b'no')]})
+    await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+
+    bus.iscrivi(consegna)
+    disconnessione = asyncio.ensure_future(attendi_disconnessione())
+    try:
+        while not disconnessione.done():
+            prossimo = asyncio.ensure_future(coda.get())
+            await asyncio.wait({prossimo, disconnessione}, timeout=PING, return_when=asyncio.FIRST_COMPLETED)
+            if not prossimo.done():
+                prossimo.cancel()
+                if not disconnessione.done():
+                    await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                continue
+            evento = prossimo.result()
+            if visibile(evento, sessione.get('struttura')):
+                await send({'type': 'http.response.body', 'body': formatta_sse(evento).encode('utf-8'),
+                            'more_body': True})
+    finally:
+        bus.annulla(consegna)
+        disconnessione.cancel()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            bus.avvia_listener()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await AsyncDatabase().dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        if scope['path'] == '/api/resoconto/eventi':
+            sessione = _sessione_flask(scope)
+            if not sessione or 'user' not in sessione:
+                return await _send(send, 302, headers=[(b'location', b'/')])
+            return await eventi_resoconto(sessione, receive, send)
+        for pattern, handler in ROTTE_ASYNC:
+            match = pattern.match(scope['path'])
+            if match is None:
+                continue
+            sessione = _sessione_flask(scope)
+            if not sessione or 'user' not in sessione:
+                return await _send(send, 302, headers=[(b'location', b'/')])
+            query = parse_qs(scope['query_string'].decode('latin-1'))
+            return await _send_json(send, await handler(sessione, query, **match.groupdict()))
+
+    await wsgi_app(scope, receive, send)
@@ -0,0 +1,171 @@
+"""
+Benchmark dei percorsi frequenti: costo Python della costruzione degli
+statement e cache degli statement compilati dell'engine.
+
+    python benchmarks/bench_statement.py [--repo CARTELLA] [--url DATABASE_URL]
+
+Due misure, ognuna con la percentuale di esecuzioni servite dalla cache degli
+statement compilati (context.cache_hit):
+- "operazioni": ogni percorso eseguito nella forma precedente (query costruita
+  a ogni chiamata, session.query(X).get) e con gli statement precostruiti di
+  database/queries.py, su una sessione nuova per chiamata come in una richiesta;
+- "richieste": latenza delle rotte corrispondenti con il client di test di
+  Flask. Con --repo la stessa misura gira su un altro checkout del
+  repository (es. `git worktree add /tmp/prima <revisione>`), per confrontare
+  le rotte prima e dopo gli statement precostruiti.
+
+Senza --url usa un database SQLite temporaneo.
+"""
+import os
+import sys
+import argparse
+import tempfile
+import warnings
+from collections import Counter
+
+_QUI = os.path.dirname(os.path.abspath(__file__))
+
+
+def _argomenti():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repo', default=os.path.dirname(_QUI))
+    parser.add_argument('--url', default='sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    parser.add_argument('--attivita', type=int, default=5000)
+    parser.add_argument('--ripetizioni', type=int, default=300)
+    return parser.parse_args()
+
+
+class ContaCache:
+    """Conta le esecuzioni per esito della cache degli statement compilati."""
+
+    def __init__(self, engine):
+        self.dialetto = engine.dialect
+        self.esiti = Counter()
+        from sqlalchemy import event
+        event.listen(engine, 'after_cursor_execute', self._conta)
+
+    def _conta(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            self.esiti[context.cache_hit] += 1
+
+    def azzera(self):
+        self.esiti.clear()
+
+    def percentuale_hit(self):
+        totale = sum(self.esiti.values())
+        return 100 * self.esiti[self.dialetto.CACHE_HIT] / totale if totale else 0.0
+
+
+def _operazioni(Database, ripetizioni, conta):
+    from sqlalchemy import select
+    from database import queries
+    from database.models import AttivitaOrientamento, IndirizzoScolastico, UtenteApplicazione
+
+    if not hasattr(queries, 'STMT_UTENTE_PER_EMAIL'):
+        print("operazioni: statement precostruiti assenti in questa revisione, misura saltata\n")
+        return
+
+    codici = [f'VR{i:08d}' for i in range(0, 30, 3)]
+
+    def in_sessione(funzione):
+        def chiamata():
+            with Database().session_factory() as s:
+                funzione(s)
+        return chiamata
+
+    def attivita_figli(attivita):
+        return len(attivita.supervisioni) + len(attivita.collaborazioni) + len(attivita.partecipazioni)
+
+    # Forma precedente, come nelle rotte prima degli statement precostruiti
+    warnings.filterwarnings('ignore', message='The Query.get')
+    precedenti = {
+        'login': lambda s: s.query(UtenteApplicazione).filter_by(email='docente0@univr.it').first(),
+        'modifica_attivita': lambda s: attivita_figli(s.query(AttivitaOrientamento).get(42)),
+        'indirizzi_scuola': lambda s: s.execute(select(IndirizzoScolastico.indirizzo).where(
+            IndirizzoScolastico.codice_meccanografico == 'VR00000007'
+        ).order_by(IndirizzoScolastico.indirizzo)).all(),
+        'indirizzi_scuole': lambda s: s.execute(select(
+            IndirizzoScolastico.codice_meccanografico, IndirizzoScolastico.indirizzo
+        ).where(IndirizzoScolastico.codice_meccanografico.in_(codici)).order_by(
+            IndirizzoScolastico.codice_meccanografico, IndirizzoScolastico.indirizzo)).all(),
+        'cerca_attivita': lambda s: s.execute(select(
+            AttivitaOrientamento.id_attivita, AttivitaOrientamento.nome, AttivitaOrientamento.data_inizio,
+            AttivitaOrientamento.struttura_organizzante
+        ).where(AttivitaOrientamento.nome.ilike('%tà 12%')).order_by(
+            AttivitaOrientamento.data_inizio.desc()).limit(20)).all(),
+    }
+    precostruiti = {
+        'login': lambda s: s.execute(queries.STMT_UTENTE_PER_EMAIL, {'email': 'docente0@univr.it'}).scalars().first(),
+        'modifica_attivita': lambda s: attivita_figli(
+            s.execute(queries.STMT_ATTIVITA_MODIFICA, {'id_attivita': 42}).scalars().first()),
+        'indirizzi_scuola': lambda s: s.execute(queries.STMT_INDIRIZZI_SCUOLA, {'codice_scuola': 'VR00000007'}).all(),
+        'indirizzi_scuole': lambda s: s.execute(queries.STMT_INDIRIZZI_SCUOLE, {'codici': codici}).all(),
+        'cerca_attivita': lambda s: s.execute(queries.STMT_CERCA_ATTIVITA, {'pattern': '%tà 12%'}).all(),
+    }
+
+    from dati import misura
+    print("operazioni (ms per chiamata, mediana / p95; hit = esecuzioni servite dalla cache compilata)")
+    print(f"{'percorso':<18} {'precedente':>16} {'hit':>5} {'precostruito':>16} {'hit':>5} {'speedup':>8}")
+    for nome in precedenti:
+        risultati = []
+        for funzione in (precedenti[nome], precostruiti[nome]):
+            chiamata = in_sessione(funzione)
+            chiamata()  # compila e popola la cache
+            conta.azzera()
+            risultati.append((misura(chiamata, ripetizioni), conta.percentuale_hit()))
+        (t_prima, hit_prima), (t_dopo, hit_dopo) = risultati
+        print(f"{nome:<18} {t_prima[0]:>7.3f} /{t_prima[1]:>7.3f} {hit_prima:>4.0f}% "
+              f"{t_dopo[0]:>7.3f} /{t_dopo[1]:>7.3f} {hit_dopo:>4.0f}% {t_prima[0] / t_dopo[0]:>7.2f}x")
+    print()
+
+
+def _richieste(app, ripetizioni, conta, email, password):
+    from dati import misura
+
+    client = app.test_client()
+    rotte = {
+        'login': lambda: client.post('/', data={'email': email, 'password': password}),
+        'modifica_attivita': lambda: client.get('/modifica_attivita/42'),
+        'api/indirizzi/<cm>': lambda: client.get('/api/indirizzi/VR00000007'),
+        'api/indirizzi': lambda: client.get('/api/indirizzi?scuole=' + ','.join(
+            f'VR{i:08d}' for i in range(0, 30, 3))),
+        'api/cerca_attivita': lambda: client.get('/api/cerca_attivita?q=tà 12'),
+        'api/confronta_edizioni': lambda: client.get('/api/confronta_edizioni?ids=1,2,3,4'),
+    }
+    rotte['login']()
+
+    print("richieste (ms per richiesta, mediana / p95)")
+    print(f"{'rotta':<24} {'latenza':>16} {'hit':>5}")
+    for nome, richiesta in rotte.items():
+        risposta = richiesta()
+        assert risposta.status_code in (200, 302), (nome, risposta.status_code)
+        conta.azzera()
+        tempi = misura(richiesta, ripetizioni)
+        print(f"{nome:<24} {tempi[0]:>7.3f} /{tempi[1]:>7.3f} {conta.percentuale_hit():>4.0f}%")
+
+
+def main():
+    args = _argomenti()
+    # Prima di importare l'app: l'engine legge DATABASE_URL alla prima istanza
+    os.environ['DATABASE_URL'] = args.url
+    os.environ['SLOW_QUERY_MS'] = '0'
+    sys.path[:0] = [os.path.abspath(args.repo), _QUI]
+
+    from app import create_app
+    from database.db_connection import Database
+    from dati import popola, utente
+
+    app = create_app()
+    engine = Database().engine
+    popola(engine, attivita=args.attivita)
+    email, password = utente(engine)
+    conta = ContaCache(engine)
+
+    print(f"{os.path.abspath(args.repo)} su {engine.dialect.name}, {args.attivita} attività, "
+          f"{args.ripetizioni} ripetizioni\n")
+    _operazioni(Database, args.ripetizioni, conta)
+    _richieste(app, args.ripetizioni, conta, email, password)
+
+
+if __name__ == '__main__':
+    main()
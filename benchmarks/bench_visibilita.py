@@ -0,0 +1,66 @@
+"""
+Benchmark della visibilità per struttura: filtro precedente (OUTER JOIN
+collabora + OR) contro la sottoquery UNION di database/visibility.py, sulla
+lista delle attività e sui totali del resoconto.
+
+    python benchmarks/bench_visibilita.py [--url DATABASE_URL] [--attivita 20000]
+
+Senza --url usa un database SQLite temporaneo. Per ogni struttura stampa righe
+restituite e tempi (mediana / 95° percentile) delle due forme: il filtro con OR
+conta un'attività una volta per collaboratore, la UNION una volta sola.
+"""
+import os
+import sys
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select, func  # noqa: E402
+
+from dati import popola, misura  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    parser.add_argument('--attivita', type=int, default=20000)
+    parser.add_argument('--ripetizioni', type=int, default=50)
+    args = parser.parse_args()
+
+    from database.models import AttivitaOrientamento, Collabora
+    from database.visibility import applica_visibilita
+
+    engine = create_engine(args.url)
+    strutture = popola(engine, attivita=args.attivita)
+
+    def filtro_or(stmt, struttura):
+        return stmt.outerjoin(Collabora).where(
+            (AttivitaOrientamento.struttura_organizzante == struttura) | (Collabora.nome_struttura == struttura))
+
+    lista = select(AttivitaOrientamento.id_attivita, AttivitaOrientamento.nome, AttivitaOrientamento.data_inizio) \
+        .order_by(AttivitaOrientamento.data_inizio.desc())
+    totali = select(func.count(AttivitaOrientamento.id_attivita), func.sum(AttivitaOrientamento.totale_ore))
+
+    print(f"{engine.dialect.name}, {args.attivita} attività, {args.ripetizioni} ripetizioni; tempi in ms")
+    print(f"{'struttura':<18} {'query':<7} {'righe OR':>9} {'righe UNION':>11} "
+          f"{'OR med/p95':>14} {'UNION med/p95':>14} {'speedup':>8}")
+    with engine.connect() as conn:
+        for struttura in strutture[1:4] + strutture[-2:]:
+            for nome, base in (('lista', lista), ('totali', totali)):
+                vecchio, nuovo = filtro_or(base, struttura), applica_visibilita(base, struttura)
+                righe_or, righe_union = conn.execute(vecchio).all(), conn.execute(nuovo).all()
+                if nome == 'totali':
+                    righe_or, righe_union = righe_or[0][0], righe_union[0][0]
+                else:
+                    assert {r[0] for r in righe_or} == {r[0] for r in righe_union}
+                    righe_or, righe_union = len(righe_or), len(righe_union)
+                t_or = misura(lambda: conn.execute(vecchio).all(), args.ripetizioni)
+                t_union = misura(lambda: conn.execute(nuovo).all(), args.ripetizioni)
+                print(f"{struttura:<18} {nome:<7} {righe_or:>9} {righe_union:>11} "
+                      f"{t_or[0]:>6.2f} /{t_or[1]:>6.2f} {t_union[0]:>6.2f} /{t_union[1]:>6.2f} "
+                      f"{t_or[0] / t_union[0]:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Dati sintetici per i benchmark: strutture, personale, scuole, attività con
+collaborazioni e partecipazioni, inseriti con INSERT multi-riga.
+
+Usa solo colonne presenti in tutte le versioni dello schema, così lo stesso
+benchmark può girare su revisioni diverse del repository (--repo).
+"""
+import random
+from datetime import date, timedelta
+
+
+def popola(engine, attivita=20000, strutture=20, scuole=300, seme=1):
+    """Crea lo schema su `engine` e lo riempie; restituisce i nomi delle strutture."""
+    from database.db_connection import Base
+    from database.models import (
+        Struttura, PersonaleUniversitario, PersonaleScolastico, Scuola,
+        IndirizzoScolastico, AttivitaOrientamento, Collabora, Partecipa
+    )
+
+    casuale = random.Random(seme)
+    nomi = ['Ateneo di Verona'] + [f'Dipartimento {i:02d}' for i in range(1, strutture)]
+    indirizzi = ['Scientifico', 'Classico', 'Linguistico', 'Tecnico']
+    inizio = date(2019, 1, 1)
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(Struttura.__table__.insert(), [{'nome': n} for n in nomi])
+        conn.execute(PersonaleUniversitario.__table__.insert(), [
+            {'email': f'docente{i}@univr.it', 'nome': f'Nome{i}', 'cognome': f'Cognome{i}'} for i in range(200)])
+        conn.execute(PersonaleScolastico.__table__.insert(), [
+            {'email': f'dirigente{i}@scuola.it', 'nome': f'Nome{i}', 'cognome': f'Cognome{i}'} for i in range(scuole)])
+        conn.execute(Scuola.__table__.insert(), [
+            {'codice_meccanografico': f'VR{i:08d}', 'nome': f'Istituto {i}', 'email': f'scuola{i}@scuola.it',
+             'numero_telefonico': '+39 045 000000', 'via': 'Via Roma', 'numero_civico': 1 + i,
+             'comune': f'Comune {i % 40}', 'dirigente': f'dirigente{i}@scuola.it'} for i in range(scuole)])
+        conn.execute(IndirizzoScolastico.__table__.insert(), [
+            {'codice_meccanografico': f'VR{i:08d}', 'indirizzo': ind, 'referente': f'dirigente{i}@scuola.it'}
+            for i in range(scuole) for ind in indirizzi])
+
+        righe_attivita, righe_collabora, righe_partecipa = [], [], []
+        for id_attivita in range(1, attivita + 1):
+            giorno = inizio + timedelta(days=casuale.randrange(6 * 365))
+            organizzatrice = casuale.choice(nomi[1:])
+            righe_attivita.append({
+                'id_attivita': id_attivita, 'nome': f'Attività {id_attivita % 500}', 'data_inizio': giorno,
+                'data_fine': giorno, 'totale_ore': casuale.randint(1, 8), 'struttura_organizzante': organizzatrice,
+                'docente_presidente': f'docente{casuale.randrange(200)}@univr.it'})
+            # Da zero a tre collaboratori, come nei dati reali
+            for nome in casuale.sample([n for n in nomi if n != organizzatrice], casuale.choice((0, 0, 1, 2, 3))):
+                righe_collabora.append({'id_attivita': id_attivita, 'nome_struttura': nome})
+            for scuola in casuale.sample(range(scuole), casuale.randint(0, 3)):
+                maschi, femmine, altro = casuale.randint(1, 20), casuale.randint(1, 20), 1
+                righe_partecipa.append({
+                    'id_attivita': id_attivita, 'data_inizio': giorno, 'codice_meccanografico': f'VR{scuola:08d}',
+                    'indirizzo': casuale.choice(indirizzi), 'totale_studenti': maschi + femmine + altro,
+                    'totale_maschi': maschi, 'totale_femmine': femmine, 'altro': altro, 'classi': '4A'})
+        for tabella, righe in ((AttivitaOrientamento, righe_attivita), (Collabora, righe_collabora),
+                               (Partecipa, righe_partecipa)):
+            for i in range(0, len(righe), 5000):
+                conn.execute(tabella.__table__.insert(), righe[i:i + 5000])
+    return nomi
+
+
+def utente(engine, email='docente0@univr.it', password='benchmark'):
+    """Utente dell'Ufficio Orientamento per il login dei benchmark sulle rotte."""
+    from bcrypt import hashpw, gensalt
+    from database.models import UtenteApplicazione
+
+    with engine.begin() as conn:
+        conn.execute(UtenteApplicazione.__table__.insert(), {
+            'email': email, 'password': hashpw(password.encode(), gensalt(4)).decode(),
+            'ruolo': 'Ufficio Orientamento', 'struttura_afferita': 'Ateneo di Verona'})
+    return email, password
+
+
+def misura(funzione, ripetizioni):
+    """Tempi in millisecondi di `ripetizioni` chiamate: (mediana, 95° percentile)."""
+    import time
+    tempi = []
+    for _ in range(ripetizioni):
+        t = time.perf_counter()
+        funzione()
+        tempi.append((time.perf_counter() - t) * 1000)
+    tempi.sort()
+    return tempi[len(tempi) // 2], tempi[min(len(tempi) - 1, int(len(tempi) * 0.95))]
@@ -0,0 +1,266 @@
+import click
+from flask.cli import AppGroup
+
+from database.db_connection import Database
+from database.schema import aggiorna_schema
+
+
+db_cli = AppGroup('db', help="Gestione dello schema del database.")
+
+
+@db_cli.command('aggiorna')
+def db_aggiorna():
+    """Crea tabelle e indici mancanti (idempotente)."""
+    aggiorna_schema(Database().engine)
+    click.echo("Schema aggiornato.")
+
+
+@db_cli.command('partiziona')
+@click.option('--anni-futuri', default=1, show_default=True, help="Anni dopo quello corrente da preparare.")
+def db_partiziona(anni_futuri):
+    """Partiziona attività e partecipazioni per anno (solo PostgreSQL 15+); rieseguire ogni anno."""
+    from database import partizioni
+
+    try:
+        with Database().engine.begin() as conn:
+            create, saltati = partizioni.partiziona(conn, anni_futuri)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    for nome in create:
+        click.echo(f"Creata la partizione {nome}.")
+    for anno in saltati:
+        click.echo(f"Anno {anno} già presente nella partizione predefinita: partizione non creata.")
+    if not create and not saltati:
+        click.echo("Partizioni già presenti.")
+
+
+@db_cli.command('query-lente')
+@click.option('--limite', default=20, show_default=True, help="Numero di query da mostrare.")
+@click.option('--rotta', help="Solo le query delle rotte che contengono il testo.")
+@click.option('--piano', is_flag=True, help="Mostra anche il piano di esecuzione.")
+@click.option('--pulisci', type=int, metavar='GIORNI', help="Elimina le voci più vecchie di GIORNI giorni.")
+def db_query_lente(limite, rotta, piano, pulisci):
+    """Query lente registrate (tabella query_lenta), dalla più lenta."""
+    from datetime import datetime, timedelta
+    from sqlalchemy import select, delete
+    from database.models import QueryLenta
+
+    with Database().session_factory() as session_db:
+        if pulisci is not None:
+            eliminate = session_db.execute(
+                delete(QueryLenta).where(QueryLenta.istante < datetime.now() - timedelta(days=pulisci))).rowcount
+            session_db.commit()
+            click.echo(f"{eliminate} voci eliminate.")
+            return
+
+        stmt = select(QueryLenta).order_by(QueryLenta.durata_ms.desc()).limit(limite)
+        if rotta:
+            stmt = stmt.where(QueryLenta.rotta.contains(rotta))
+        for q in session_db.execute(stmt).scalars():
+            click.echo(f"{q.istante:%Y-%m-%d %H:%M:%S}  {q.durata_ms} ms  {q.rotta}")
+            click.echo(f"  {' '.join(q.statement.split())[:300]}")
+            click.echo(f"  parametri: {q.parametri}")
+            if piano and q.piano:
+                click.echo('\n'.join('    ' + riga for riga in q.piano.splitlines()))
+
+
+kpi_cli = AppGroup('kpi', help="Contatori KPI del resoconto.")
+
+
+@kpi_cli.command('verifica')
+@click.option('--ricostruisci', is_flag=True, help="Ricalcola la tabella dei contatori se ci sono differenze.")
+def kpi_verifica(ricostruisci):
+    """Confronta i contatori KPI con un ricalcolo completo dalle tabelle."""
+    from database import counters
+
+    with Database().engine.begin() as conn:
+        diff = counters.differenze(conn)
+        for struttura, anno, atteso, salvato in diff:
+            click.echo(f"{struttura} {anno}: atteso {atteso}, salvato {salvato}")
+        if not diff:
+            click.echo("Contatori KPI coerenti.")
+            return
+        if ricostruisci:
+            counters.ricostruisci(conn)
+            click.echo(f"Contatori ricostruiti ({len(diff)} righe differenti).")
+        else:
+            raise click.ClickException(f"{len(diff)} righe differenti (usare --ricostruisci).")
+
+
+anno_cli = AppGroup('anno', help="Snapshot degli anni chiusi per la reportistica.")
+
+
+@anno_cli.command('chiudi')
+@click.argument('anno', type=int)
+@click.option('--ricostruisci', is_flag=True, help="Rigenera lo snapshot se l'anno è già chiuso.")
+def anno_chiudi(anno, ricostruisci):
+    """Congela resoconto ed export dell'anno in uno snapshot su disco."""
+    from services import snapshot
+
+    session_db = Database().session_factory()
+    try:
+        dati = snapshot.chiudi_anno(session_db, anno, ricostruisci=ricostruisci)
+    except (ValueError, FileExistsError) as e:
+        raise click.ClickException(str(e))
+    finally:
+        session_db.close()
+    click.echo(f"Anno {anno} chiuso: {len(dati['resoconto'])} strutture, {len(dati['export'])} righe di export.")
+
+
+@anno_cli.command('riapri')
+@click.argument('anno', type=int)
+def anno_riapri(anno):
+    """Elimina lo snapshot: l'anno torna a essere calcolato dalle tabelle."""
+    from services import snapshot
+
+    if not snapshot.riapri_anno(anno):
+        raise click.ClickException(f"L'anno {anno} non è chiuso.")
+    click.echo(f"Anno {anno} riaperto.")
+
+
+@anno_cli.command('elenco')
+def anno_elenco():
+    """Elenca gli anni chiusi."""
+    from services import snapshot
+
+    for anno in snapshot.anni_chiusi():
+        click.echo(anno)
+
+
+export_cli = AppGroup('export', help="Export del report delle attività.")
+
+
+@export_cli.command('xlsx')
+@click.argument('file', type=click.Path(dir_okay=False, writable=True))
+@click.option('--anno', type=int, help="Solo le attività iniziate nell'anno.")
+def export_xlsx_cmd(file, anno):
+    """Scrive il report in FILE (XLSX) e riporta righe al secondo e memoria massima."""
+    import resource
+    import time
+    from services import export_xlsx
+    from services.export import righe_export
+
+    if not export_xlsx.xlsx_disponibile():
+        raise click.ClickException("Il pacchetto xlsxwriter non è installato.")
+
+    session_db = Database().session_factory()
+    try:
+        inizio = time.perf_counter()
+        righe = export_xlsx.scrivi_export(righe_export(session_db, anno), file)
+        durata = time.perf_counter() - inizio
+    finally:
+        session_db.close()
+    picco_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    click.echo(f"{righe} righe in {durata:.2f} s ({righe / durata:.0f} righe/s), memoria massima {picco_mb:.0f} MB.")
+
+
+
+def _righe_csv(file):
+    """Numero di record del CSV (intestazione esclusa), per i benchmark."""
+    import csv
+    with open(file, newline='', encoding='utf-8-sig') as f:
+        return max(sum(1 for _ in csv.reader(f, delimiter=';')) - 1, 0)
+
+
+@export_cli.command('csv')
+@click.argument('file', type=click.Path(dir_okay=False, writable=True))
+@click.option('--anno', type=int, help="Solo le attività iniziate nell'anno.")
+def export_csv_cmd(file, anno):
+    """Scrive il report in FILE (CSV) come l'export web e riporta righe al secondo."""
+    import time
+    from database.bulk import copy_disponibile
+    from services.export import stream_export_csv
+
+    session_db = Database().session_factory()
+    try:
+        inizio = time.perf_counter()
+        with open(file, 'wb') as f:
+            for blocco in stream_export_csv(session_db, anno):
+                f.write(blocco)
+        durata = time.perf_counter() - inizio
+        metodo = 'COPY' if copy_disponibile(session_db) else 'SQL a lotti'
+    finally:
+        session_db.close()
+    righe = _righe_csv(file)
+    click.echo(f"{righe} righe in {durata:.2f} s ({righe / durata:.0f} righe/s, {metodo}).")
+
+
+import_cli = AppGroup('importa', help="Import massivi da CSV.")
+
+
+@import_cli.command('partecipazioni')
+@click.argument('file', type=click.Path(exists=True, dir_okay=False))
+def importa_partecipazioni_cmd(file):
+    """Importa le partecipazioni da FILE (CSV, vedi services.importa) e riporta righe al secondo."""
+    import time
+    from database.bulk import copy_disponibile
+    from services.importa import importa_partecipazioni
+
+    session_db = Database().session_factory()
+    try:
+        inizio = time.perf_counter()
+        with open(file, 'rb') as f:
+            righe = importa_partecipazioni(session_db, f)
+        session_db.commit()
+        durata = time.perf_counter() - inizio
+        metodo = 'COPY' if copy_disponibile(session_db) else 'SQL a lotti'
+    except Exception as e:
+        session_db.rollback()
+        raise click.ClickException(str(e))
+    finally:
+        session_db.close()
+    click.echo(f"{righe} righe in {durata:.2f} s ({righe / durata:.0f} righe/s, {metodo}).")
+
+
+report_cli = AppGroup('report', help="Resoconti stampabili delle attività.")
+
+
+@report_cli.command('pdf')
+@click.argument('struttura')
+@click.argument('anno', type=int)
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True),
+              help="File zip di destinazione (default: resoconti_<struttura>_<anno>.zip).")
+@click.option('--processi', '-p', type=click.IntRange(min=1), help="Processi di conversione (default: CPU).")
+def report_pdf(struttura, anno, output, processi):
+    """Un PDF del resoconto per ogni attività della STRUTTURA iniziata nell'ANNO, in uno zip."""
+    import time
+    from flask import current_app
+    from database.models import Struttura
+    from services import report_pdf as pdf
+
+    if not pdf.pdf_disponibile():
+        raise click.ClickException("WeasyPrint non è installato (o mancano le librerie Pango).")
+    output = output or f"resoconti_{pdf.nome_sicuro(struttura)}_{anno}.zip"
+
+    session_db = Database().session_factory()
+    barra = None
+
+    def avanzamento(totale, fatti):
+        nonlocal barra
+        if barra is None:
+            barra = click.progressbar(length=totale, label=f"{struttura} {anno}", show_pos=True)
+            barra.__enter__()
+        else:
+            barra.update(1)
+
+    try:
+        if session_db.get(Struttura, struttura) is None:
+            raise click.ClickException(f"Struttura sconosciuta: {struttura}")
+        inizio = time.perf_counter()
+        n = pdf.genera_zip(current_app._get_current_object(), session_db, struttura, anno, output,
+                           processi=processi, avanzamento=avanzamento)
+        durata = time.perf_counter() - inizio
+    finally:
+        if barra is not None:
+            barra.__exit__(None, None, None)
+        session_db.close()
+    click.echo(f"{n} PDF in {output} ({durata:.1f} s).")
+
+def registra_comandi(app):
+    """Registra i comandi `flask ...` dell'applicazione."""
+    app.cli.add_command(db_cli)
+    app.cli.add_command(kpi_cli)
+    app.cli.add_command(anno_cli)
+    app.cli.add_command(export_cli)
+    app.cli.add_command(import_cli)
+    app.cli.add_command(report_cli)
@@ -0,0 +1,52 @@
+import os
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database.db_connection import DATABASE_URL
+
+
+def _async_url(url):
+    """Deriva l'URL asincrono da quello sincrono (psycopg2 -> asyncpg, sqlite -> aiosqlite)."""
+    if url.startswith('postgresql'):
+        return 'postgresql+asyncpg://' + url.split('://', 1)[1]
+    if url.startswith('sqlite'):
+        return 'sqlite+aiosqlite://' + url.split('://', 1)[1]
+    return url
+
+
+ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL', _async_url(DATABASE_URL))
+
+
+class AsyncDatabase:
+    """
+    Singleton con l'engine asincrono usato dalle API JSON servite via ASGI.
+    Il pool è volutamente piccolo: le richieste concorrenti attendono la
+    connessione sull'event loop invece di occupare un worker ciascuna.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(AsyncDatabase, cls).__new__(cls)
+
+            engine_args = {'echo': False, 'pool_pre_ping': True}
+            if not ASYNC_DATABASE_URL.startswith('sqlite'):
+                engine_args['pool_size'] = int(os.environ.get('ASYNC_DB_POOL_SIZE', 5))
+                engine_args['max_overflow'] = int(os.environ.get('ASYNC_DB_MAX_OVERFLOW', 0))
+
+            cls._instance.engine = create_async_engine(ASYNC_DATABASE_URL, **engine_args)
+            cls._instance.session_factory = async_sessionmaker(
+                bind=cls._instance.engine,
+                autoflush=False,
+                expire_on_commit=False,
+            )
+
+        return cls._instance
+
+    async def execute_all(self, stmt, params=None):
+        """Esegue uno statement di sola lettura e restituisce tutte le righe."""
+        async with self.session_factory() as session:
+            return (await session.execute(stmt, params)).all()
+
+    async def dispose(self):
+        await self.engine.dispose()
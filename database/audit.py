@@ -0,0 +1,159 @@
+"""
+Registro delle modifiche (append-only).
+
+Gli eventi della Session raccolgono INSERT, UPDATE e DELETE sulle entità
+anagrafiche e sulle attività durante i flush (compresi i DELETE massivi di
+query(...).delete(), letti prima dell'esecuzione) e li scrivono in
+`registro_modifiche` con un'unica INSERT multi-riga in `before_commit`:
+stessa transazione dei dati, nessuna riga se la transazione viene annullata.
+
+L'utente viene letto da `session.info['utente']`, impostato per ogni
+richiesta da `login_required`; i comandi CLI scrivono con utente vuoto.
+"""
+import json
+from datetime import date, datetime
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from database.models import (
+    AttivitaOrientamento, Supervisiona, Collabora, Partecipa, Scuola, IndirizzoScolastico,
+    PersonaleScolastico, PersonaleUniversitario, UtenteApplicazione, RegistroModifica
+)
+
+
+ENTITA_REGISTRATE = (
+    AttivitaOrientamento, Supervisiona, Collabora, Partecipa, Scuola, IndirizzoScolastico,
+    PersonaleScolastico, PersonaleUniversitario, UtenteApplicazione
+)
+
+# Colonne mai copiate nel registro
+_ESCLUSE = {'password'}
+
+
+def _valore(v):
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    if v is None or isinstance(v, (int, float, str, bool)):
+        return v
+    return str(v)
+
+
+def _chiave(mapper, valori):
+    return '|'.join(str(valori[mapper.get_property_by_column(c).key]) for c in mapper.primary_key)
+
+
+def _colonne(mapper):
+    return [c for c in mapper.column_attrs if c.key not in _ESCLUSE]
+
+
+def _voci(session):
+    return session.info.setdefault('registro_modifiche', [])
+
+
+def _voce(session, entita, chiave, operazione, valori):
+    _voci(session).append({
+        'istante': datetime.now(),
+        'utente': session.info.get('utente'),
+        'entita': entita,
+        'chiave': chiave,
+        'operazione': operazione,
+        'valori': json.dumps(valori, ensure_ascii=False, sort_keys=True),
+    })
+
+
+def registra(session, entita, chiave, operazione, valori):
+    """
+    Voce esplicita per le modifiche che non passano dalla unit of work (es. un
+    import massivo registrato con una sola voce riassuntiva).
+    """
+    _voce(session, entita, chiave, operazione, valori)
+
+
+@event.listens_for(Session, 'after_flush')
+def _registra_flush(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, ENTITA_REGISTRATE):
+            mapper = inspect(obj).mapper
+            valori = {c.key: _valore(getattr(obj, c.key)) for c in _colonne(mapper)}
+            _voce(session, mapper.local_table.name, _chiave(mapper, valori), 'INSERT', valori)
+
+    for obj in session.dirty:
+        if not isinstance(obj, ENTITA_REGISTRATE):
+            continue
+        stato = inspect(obj)
+        modifiche = {}
+        for colonna in _colonne(stato.mapper):
+            storia = stato.attrs[colonna.key].history
+            if storia.added or storia.deleted:
+                prima = _valore(storia.deleted[0]) if storia.deleted else None
+                dopo = _valore(storia.added[0]) if storia.added else None
+                if prima != dopo:
+                    modifiche[colonna.key] = [prima, dopo]
+        if modifiche:
+            valori = {c.key: getattr(obj, c.key) for c in _colonne(stato.mapper)}
+            _voce(session, stato.mapper.local_table.name, _chiave(stato.mapper, valori), 'UPDATE', modifiche)
+
+    for obj in session.deleted:
+        if isinstance(obj, ENTITA_REGISTRATE):
+            mapper = inspect(obj).mapper
+            valori = {c.key: _valore(getattr(obj, c.key)) for c in _colonne(mapper)}
+            _voce(session, mapper.local_table.name, _chiave(mapper, valori), 'DELETE', valori)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _registra_bulk(orm_execute_state):
+    """DELETE massivi: le righe colpite vengono lette prima dell'esecuzione."""
+    if not orm_execute_state.is_delete:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or not issubclass(mapper.class_, ENTITA_REGISTRATE):
+        return
+
+    colonne = _colonne(mapper)
+    stmt = select(*[c.expression for c in colonne])
+    if orm_execute_state.statement.whereclause is not None:
+        stmt = stmt.where(orm_execute_state.statement.whereclause)
+    for riga in orm_execute_state.session.execute(stmt):
+        valori = {c.key: _valore(v) for c, v in zip(colonne, riga)}
+        _voce(orm_execute_state.session, mapper.local_table.name, _chiave(mapper, valori), 'DELETE', valori)
+
+
+@event.listens_for(Session, 'before_commit')
+def _scrivi_registro(session):
+    # before_commit precede l'autoflush del commit: il flush esplicito fa
+    # arrivare prima in after_flush le modifiche ancora pendenti
+    session.flush()
+    voci = session.info.pop('registro_modifiche', None)
+    if not voci:
+        return
+    session.connection().execute(RegistroModifica.__table__.insert(), voci)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _scarta_registro(session):
+    session.info.pop('registro_modifiche', None)
+
+
+def cerca_modifiche(session_db, entita=None, chiave=None, dal=None, al=None, limite=200):
+    """
+    Voci del registro dalla più recente, filtrate per entità (nome tabella),
+    chiave primaria (valori separati da '|') e intervallo [dal, al).
+    """
+    stmt = select(RegistroModifica).order_by(RegistroModifica.istante.desc(), RegistroModifica.id.desc())
+    if entita:
+        stmt = stmt.where(RegistroModifica.entita == entita)
+    if chiave:
+        stmt = stmt.where(RegistroModifica.chiave == chiave)
+    if dal:
+        stmt = stmt.where(RegistroModifica.istante >= dal)
+    if al:
+        stmt = stmt.where(RegistroModifica.istante < al)
+    return [{
+        'istante': r.istante.isoformat(timespec='seconds'),
+        'utente': r.utente,
+        'entita': r.entita,
+        'chiave': r.chiave,
+        'operazione': r.operazione,
+        'valori': json.loads(r.valori) if r.valori else None,
+    } for r in session_db.execute(stmt.limit(limite)).scalars()]
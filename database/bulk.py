@@ -0,0 +1,111 @@
+"""
+COPY di PostgreSQL per export e import massivi.
+
+`COPY ... TO STDOUT` e `COPY ... FROM STDIN` trasferiscono le righe in un
+unico flusso, senza il costo per riga di driver e ORM. Le funzioni usano
+`copy_expert` di psycopg2; gli altri database (SQLite in sviluppo) passano
+dai percorsi SQL a lotti dei chiamanti, vedi `copy_disponibile`.
+"""
+import queue
+import threading
+
+from sqlalchemy import exc
+from sqlalchemy.dialects import postgresql
+
+from database.db_connection import Database
+
+
+def copy_disponibile(bind):
+    """True se `bind` (engine, connessione o sessione) è PostgreSQL con psycopg2."""
+    if hasattr(bind, 'get_bind'):
+        bind = bind.get_bind()
+    return bind.dialect.name == 'postgresql' and bind.dialect.driver == 'psycopg2'
+
+
+def compila(stmt):
+    """SQL di uno statement Core con i parametri inclusi (COPY non accetta parametri legati)."""
+    return str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+
+
+def _accoda(coda, elemento, annullato):
+    """put() che si arrende quando il lettore ha smesso di consumare (es. client disconnesso)."""
+    while True:
+        try:
+            coda.put(elemento, timeout=1)
+            return True
+        except queue.Full:
+            if annullato.is_set():
+                return False
+
+
+class _ScritturaCoda:
+    """File in sola scrittura che passa i blocchi ricevuti da COPY a una coda limitata."""
+
+    def __init__(self, coda, annullato):
+        self.coda = coda
+        self.annullato = annullato
+
+    def write(self, dati):
+        if isinstance(dati, str):
+            dati = dati.encode('utf-8')
+        if not _accoda(self.coda, bytes(dati), self.annullato):
+            raise IOError("Lettura del COPY interrotta")
+        return len(dati)
+
+
+def stream_copy_to(sql, max_blocchi=64):
+    """
+    Generatore dei blocchi di byte prodotti da `COPY (<sql>) TO STDOUT ...`.
+
+    COPY gira in un thread su una connessione propria del pool e scrive in
+    una coda limitata a `max_blocchi` blocchi: il client HTTP detta il ritmo
+    e la memoria resta costante. Chiudere il generatore (fine della risposta
+    o disconnessione) interrompe COPY e restituisce la connessione al pool.
+    """
+    coda = queue.Queue(maxsize=max_blocchi)
+    annullato = threading.Event()
+    fine = object()
+    errori = []
+
+    def produci():
+        raw = Database().engine.raw_connection()
+        try:
+            with raw.cursor() as cursor:
+                cursor.copy_expert(sql, _ScritturaCoda(coda, annullato))
+            raw.commit()
+        except Exception as e:
+            errori.append(e)
+        finally:
+            raw.close()
+            _accoda(coda, fine, annullato)
+
+    threading.Thread(target=produci, name='copy-to', daemon=True).start()
+    try:
+        while True:
+            blocco = coda.get()
+            if blocco is fine:
+                break
+            yield blocco
+        if errori:
+            raise errori[0]
+    finally:
+        annullato.set()
+
+
+def copy_from(session_db, sql, file):
+    """
+    Esegue `COPY ... FROM STDIN` leggendo da `file` (qualsiasi oggetto con
+    read(), es. il corpo della richiesta) sulla connessione della sessione,
+    quindi nella sua transazione. Restituisce il numero di righe caricate.
+    Gli errori del driver diventano le eccezioni di SQLAlchemy corrispondenti
+    (DataError, IntegrityError, ...), come per gli altri statement.
+    """
+    connessione = session_db.connection()
+    dbapi = connessione.dialect.dbapi
+    raw = connessione.connection.driver_connection
+    try:
+        with raw.cursor() as cursor:
+            cursor.copy_expert(sql, file)
+            return cursor.rowcount
+    except dbapi.Error as e:
+        raise exc.DBAPIError.instance(sql, None, e, dbapi.Error) from e
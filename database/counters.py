@@ -0,0 +1,478 @@
+"""
+Contatori KPI incrementali per il resoconto.
+
+La tabella `kpi_contatore` contiene, per ogni coppia (struttura, anno di
+inizio), il numero di attività visibili alla struttura, le ore erogate e gli
+studenti coinvolti. La riga con struttura = ATENEO aggrega tutte le attività.
+Così l'intestazione del resoconto legge poche righe invece di ricalcolare
+COUNT/SUM su attività e partecipazioni a ogni richiesta.
+
+Manutenzione incrementale: ogni modifica applica alle sole righe toccate
+il delta (+/-) del contributo delle attività coinvolte, con UPDATE ... SET
+attivita = attivita + ... nell'ordine (struttura, anno), così due modifiche
+concorrenti bloccano le righe nello stesso ordine. Il contributo di
+un'attività è una riga per struttura visibile con (1, ore, studenti).
+- PostgreSQL: trigger di riga su attività e collaborazioni, trigger di
+  istruzione su `partecipa` che leggono le tabelle di transizione (un import
+  massivo applica un solo delta per struttura e anno).
+- Altri database (es. SQLite in sviluppo): il contributo delle attività
+  toccate viene letto prima della prima modifica (eventi della Session) e
+  confrontato al commit con quello finale.
+
+Il ricalcolo completo (`ricostruisci`) resta per popolare una tabella vuota
+e per `flask kpi verifica --ricostruisci`.
+"""
+from sqlalchemy import select, union, literal, func, event, extract, inspect
+from sqlalchemy.orm import Session
+
+from database.models import AttivitaOrientamento, Collabora, Partecipa, KpiContatore
+from database.visibility import ATENEO
+
+
+_COLONNE = ['struttura', 'anno', 'attivita', 'ore', 'studenti']
+
+
+def _select_contatori(anno, *filtri, raggruppa=()):
+    """
+    SELECT (struttura, anno, attivita, ore, studenti) sulle attività che
+    rispettano `filtri`. Ogni attività conta per la struttura organizzante,
+    per le strutture collaboratrici e per l'Ateneo (UNION: una volta sola
+    anche se la stessa struttura compare in più ruoli).
+    """
+    visibilita = union(
+        select(AttivitaOrientamento.id_attivita,
+               AttivitaOrientamento.struttura_organizzante.label('struttura')),
+        select(Collabora.id_attivita, Collabora.nome_struttura),
+        select(AttivitaOrientamento.id_attivita, literal(ATENEO)),
+    ).subquery()
+    studenti = (
+        select(Partecipa.id_attivita, func.sum(Partecipa.totale_studenti).label('studenti'))
+        .group_by(Partecipa.id_attivita)
+        .subquery()
+    )
+    return (
+        select(
+            visibilita.c.struttura,
+            anno.label('anno'),
+            func.count().label('attivita'),
+            func.coalesce(func.sum(AttivitaOrientamento.totale_ore), 0).label('ore'),
+            func.coalesce(func.sum(studenti.c.studenti), 0).label('studenti'),
+        )
+        .select_from(visibilita)
+        .join(AttivitaOrientamento, AttivitaOrientamento.id_attivita == visibilita.c.id_attivita)
+        .outerjoin(studenti, studenti.c.id_attivita == AttivitaOrientamento.id_attivita)
+        .where(*filtri)
+        .group_by(visibilita.c.struttura, *raggruppa)
+    )
+
+
+def _select_tutti():
+    anno = extract('year', AttivitaOrientamento.data_inizio)
+    return _select_contatori(anno, raggruppa=(anno,))
+
+
+def _contributo(connection, ids):
+    """Contributo complessivo delle attività `ids` (quelle esistenti): {(struttura, anno): [attivita, ore, studenti]}."""
+    anno = extract('year', AttivitaOrientamento.data_inizio)
+    stmt = _select_contatori(anno, AttivitaOrientamento.id_attivita.in_(sorted(ids)), raggruppa=(anno,))
+    return {(r.struttura, int(r.anno)): [r.attivita, r.ore, r.studenti]
+            for r in connection.execute(stmt) if r.anno is not None}
+
+
+def _applica_delta(connection, delta):
+    """
+    Somma `delta` {(struttura, anno): (attivita, ore, studenti)} ai contatori,
+    in ordine di chiave; le righe che restano senza attività vengono rimosse.
+    """
+    tabella = KpiContatore.__table__
+    for (struttura, anno), (attivita, ore, studenti) in sorted(delta.items()):
+        if not (attivita or ore or studenti):
+            continue
+        chiave = (tabella.c.struttura == struttura) & (tabella.c.anno == anno)
+        aggiornate = connection.execute(tabella.update().where(chiave).values(
+            attivita=tabella.c.attivita + attivita, ore=tabella.c.ore + ore,
+            studenti=tabella.c.studenti + studenti)).rowcount
+        if not aggiornate:
+            connection.execute(tabella.insert().values(
+                struttura=struttura, anno=anno, attivita=attivita, ore=ore, studenti=studenti))
+        connection.execute(tabella.delete().where(chiave, tabella.c.attivita == 0))
+
+
+def ricostruisci(connection):
+    """Ricalcola da zero l'intera tabella dei contatori."""
+    tabella = KpiContatore.__table__
+    connection.execute(tabella.delete())
+    connection.execute(tabella.insert().from_select(_COLONNE, _select_tutti()))
+
+
+def differenze(connection):
+    """
+    Confronta i contatori salvati con quelli ricalcolati dalle tabelle.
+    Restituisce [(struttura, anno, atteso, salvato)] dove atteso/salvato sono
+    tuple (attivita, ore, studenti) oppure None se la riga manca.
+    """
+    attesi = {(r.struttura, int(r.anno)): (r.attivita, r.ore, r.studenti)
+              for r in connection.execute(_select_tutti())}
+    salvati = {(r.struttura, r.anno): (r.attivita, r.ore, r.studenti)
+               for r in connection.execute(select(KpiContatore.__table__))}
+    return [(chiave[0], chiave[1], attesi.get(chiave), salvati.get(chiave))
+            for chiave in sorted(attesi.keys() | salvati.keys())
+            if attesi.get(chiave) != salvati.get(chiave)]
+
+
+def leggi_contatori(session_db, struttura, anno=None, *altre):
+    """
+    KPI (attivita, ore, studenti) di una struttura, per un anno o sull'intero
+    storico se `anno` è None. Le espressioni scalari in `altre` (es. una
+    sottoquery di conteggio) vengono lette nella stessa query, quindi sulla
+    stessa fotografia dei dati, e aggiunte in coda alla tupla.
+    """
+    stmt = select(
+        func.coalesce(func.sum(KpiContatore.attivita), 0),
+        func.coalesce(func.sum(KpiContatore.ore), 0),
+        func.coalesce(func.sum(KpiContatore.studenti), 0),
+        *altre,
+    ).where(KpiContatore.struttura == struttura)
+    if anno is not None:
+        stmt = stmt.where(KpiContatore.anno == anno)
+    return tuple(session_db.execute(stmt).one())
+
+
+def anni_disponibili(session_db):
+    """Anni con almeno un'attività (righe dell'Ateneo), dal più recente."""
+    return list(session_db.execute(
+        select(KpiContatore.anno).where(KpiContatore.struttura == ATENEO).order_by(KpiContatore.anno.desc())
+    ).scalars())
+
+
+# ------------------------------------------------------------------------------
+# PostgreSQL: trigger
+# ------------------------------------------------------------------------------
+
+def _applica(delta):
+    """
+    Ciclo plpgsql che somma ai contatori le righe di `delta` (struttura, anno,
+    attivita, ore, studenti), raggruppate e in ordine di chiave. La funzione
+    che lo contiene deve dichiarare `r record`.
+    """
+    return f"""
+        FOR r IN SELECT struttura, anno, sum(attivita)::integer AS attivita, sum(ore)::integer AS ore,
+                        sum(studenti)::integer AS studenti
+                 FROM ({delta}) AS delta (struttura, anno, attivita, ore, studenti)
+                 WHERE struttura IS NOT NULL AND anno IS NOT NULL
+                 GROUP BY struttura, anno
+                 HAVING sum(attivita) <> 0 OR sum(ore) <> 0 OR sum(studenti) <> 0
+                 ORDER BY struttura, anno LOOP
+            PERFORM kpi_somma(r.struttura, r.anno, r.attivita, r.ore, r.studenti);
+        END LOOP;"""
+
+
+def _contributo_riga(riga, segno, figli=None):
+    """Contributo dell'attività nel record `riga` (OLD o NEW di attivita_orientamento), con segno.
+
+    Collaborazioni e partecipazioni sono quelle dell'id del record `figli` (di default `riga`).
+    """
+    return f"""
+        SELECT struttura, anno, {segno} * attivita, {segno} * ore, {segno} * studenti
+        FROM kpi_contributo({figli or riga}.id_attivita, {riga}.data_inizio,
+                            {riga}.struttura_organizzante, {riga}.totale_ore)"""
+
+
+def _collaborazione(riga, segno):
+    """Contributo aggiunto da una collaborazione (OLD o NEW di collabora) a un'attività esistente."""
+    return f"""
+        SELECT {riga}.nome_struttura, extract(year FROM a.data_inizio)::integer, {segno},
+               {segno} * coalesce(a.totale_ore, 0), {segno} * kpi_studenti(a.id_attivita)
+        FROM attivita_orientamento a
+        WHERE a.id_attivita = {riga}.id_attivita
+          AND {riga}.nome_struttura NOT IN (a.struttura_organizzante, {_ATENEO_SQL})"""
+
+
+def _studenti_cambiati(righe):
+    """Delta degli studenti per ogni struttura delle attività (esistenti) in `righe` (id_attivita, studenti)."""
+    return f"""
+        SELECT s.struttura, extract(year FROM a.data_inizio)::integer, 0, 0, d.studenti
+        FROM (SELECT id_attivita, sum(studenti) AS studenti FROM ({righe}) AS righe
+              GROUP BY id_attivita) AS d
+        JOIN attivita_orientamento a USING (id_attivita)
+        CROSS JOIN LATERAL kpi_strutture(a.id_attivita, a.struttura_organizzante) AS s(struttura)"""
+
+
+_ATENEO_SQL = "'" + ATENEO.replace("'", "''") + "'"
+_NUOVE = "SELECT id_attivita, coalesce(totale_studenti, 0) AS studenti FROM nuove"
+_VECCHIE = "SELECT id_attivita, -coalesce(totale_studenti, 0) AS studenti FROM vecchie"
+
+# Oggetti della versione precedente (ricalcolo per anno al commit), rimossi all'aggiornamento
+_DDL_RIMOSSI = [
+    "DROP TRIGGER IF EXISTS kpi_ricalcolo ON kpi_anno_da_ricalcolare",
+    "DROP TRIGGER IF EXISTS kpi_partecipa ON partecipa",
+    "DROP TABLE IF EXISTS kpi_anno_da_ricalcolare",
+    "DROP FUNCTION IF EXISTS kpi_trg_ricalcola()",
+    "DROP FUNCTION IF EXISTS kpi_trg_dipendenti()",
+    "DROP FUNCTION IF EXISTS kpi_segna_anno(date)",
+    "DROP FUNCTION IF EXISTS kpi_ricalcola_anno(integer)",
+]
+
+
+def _ddl_trigger():
+    return _DDL_RIMOSSI + [
+        f"""
+        CREATE OR REPLACE FUNCTION kpi_strutture(p_id integer, p_organizzante varchar) RETURNS SETOF varchar AS $$
+            SELECT p_organizzante WHERE p_organizzante IS NOT NULL
+            UNION SELECT {_ATENEO_SQL}
+            UNION SELECT nome_struttura FROM collabora WHERE id_attivita = p_id
+        $$ LANGUAGE sql STABLE
+        """,
+        """
+        CREATE OR REPLACE FUNCTION kpi_studenti(p_id integer) RETURNS integer AS $$
+            SELECT coalesce(sum(totale_studenti), 0)::integer FROM partecipa WHERE id_attivita = p_id
+        $$ LANGUAGE sql STABLE
+        """,
+        """
+        CREATE OR REPLACE FUNCTION kpi_contributo(p_id integer, p_data date, p_organizzante varchar,
+                                                  p_ore integer)
+        RETURNS TABLE (struttura varchar, anno integer, attivita integer, ore integer, studenti integer) AS $$
+            SELECT s.struttura, extract(year FROM p_data)::integer, 1, coalesce(p_ore, 0),
+                   kpi_studenti(p_id)
+            FROM kpi_strutture(p_id, p_organizzante) AS s(struttura)
+            WHERE p_data IS NOT NULL
+        $$ LANGUAGE sql STABLE
+        """,
+        """
+        CREATE OR REPLACE FUNCTION kpi_somma(p_struttura varchar, p_anno integer, p_attivita integer,
+                                             p_ore integer, p_studenti integer) RETURNS void AS $$
+        DECLARE
+            v_attivita integer;
+        BEGIN
+            UPDATE kpi_contatore
+            SET attivita = attivita + p_attivita, ore = ore + p_ore, studenti = studenti + p_studenti
+            WHERE struttura = p_struttura AND anno = p_anno
+            RETURNING attivita INTO v_attivita;
+            IF NOT FOUND THEN
+                INSERT INTO kpi_contatore AS k (struttura, anno, attivita, ore, studenti)
+                VALUES (p_struttura, p_anno, p_attivita, p_ore, p_studenti)
+                ON CONFLICT (struttura, anno) DO UPDATE
+                SET attivita = k.attivita + EXCLUDED.attivita, ore = k.ore + EXCLUDED.ore,
+                    studenti = k.studenti + EXCLUDED.studenti
+                RETURNING k.attivita INTO v_attivita;
+            END IF;
+            IF v_attivita = 0 THEN
+                DELETE FROM kpi_contatore WHERE struttura = p_struttura AND anno = p_anno;
+            END IF;
+        END $$ LANGUAGE plpgsql
+        """,
+        # BEFORE DELETE, e BEFORE UPDATE che cambia id_attivita: le collaborazioni e
+        # le partecipazioni sono ancora legate al vecchio id. Le cancellazioni in
+        # cascata trovano poi l'attività già rimossa e non applicano altro; per un
+        # cambio di id il contributo nuovo si calcola qui con le righe figlie
+        # ancora al vecchio id, e i trigger delle righe spostate in cascata (che
+        # partono a cascate concluse) le ignorano.
+        f"""
+        CREATE OR REPLACE FUNCTION kpi_trg_attivita_prima() RETURNS trigger AS $$
+        DECLARE
+            r record;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                {_applica(_contributo_riga('OLD', -1))}
+                RETURN OLD;
+            END IF;
+            {_applica(_contributo_riga('OLD', -1) + ' UNION ALL ' + _contributo_riga('NEW', 1, figli='OLD'))}
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION kpi_trg_attivita() RETURNS trigger AS $$
+        DECLARE
+            r record;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {_applica(_contributo_riga('NEW', 1))}
+            ELSIF OLD.id_attivita = NEW.id_attivita THEN
+                {_applica(_contributo_riga('OLD', -1) + ' UNION ALL ' + _contributo_riga('NEW', 1))}
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION kpi_trg_collabora() RETURNS trigger AS $$
+        DECLARE
+            r record;
+        BEGIN
+            IF TG_OP = 'UPDATE' AND OLD.id_attivita <> NEW.id_attivita
+               AND NOT EXISTS (SELECT 1 FROM attivita_orientamento WHERE id_attivita = OLD.id_attivita) THEN
+                RETURN NULL;
+            END IF;
+            {_applica(_collaborazione('OLD', -1) + ' UNION ALL ' + _collaborazione('NEW', 1))}
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION kpi_trg_partecipa() RETURNS trigger AS $$
+        DECLARE
+            r record;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {_applica(_studenti_cambiati(_NUOVE))}
+            ELSIF TG_OP = 'DELETE' THEN
+                {_applica(_studenti_cambiati(_VECCHIE))}
+            ELSIF NOT EXISTS (SELECT 1 FROM vecchie v WHERE NOT EXISTS (
+                    SELECT 1 FROM attivita_orientamento a WHERE a.id_attivita = v.id_attivita)) THEN
+                {_applica(_studenti_cambiati(_NUOVE + ' UNION ALL ' + _VECCHIE))}
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS kpi_attivita ON attivita_orientamento",
+        "DROP TRIGGER IF EXISTS kpi_attivita_cancella ON attivita_orientamento",
+        "DROP TRIGGER IF EXISTS kpi_attivita_id ON attivita_orientamento",
+        """
+        CREATE TRIGGER kpi_attivita
+        AFTER INSERT OR UPDATE OF data_inizio, totale_ore, struttura_organizzante
+        ON attivita_orientamento FOR EACH ROW EXECUTE FUNCTION kpi_trg_attivita()
+        """,
+        """
+        CREATE TRIGGER kpi_attivita_cancella BEFORE DELETE
+        ON attivita_orientamento FOR EACH ROW EXECUTE FUNCTION kpi_trg_attivita_prima()
+        """,
+        """
+        CREATE TRIGGER kpi_attivita_id BEFORE UPDATE OF id_attivita ON attivita_orientamento
+        FOR EACH ROW WHEN (OLD.id_attivita <> NEW.id_attivita) EXECUTE FUNCTION kpi_trg_attivita_prima()
+        """,
+        "DROP TRIGGER IF EXISTS kpi_collabora ON collabora",
+        """
+        CREATE TRIGGER kpi_collabora AFTER INSERT OR DELETE OR UPDATE OF id_attivita, nome_struttura
+        ON collabora FOR EACH ROW EXECUTE FUNCTION kpi_trg_collabora()
+        """,
+        "DROP TRIGGER IF EXISTS kpi_partecipa_ins ON partecipa",
+        "DROP TRIGGER IF EXISTS kpi_partecipa_upd ON partecipa",
+        "DROP TRIGGER IF EXISTS kpi_partecipa_del ON partecipa",
+        """
+        CREATE TRIGGER kpi_partecipa_ins AFTER INSERT ON partecipa
+        REFERENCING NEW TABLE AS nuove FOR EACH STATEMENT EXECUTE FUNCTION kpi_trg_partecipa()
+        """,
+        """
+        CREATE TRIGGER kpi_partecipa_upd AFTER UPDATE ON partecipa
+        REFERENCING OLD TABLE AS vecchie NEW TABLE AS nuove FOR EACH STATEMENT EXECUTE FUNCTION kpi_trg_partecipa()
+        """,
+        """
+        CREATE TRIGGER kpi_partecipa_del AFTER DELETE ON partecipa
+        REFERENCING OLD TABLE AS vecchie FOR EACH STATEMENT EXECUTE FUNCTION kpi_trg_partecipa()
+        """,
+    ]
+
+
+def installa_trigger(connection):
+    """Installa (o aggiorna) funzioni e trigger PostgreSQL. Idempotente."""
+    if connection.dialect.name != 'postgresql':
+        return
+    for ddl in _ddl_trigger():
+        connection.exec_driver_sql(ddl)
+
+
+# ------------------------------------------------------------------------------
+# Altri database: manutenzione dagli eventi della Session
+# ------------------------------------------------------------------------------
+
+_ENTITA_KPI = (AttivitaOrientamento, Collabora, Partecipa)
+
+
+def _manutenzione_python(session):
+    bind = session.get_bind()
+    return bind.dialect.name != 'postgresql'
+
+
+def _pendenti(session):
+    """Contributo iniziale delle attività toccate nella transazione e i loro id."""
+    return session.info.setdefault('kpi_pendenti', ({}, set()))
+
+
+def _leggi_prima(session, ids):
+    """Legge il contributo delle attività `ids` non ancora toccate, prima che vengano modificate."""
+    prima, toccate = _pendenti(session)
+    nuove = set(ids) - toccate - {None}
+    if not nuove:
+        return
+    toccate.update(nuove)
+    for chiave, valori in _contributo(session.connection(), nuove).items():
+        prima[chiave] = [a + b for a, b in zip(prima.get(chiave, (0, 0, 0)), valori)]
+
+
+def segna_attivita(session, ids):
+    """
+    Attività che uno statement Core (es. import massivo) sta per modificare:
+    va chiamata prima dello statement, così il delta al commit parte dal loro
+    contributo attuale. Su PostgreSQL ci pensano già i trigger.
+    """
+    if _manutenzione_python(session):
+        _leggi_prima(session, ids)
+
+
+def _id_attivita(obj):
+    """Id dell'attività di un oggetto, compreso quello precedente se è cambiato."""
+    storia = inspect(obj).attrs.id_attivita.history
+    return {obj.id_attivita, *storia.deleted}
+
+
+@event.listens_for(Session, 'before_flush')
+def _raccogli_flush(session, flush_context, instances):
+    if not _manutenzione_python(session):
+        return
+    ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, _ENTITA_KPI) or (obj in session.dirty and not session.is_modified(obj)):
+            continue
+        # Le attività nuove non hanno ancora un contributo: vengono aggiunte dopo il flush
+        if not (isinstance(obj, AttivitaOrientamento) and obj in session.new):
+            ids |= _id_attivita(obj)
+    _leggi_prima(session, ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _raccogli_nuove(session, flush_context):
+    if not _manutenzione_python(session):
+        return
+    _, toccate = _pendenti(session)
+    toccate.update(obj.id_attivita for obj in session.new if isinstance(obj, AttivitaOrientamento))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _raccogli_bulk(orm_execute_state):
+    """
+    UPDATE/DELETE massivi: prima dell'esecuzione si legge il contributo delle
+    attività che lo statement colpisce, finché le righe esistono ancora.
+    """
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    entita = mapper.class_ if mapper is not None else None
+    if entita not in _ENTITA_KPI or not _manutenzione_python(orm_execute_state.session):
+        return
+
+    colpite = select(entita.id_attivita)
+    if orm_execute_state.statement.whereclause is not None:
+        colpite = colpite.where(orm_execute_state.statement.whereclause)
+    _leggi_prima(orm_execute_state.session,
+                 orm_execute_state.session.connection().execute(colpite.distinct()).scalars())
+
+
+@event.listens_for(Session, 'before_commit')
+def _aggiorna_contatori(session):
+    # before_commit precede l'autoflush del commit: le modifiche ancora
+    # pendenti arrivano in before_flush solo con il flush esplicito
+    session.flush()
+    if 'kpi_pendenti' not in session.info:
+        return
+    prima, toccate = session.info.pop('kpi_pendenti')
+    if not toccate:
+        return
+    connection = session.connection()
+    dopo = _contributo(connection, toccate)
+    _applica_delta(connection, {
+        chiave: [d - p for d, p in zip(dopo.get(chiave, (0, 0, 0)), prima.get(chiave, (0, 0, 0)))]
+        for chiave in prima.keys() | dopo.keys()
+    })
+
+
+@event.listens_for(Session, 'after_rollback')
+def _scarta_contatori(session):
+    session.info.pop('kpi_pendenti', None)
@@ -0,0 +1,55 @@
+"""
+Indice delle edizioni delle attività ricorrenti.
+
+Le edizioni di una stessa attività (es. "Open Day 2023", "Open Day 2024")
+condividono la struttura organizzante e il nome normalizzato, salvato in
+`attivita_orientamento.chiave_edizione` e indicizzato insieme alla struttura.
+La chiave viene ricalcolata dall'ORM a ogni INSERT/UPDATE dell'attività.
+"""
+import re
+import unicodedata
+
+from sqlalchemy import event, select, update
+
+from database.models import AttivitaOrientamento
+
+
+# Anni ("2024", "2023/24", "2023-2024") e indicazioni di edizione
+# ("3a edizione", "edizione III", "ed. 2") non fanno parte del nome.
+_ANNI = re.compile(r"\b(?:19|20)\d{2}(?:\s*[/-]\s*(?:19|20)?\d{2})?\b")
+_EDIZIONE = re.compile(
+    r"\b(?:\d+\s*[aª°]?|[ivxlc]+)\s+edizione\b|\bedizione\s+(?:\d+|[ivxlc]+)\b|\bed\.\s*\d+\b|\bedizione\b")
+_NON_ALFANUMERICI = re.compile(r"[^a-z0-9]+")
+
+_LUNGHEZZA = AttivitaOrientamento.chiave_edizione.type.length
+
+
+def chiave_edizione(nome):
+    """Nome normalizzato: minuscolo, senza accenti, anni e numero di edizione."""
+    if not nome:
+        return None
+    testo = unicodedata.normalize('NFKD', nome).encode('ascii', 'ignore').decode('ascii').lower()
+    testo = _ANNI.sub(' ', testo)
+    testo = _EDIZIONE.sub(' ', testo)
+    testo = _NON_ALFANUMERICI.sub(' ', testo).strip()
+    return (testo or nome.lower())[:_LUNGHEZZA]
+
+
+@event.listens_for(AttivitaOrientamento, 'before_insert')
+@event.listens_for(AttivitaOrientamento, 'before_update')
+def _aggiorna_chiave(mapper, connection, target):
+    target.chiave_edizione = chiave_edizione(target.nome)
+
+
+def allinea_chiavi(connection):
+    """Calcola la chiave per le attività che ne sono prive (righe preesistenti)."""
+    righe = connection.execute(
+        select(AttivitaOrientamento.id_attivita, AttivitaOrientamento.nome)
+        .where(AttivitaOrientamento.chiave_edizione.is_(None))
+    ).all()
+    for id_attivita, nome in righe:
+        connection.execute(
+            update(AttivitaOrientamento.__table__)
+            .where(AttivitaOrientamento.__table__.c.id_attivita == id_attivita)
+            .values(chiave_edizione=chiave_edizione(nome)))
+    return len(righe)
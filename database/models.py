@@ -1,5 +1,6 @@
 from sqlalchemy import (
-    Column, String, Integer, Date, ForeignKey, CheckConstraint, Text, ForeignKeyConstraint
+    Column, String, Integer, Date, DateTime, ForeignKey, CheckConstraint, Text, ForeignKeyConstraint, Index,
+    UniqueConstraint
 )
 from sqlalchemy.orm import relationship
 from database.db_connection import Base
@@ -59,10 +60,21 @@ class AttivitaOrientamento(Base):
     docente_presidente = Column(String(64),
                                 ForeignKey("personale_universitario.email", onupdate="CASCADE", ondelete="CASCADE"),
                                 nullable=False)
+    # Nome normalizzato per raggruppare le edizioni (vedi database/edizioni.py)
+    chiave_edizione = Column(String(64))
+    # Versione per il controllo di concorrenza ottimistico (UPDATE ... WHERE versione = ?)
+    versione = Column(Integer, nullable=False, server_default="1")
 
     __table_args__ = (
         CheckConstraint("data_fine >= data_inizio", name="check_data_fine"),
+        # Riferita da partecipa (id_attivita, data_inizio); con le tabelle partizionate è la chiave primaria
+        UniqueConstraint("id_attivita", "data_inizio", name="uq_attivita_orientamento_data_inizio"),
+        Index("ix_attivita_orientamento_struttura_organizzante", "struttura_organizzante", "id_attivita"),
+        Index("ix_attivita_orientamento_data_fine", "data_fine"),
+        Index("ix_attivita_orientamento_data_inizio", "data_inizio", "id_attivita"),
+        Index("ix_attivita_orientamento_edizione", "struttura_organizzante", "chiave_edizione", "data_inizio"),
     )
+    __mapper_args__ = {"version_id_col": versione}
 
     struttura_organizzante_rel = relationship("Struttura", back_populates="attivita_organizzate_rel")
     docente_presidente_rel = relationship("PersonaleUniversitario", back_populates="attivita_presiedute")
@@ -96,6 +108,10 @@ class Collabora(Base):
     nome_struttura = Column(String(64), ForeignKey("struttura.nome", onupdate="CASCADE", ondelete="CASCADE"),
                             primary_key=True)
 
+    __table_args__ = (
+        Index("ix_collabora_nome_struttura", "nome_struttura", "id_attivita"),
+    )
+
     attivita = relationship("AttivitaOrientamento", back_populates="collaborazioni")
     struttura_collaborante_rel = relationship("Struttura", back_populates="attivita_collaborate_rel")
 
@@ -103,11 +119,12 @@ class Collabora(Base):
 class Partecipa(Base):
     __tablename__ = "partecipa"
 
-    id_attivita = Column(Integer,
-                         ForeignKey("attivita_orientamento.id_attivita", onupdate="CASCADE", ondelete="CASCADE"),
-                         primary_key=True)
+    id_attivita = Column(Integer, primary_key=True)
     codice_meccanografico = Column(String(16), primary_key=True)
     indirizzo = Column(String(64), primary_key=True)
+    # Copia di attivita_orientamento.data_inizio (allineata dalla chiave esterna in
+    # cascata): filtra le partecipazioni per anno e partiziona la tabella (database/partizioni.py)
+    data_inizio = Column(Date, nullable=False)
 
     totale_studenti = Column(Integer, CheckConstraint("totale_studenti > 0"), CheckConstraint("totale_studenti = totale_maschi + totale_femmine + altro"))
     totale_maschi = Column(Integer, CheckConstraint("totale_maschi > 0"))
@@ -116,6 +133,12 @@ class Partecipa(Base):
     altro = Column(Integer, CheckConstraint("altro > 0"))
 
     __table_args__ = (
+        ForeignKeyConstraint(
+            ["id_attivita", "data_inizio"],
+            ["attivita_orientamento.id_attivita", "attivita_orientamento.data_inizio"],
+            onupdate="CASCADE",
+            ondelete="CASCADE"
+        ),
         ForeignKeyConstraint(
             ["codice_meccanografico", "indirizzo"],
             ["indirizzo_scolastico.codice_meccanografico", "indirizzo_scolastico.indirizzo"],
@@ -153,6 +176,9 @@ class Scuola(Base):
     comune = Column(String(64), nullable=False)
     dirigente = Column(String(64), ForeignKey("personale_scolastico.email", onupdate="CASCADE", ondelete="CASCADE"),
                        nullable=False)
+    versione = Column(Integer, nullable=False, server_default="1")
+
+    __mapper_args__ = {"version_id_col": versione}
 
     info_personali_dirigente = relationship("PersonaleScolastico", back_populates="scuola_diretta")
     indirizzi = relationship("IndirizzoScolastico", back_populates="scuola")
@@ -168,7 +194,57 @@ class IndirizzoScolastico(Base):
     indirizzo = Column(String(64), primary_key=True)
     referente = Column(String(64), ForeignKey("personale_scolastico.email", onupdate="CASCADE", ondelete="CASCADE"),
                        nullable=False)
+    versione = Column(Integer, nullable=False, server_default="1")
+
+    __mapper_args__ = {"version_id_col": versione}
 
     scuola = relationship("Scuola", back_populates="indirizzi")
     info_personali_referente = relationship("PersonaleScolastico", back_populates="indirizzo_referito")
-    partecipazioni = relationship("Partecipa", back_populates="indirizzi")
\ No newline at end of file
+    partecipazioni = relationship("Partecipa", back_populates="indirizzi")
+
+
+# 11 Contatori KPI (mantenuti da database/counters.py, non modificare a mano)
+class KpiContatore(Base):
+    __tablename__ = "kpi_contatore"
+
+    struttura = Column(String(64), primary_key=True)
+    anno = Column(Integer, primary_key=True)
+    attivita = Column(Integer, nullable=False, default=0)
+    ore = Column(Integer, nullable=False, default=0)
+    studenti = Column(Integer, nullable=False, default=0)
+
+
+# 12 Registro modifiche (append-only, scritto da database/audit.py)
+class RegistroModifica(Base):
+    __tablename__ = "registro_modifiche"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    istante = Column(DateTime, nullable=False)
+    utente = Column(String(64))
+    entita = Column(String(64), nullable=False)
+    chiave = Column(String(160), nullable=False)
+    operazione = Column(String(8), nullable=False)
+    valori = Column(Text)
+
+    __table_args__ = (
+        Index("ix_registro_modifiche_entita", "entita", "chiave", "istante"),
+        Index("ix_registro_modifiche_istante", "istante"),
+    )
+
+
+# 13 Query lente (scritto da database/query_lente.py)
+class QueryLenta(Base):
+    __tablename__ = "query_lenta"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    istante = Column(DateTime, nullable=False)
+    durata_ms = Column(Integer, nullable=False)
+    rotta = Column(String(160))
+    statement = Column(Text, nullable=False)
+    parametri = Column(Text)
+    piano = Column(Text)
+
+    __table_args__ = (
+        Index("ix_query_lenta_istante", "istante"),
+        Index("ix_query_lenta_durata", "durata_ms"),
+    )
@@ -0,0 +1,97 @@
+"""
+Esecuzione concorrente di query di sola lettura indipendenti.
+
+Ogni compito è una funzione `compito(session) -> risultato` che riceve una
+propria sessione (quindi una propria connessione del pool) e viene eseguito
+su un pool di thread condiviso dal processo. Il tempo complessivo si avvicina
+a quello della query più lenta invece che alla somma di tutte.
+
+Limiti:
+- QUERY_WORKERS: thread del pool condiviso (default: DB_POOL_SIZE, così i
+  compiti non svuotano il pool di connessioni delle richieste);
+- QUERY_CONCORRENZA: compiti di una stessa chiamata in esecuzione
+  contemporanea (default 4); con 1 i compiti girano in sequenza sulla
+  sessione del chiamante.
+
+Un compito che a sua volta chiama `esegui_in_parallelo` esegue i
+sottocompiti in sequenza sulla propria sessione: attendere altri compiti
+dello stesso pool da un suo thread potrebbe bloccarlo.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from database import query_lente
+from database.db_connection import Database
+
+
+QUERY_WORKERS = int(os.environ.get('QUERY_WORKERS', os.environ.get('DB_POOL_SIZE', 5)))
+QUERY_CONCORRENZA = int(os.environ.get('QUERY_CONCORRENZA', 4))
+
+_executor = None
+_executor_lock = threading.Lock()
+_locale = threading.local()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix='query')
+        return _executor
+
+
+def _esegui(compito, limite, rotta):
+    """Esegue un compito su una sessione dedicata, poi restituisce la connessione al pool."""
+    try:
+        _locale.in_compito = True
+        with Database().session_factory() as session_db, query_lente.per_rotta(rotta):
+            return compito(session_db)
+    finally:
+        _locale.in_compito = False
+        limite.release()
+
+
+def esegui_in_parallelo(compiti, session_db=None, max_concorrenza=None):
+    """
+    Esegue i compiti e restituisce i risultati nello stesso ordine. La prima
+    eccezione sollevata da un compito viene rilanciata al chiamante dopo che
+    tutti i compiti sono terminati.
+
+    `session_db` è la sessione usata quando i compiti girano in sequenza
+    (concorrenza 1, un solo compito o chiamata da dentro un compito).
+    """
+    compiti = list(compiti)
+    concorrenza = min(max_concorrenza or QUERY_CONCORRENZA, QUERY_WORKERS)
+    if concorrenza <= 1 or len(compiti) <= 1 or getattr(_locale, 'in_compito', False):
+        if session_db is None:
+            session_db = Database().get_session()
+        return [compito(session_db) for compito in compiti]
+
+    limite = threading.BoundedSemaphore(concorrenza)
+    rotta = query_lente.rotta_corrente()
+    futures = []
+    for compito in compiti:
+        limite.acquire()
+        futures.append(_pool().submit(_esegui, compito, limite, rotta))
+
+    errore = None
+    risultati = []
+    for future in futures:
+        try:
+            risultati.append(future.result())
+        except Exception as e:
+            errore = errore or e
+            risultati.append(None)
+    if errore is not None:
+        raise errore
+    return risultati
+
+
+def chiudi_pool():
+    """Ferma il pool di thread (es. dopo il fork o alla chiusura del processo)."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
@@ -0,0 +1,249 @@
+"""
+Partizionamento per anno di `attivita_orientamento` e `partecipa` (opzionale).
+
+Ogni partecipazione porta con sé la data di inizio della sua attività
+(`partecipa.data_inizio`), tenuta allineata dalla chiave esterna composta
+(id_attivita, data_inizio) con ON UPDATE CASCADE. Le query filtrate per anno
+confrontano con l'intervallo dell'anno (database/periodi.filtro_anno) sia la
+data dell'attività sia quella della partecipazione: con le tabelle
+partizionate il planner esclude le partizioni degli altri anni di entrambe.
+
+Lo schema predefinito non è partizionato. `flask db partiziona` (solo
+PostgreSQL 15 o successivo, che sposta tra partizioni anche le righe
+riferite da chiavi esterne) converte le due tabelle, in un'unica transazione,
+in tabelle partizionate per intervallo di data_inizio, una partizione per
+anno solare più una predefinita per le date fuori intervallo:
+- la chiave primaria di attivita_orientamento diventa (id_attivita, data_inizio),
+  quella di partecipa (id_attivita, data_inizio, codice_meccanografico, indirizzo):
+  l'unicità del solo id_attivita resta affidata alla sequenza;
+- collabora e supervisiona ricevono anch'esse la colonna data_inizio (solo
+  nel database, riempita da un trigger) per la chiave esterna composta;
+- dati, sequenza degli id, vincoli, indici e trigger dei contatori passano
+  alle nuove tabelle.
+Rieseguito, il comando aggiunge solo le partizioni mancanti fino all'anno
+prossimo: va lanciato prima dell'inizio di ogni anno, altrimenti le attività
+del nuovo anno finiscono nella partizione predefinita (e l'anno non si può
+più separare senza spostarle a mano).
+"""
+from datetime import date
+
+from sqlalchemy import event, select, update, func, text
+
+from database.models import AttivitaOrientamento, Partecipa
+from database.periodi import intervallo_anno
+
+
+# Tabelle partizionate e chiave primaria che assumono
+TABELLE = {
+    'attivita_orientamento': ('id_attivita', 'data_inizio'),
+    'partecipa': ('id_attivita', 'data_inizio', 'codice_meccanografico', 'indirizzo'),
+}
+# Tabelle che riferiscono le attività senza essere partizionate
+_FIGLIE = ('collabora', 'supervisiona')
+_PREDEFINITA = 'altri'
+
+
+def data_attivita(id_attivita):
+    """Data di inizio dell'attività `id_attivita` (colonna o valore), come sottoquery scalare."""
+    return select(AttivitaOrientamento.data_inizio) \
+        .where(AttivitaOrientamento.id_attivita == id_attivita).scalar_subquery()
+
+
+@event.listens_for(Partecipa, 'before_insert')
+def _copia_data(mapper, connection, target):
+    if target.data_inizio is None:
+        target.data_inizio = data_attivita(target.id_attivita)
+
+
+def date_attivita(connection, ids):
+    """{id_attivita: data_inizio} delle attività `ids` (per gli INSERT senza ORM)."""
+    return dict(connection.execute(
+        select(AttivitaOrientamento.id_attivita, AttivitaOrientamento.data_inizio)
+        .where(AttivitaOrientamento.id_attivita.in_(sorted(ids)))).all())
+
+
+def partizionata(connection, tabella='attivita_orientamento'):
+    """True se `tabella` è partizionata (sempre False fuori da PostgreSQL)."""
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t))"),
+        {'t': tabella}).scalar()
+
+
+def chiave_partecipa(connection):
+    """Colonne della chiave primaria di partecipa, data_inizio compresa se la tabella è partizionata."""
+    if partizionata(connection, 'partecipa'):
+        return list(TABELLE['partecipa'])
+    return [c.name for c in Partecipa.__table__.primary_key]
+
+
+def _chiavi_esterne(connection, tabella, colonne):
+    """Nomi delle chiavi esterne di `tabella` verso le attività con `colonne` colonne."""
+    return connection.execute(text("""
+        SELECT conname FROM pg_constraint
+        WHERE contype = 'f' AND conrelid = to_regclass(:t)
+          AND confrelid = 'attivita_orientamento'::regclass AND cardinality(conkey) = :n
+    """), {'t': tabella, 'n': colonne}).scalars().all()
+
+
+def _riferisci_per_data(connection, tabella):
+    connection.exec_driver_sql(
+        f"ALTER TABLE {tabella} ADD CONSTRAINT {tabella}_id_attivita_data_inizio_fkey "
+        f"FOREIGN KEY (id_attivita, data_inizio) REFERENCES attivita_orientamento (id_attivita, data_inizio) "
+        f"ON UPDATE CASCADE ON DELETE CASCADE")
+
+
+def allinea_date(connection):
+    """
+    Porta partecipa.data_inizio negli schemi creati prima della colonna: copia
+    le date mancanti e, su PostgreSQL, sostituisce la chiave esterna verso le
+    attività con quella composta che le tiene allineate. Idempotente.
+    """
+    partecipa = Partecipa.__table__
+    copiate = connection.execute(
+        update(partecipa).where(partecipa.c.data_inizio.is_(None))
+        .values(data_inizio=data_attivita(partecipa.c.id_attivita))).rowcount
+    if connection.dialect.name != 'postgresql' or _chiavi_esterne(connection, 'partecipa', 2):
+        return copiate
+
+    connection.exec_driver_sql("""
+        DO $$ BEGIN
+            IF to_regclass('uq_attivita_orientamento_data_inizio') IS NULL THEN
+                ALTER TABLE attivita_orientamento ADD CONSTRAINT uq_attivita_orientamento_data_inizio
+                    UNIQUE (id_attivita, data_inizio);
+            END IF;
+        END $$
+    """)
+    for nome in _chiavi_esterne(connection, 'partecipa', 1):
+        connection.exec_driver_sql(f"ALTER TABLE partecipa DROP CONSTRAINT {nome}")
+    _riferisci_per_data(connection, 'partecipa')
+    connection.exec_driver_sql("ALTER TABLE partecipa ALTER COLUMN data_inizio SET NOT NULL")
+    return copiate
+
+
+# ------------------------------------------------------------------------------
+# Conversione in tabelle partizionate (flask db partiziona)
+# ------------------------------------------------------------------------------
+
+_DDL_FIGLIE = """
+    CREATE OR REPLACE FUNCTION partizioni_data_inizio() RETURNS trigger AS $$
+    BEGIN
+        SELECT data_inizio INTO NEW.data_inizio FROM attivita_orientamento WHERE id_attivita = NEW.id_attivita;
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql
+"""
+
+
+def _stacca(connection):
+    """
+    Rinomina le tabelle da convertire in <tabella>_np e crea al loro posto le
+    tabelle partizionate (vuote, con la sola partizione predefinita).
+    Restituisce le chiavi esterne verso le anagrafiche da ricreare.
+    """
+    vincoli = connection.execute(text("""
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE contype = 'f' AND conrelid IN ('attivita_orientamento'::regclass, 'partecipa'::regclass)
+          AND confrelid <> 'attivita_orientamento'::regclass
+        ORDER BY 1, 2
+    """)).all()
+    for tabella in ('partecipa',) + _FIGLIE:
+        for nome in _chiavi_esterne(connection, tabella, 1) + _chiavi_esterne(connection, tabella, 2):
+            connection.exec_driver_sql(f"ALTER TABLE {tabella} DROP CONSTRAINT {nome}")
+
+    connection.exec_driver_sql(_DDL_FIGLIE)
+    for tabella in _FIGLIE:
+        connection.exec_driver_sql(f"ALTER TABLE {tabella} ADD COLUMN IF NOT EXISTS data_inizio date")
+        connection.exec_driver_sql(
+            f"UPDATE {tabella} f SET data_inizio = a.data_inizio FROM attivita_orientamento a "
+            f"WHERE a.id_attivita = f.id_attivita")
+        connection.exec_driver_sql(f"ALTER TABLE {tabella} ALTER COLUMN data_inizio SET NOT NULL")
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {tabella}_data_inizio ON {tabella}")
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER {tabella}_data_inizio BEFORE INSERT OR UPDATE OF id_attivita ON {tabella} "
+            f"FOR EACH ROW EXECUTE FUNCTION partizioni_data_inizio()")
+
+    for tabella in TABELLE:
+        connection.exec_driver_sql(f"ALTER TABLE {tabella} RENAME TO {tabella}_np")
+        connection.exec_driver_sql(
+            f"CREATE TABLE {tabella} (LIKE {tabella}_np INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            f"PARTITION BY RANGE (data_inizio)")
+        connection.exec_driver_sql(f"CREATE TABLE {tabella}_{_PREDEFINITA} PARTITION OF {tabella} DEFAULT")
+    return vincoli
+
+
+def _trasferisci(connection, vincoli):
+    """Copia i dati nelle tabelle partizionate, elimina le vecchie e ricrea chiavi, vincoli, indici e trigger."""
+    from database import counters
+
+    sequenza = connection.execute(
+        text("SELECT pg_get_serial_sequence('attivita_orientamento_np', 'id_attivita')")).scalar()
+    if sequenza:
+        connection.exec_driver_sql(f"ALTER SEQUENCE {sequenza} OWNED BY attivita_orientamento.id_attivita")
+    # Le vecchie tabelle si portano via i loro trigger: la copia non tocca i contatori
+    for tabella in TABELLE:
+        connection.exec_driver_sql(f"INSERT INTO {tabella} SELECT * FROM {tabella}_np")
+    for tabella in reversed(list(TABELLE)):
+        connection.exec_driver_sql(f"DROP TABLE {tabella}_np")
+
+    for tabella, chiave in TABELLE.items():
+        connection.exec_driver_sql(f"ALTER TABLE {tabella} ADD PRIMARY KEY ({', '.join(chiave)})")
+    for tabella, nome, definizione in vincoli:
+        connection.exec_driver_sql(f"ALTER TABLE {tabella} ADD CONSTRAINT {nome} {definizione}")
+    for tabella in ('partecipa',) + _FIGLIE:
+        _riferisci_per_data(connection, tabella)
+    for modello in (AttivitaOrientamento, Partecipa):
+        for indice in modello.__table__.indexes:
+            indice.create(connection)
+
+    counters.installa_trigger(connection)
+    for tabella in TABELLE:
+        connection.exec_driver_sql(f"ANALYZE {tabella}")
+
+
+def _crea_partizioni(connection, anni):
+    """Partizioni mancanti degli `anni`; salta gli anni con righe già nella partizione predefinita."""
+    create, saltati = [], []
+    for anno in anni:
+        inizio, fine = intervallo_anno(anno)
+        mancanti = [t for t in TABELLE if connection.execute(
+            text("SELECT to_regclass(:p)"), {'p': f'{t}_{anno}'}).scalar() is None]
+        if not mancanti:
+            continue
+        if any(connection.execute(text(
+                f"SELECT EXISTS (SELECT 1 FROM {t}_{_PREDEFINITA} WHERE data_inizio >= :i AND data_inizio < :f)"),
+                {'i': inizio, 'f': fine}).scalar() for t in mancanti):
+            saltati.append(anno)
+            continue
+        for tabella in mancanti:
+            connection.exec_driver_sql(
+                f"CREATE TABLE {tabella}_{anno} PARTITION OF {tabella} "
+                f"FOR VALUES FROM ('{inizio.isoformat()}') TO ('{fine.isoformat()}')")
+            create.append(f'{tabella}_{anno}')
+    return create, saltati
+
+
+def partiziona(connection, anni_futuri=1):
+    """
+    Converte attivita_orientamento e partecipa in tabelle partizionate per anno
+    (se non lo sono già) e crea le partizioni mancanti, dal primo anno con
+    attività fino a `anni_futuri` anni dopo quello corrente.
+    Restituisce (partizioni create, anni rimasti nella partizione predefinita).
+    """
+    if connection.dialect.name != 'postgresql':
+        raise RuntimeError("Il partizionamento è disponibile solo su PostgreSQL")
+    if connection.dialect.server_version_info < (15,):
+        raise RuntimeError("Il partizionamento richiede PostgreSQL 15 o successivo")
+
+    primo, ultimo = connection.execute(
+        select(func.min(AttivitaOrientamento.data_inizio), func.max(AttivitaOrientamento.data_inizio))).one()
+    oggi = date.today().year
+    anni = range(primo.year if primo else oggi, max(ultimo.year if ultimo else oggi, oggi + anni_futuri) + 1)
+
+    if partizionata(connection):
+        return _crea_partizioni(connection, anni)
+    allinea_date(connection)
+    vincoli = _stacca(connection)
+    risultato = _crea_partizioni(connection, anni)
+    _trasferisci(connection, vincoli)
+    return risultato
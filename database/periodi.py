@@ -0,0 +1,19 @@
+from datetime import date
+
+from sqlalchemy import and_
+
+
+def intervallo_anno(anno):
+    """Intervallo semiaperto [1 gennaio anno, 1 gennaio anno+1)."""
+    return date(anno, 1, 1), date(anno + 1, 1, 1)
+
+
+def filtro_anno(colonna, anno):
+    """
+    Condizione "colonna cade nell'anno indicato" espressa come intervallo di
+    date invece di extract('year', colonna) = anno: il confronto diretto sulla
+    colonna può usare l'indice su data_inizio (range scan) anziché valutare
+    la funzione su ogni riga.
+    """
+    inizio, fine = intervallo_anno(anno)
+    return and_(colonna >= inizio, colonna < fine)
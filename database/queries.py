@@ -0,0 +1,76 @@
+from sqlalchemy import select, func, bindparam, and_, distinct
+from sqlalchemy.orm import aliased
+
+from database.models import AttivitaOrientamento, IndirizzoScolastico, Partecipa, UtenteApplicazione
+from database.visibility import ids_visibili
+
+
+# Statement SQLAlchemy 2.0 dei percorsi più frequenti, costruiti una sola volta
+# al caricamento del modulo. I valori arrivano come parametri legati al momento
+# dell'esecuzione (session.execute(STMT, {...})), quindi ogni richiesta salta la
+# costruzione della query e riusa la forma compilata dalla cache dell'engine.
+# Sono condivisi tra le rotte Flask (engine sincrono) e il percorso ASGI.
+
+STMT_UTENTE_PER_EMAIL = select(UtenteApplicazione).where(UtenteApplicazione.email == bindparam('email'))
+
+# Un'attività sola: le tre collezioni caricate in lazy costano meno di
+# selectinload, che paga la costruzione della query IN per un solo id
+# (benchmarks/bench_statement.py)
+STMT_ATTIVITA_MODIFICA = select(AttivitaOrientamento).where(
+    AttivitaOrientamento.id_attivita == bindparam('id_attivita'))
+
+STMT_INDIRIZZI_SCUOLA = select(IndirizzoScolastico.indirizzo).where(
+    IndirizzoScolastico.codice_meccanografico == bindparam('codice_scuola')
+).order_by(IndirizzoScolastico.indirizzo)
+
+STMT_INDIRIZZI_SCUOLE = select(IndirizzoScolastico.codice_meccanografico, IndirizzoScolastico.indirizzo).where(
+    IndirizzoScolastico.codice_meccanografico.in_(bindparam('codici', expanding=True))
+).order_by(IndirizzoScolastico.codice_meccanografico, IndirizzoScolastico.indirizzo)
+
+_cerca_attivita = select(
+    AttivitaOrientamento.id_attivita,
+    AttivitaOrientamento.nome,
+    AttivitaOrientamento.data_inizio,
+    AttivitaOrientamento.struttura_organizzante
+).where(AttivitaOrientamento.nome.ilike(bindparam('pattern')))
+
+STMT_CERCA_ATTIVITA = _cerca_attivita \
+    .order_by(AttivitaOrientamento.data_inizio.desc()).limit(20)
+
+STMT_CERCA_ATTIVITA_STRUTTURA = _cerca_attivita \
+    .where(AttivitaOrientamento.id_attivita.in_(ids_visibili(bindparam('struttura')))) \
+    .order_by(AttivitaOrientamento.data_inizio.desc()).limit(20)
+
+STMT_CONFRONTA_EDIZIONI = select(
+    AttivitaOrientamento.nome,
+    AttivitaOrientamento.data_inizio,
+    func.sum(Partecipa.totale_studenti),
+    func.sum(func.coalesce(Partecipa.totale_maschi, 0)),
+    func.sum(func.coalesce(Partecipa.totale_femmine, 0))
+).outerjoin(Partecipa).where(AttivitaOrientamento.id_attivita.in_(bindparam('ids', expanding=True))) \
+    .group_by(AttivitaOrientamento.id_attivita)
+
+# Tutte le edizioni dell'attività indicata (stessa struttura organizzante e
+# chiave di edizione), con i totali per edizione in un'unica query. L'outer
+# join mantiene le edizioni senza partecipazioni.
+_riferimento = aliased(AttivitaOrientamento)
+_serie_edizioni = select(
+    AttivitaOrientamento.id_attivita,
+    AttivitaOrientamento.nome,
+    AttivitaOrientamento.data_inizio,
+    func.count(distinct(Partecipa.codice_meccanografico)).label('scuole'),
+    func.coalesce(func.sum(Partecipa.totale_studenti), 0).label('studenti'),
+    func.coalesce(func.sum(Partecipa.totale_maschi), 0).label('maschi'),
+    func.coalesce(func.sum(Partecipa.totale_femmine), 0).label('femmine'),
+).join(_riferimento, and_(
+    _riferimento.struttura_organizzante == AttivitaOrientamento.struttura_organizzante,
+    _riferimento.chiave_edizione == AttivitaOrientamento.chiave_edizione,
+)).outerjoin(Partecipa, Partecipa.id_attivita == AttivitaOrientamento.id_attivita) \
+    .where(_riferimento.id_attivita == bindparam('id_attivita')) \
+    .group_by(AttivitaOrientamento.id_attivita, AttivitaOrientamento.nome, AttivitaOrientamento.data_inizio)
+
+STMT_SERIE_EDIZIONI = _serie_edizioni.order_by(AttivitaOrientamento.data_inizio)
+
+STMT_SERIE_EDIZIONI_STRUTTURA = _serie_edizioni \
+    .where(AttivitaOrientamento.id_attivita.in_(ids_visibili(bindparam('struttura')))) \
+    .order_by(AttivitaOrientamento.data_inizio)
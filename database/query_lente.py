@@ -0,0 +1,226 @@
+"""
+Registro delle query lente.
+
+Gli eventi dell'engine misurano ogni statement; quelli che superano
+SLOW_QUERY_MS millisecondi vengono passati, con i parametri e la rotta che
+li ha eseguiti, a un thread dedicato che:
+- scrive una riga nel file di log a rotazione SLOW_QUERY_LOG;
+- ricava il piano: `EXPLAIN (ANALYZE, BUFFERS)` su PostgreSQL per le SELECT
+  (le altre istruzioni con il solo EXPLAIN, per non ripetere le modifiche),
+  `EXPLAIN QUERY PLAN` su SQLite;
+- salva tutto nella tabella `query_lenta`, interrogabile con SQL o con
+  `flask db query-lente`.
+
+La richiesta non attende nulla di tutto questo: la coda verso il thread è
+limitata e, se piena, le query lente in eccesso vengono solo contate. Lo
+stesso statement viene analizzato al più una volta ogni
+SLOW_QUERY_EXPLAIN_INTERVALLO secondi, perché EXPLAIN ANALYZE riesegue la
+query. Con SLOW_QUERY_MS=0 il registro è disattivato.
+"""
+import os
+import re
+import time
+import queue
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from sqlalchemy import event, insert
+
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 500))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', os.path.join(tempfile.gettempdir(), 'orienta_query_lente.log'))
+SLOW_QUERY_EXPLAIN_INTERVALLO = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVALLO', 300))
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.environ.get('SLOW_QUERY_EXPLAIN_TIMEOUT_MS', 30000))
+
+# Opzione di esecuzione che esclude uno statement dal registro (EXPLAIN e scritture del registro stesso)
+ESCLUDI = 'query_lente_escludi'
+
+_MAX_PARAMETRI = 2000
+_SELECT = re.compile(r'^\s*(\(\s*)*(SELECT|WITH|VALUES|TABLE)\b', re.IGNORECASE)
+# Istruzioni di cui esiste un piano (non DDL, COPY, SET, ...)
+_CON_PIANO = re.compile(r'^\s*(\(\s*)*(SELECT|WITH|VALUES|TABLE|INSERT|UPDATE|DELETE|MERGE)\b', re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+
+_locale = threading.local()
+
+
+def rotta_corrente():
+    """
+    Origine delle query del thread: la rotta impostata con `per_rotta`, poi
+    endpoint e percorso della richiesta Flask in corso, infine il nome del thread.
+    """
+    rotta = getattr(_locale, 'rotta', None)
+    if rotta:
+        return rotta
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            return f"{request.endpoint} {request.method} {request.path}"[:160]
+    except ImportError:
+        pass
+    return f"thread {threading.current_thread().name}"
+
+
+@contextmanager
+def per_rotta(rotta):
+    """Attribuisce a `rotta` le query eseguite nel blocco (es. i compiti paralleli di una richiesta)."""
+    precedente = getattr(_locale, 'rotta', None)
+    _locale.rotta = rotta
+    try:
+        yield
+    finally:
+        _locale.rotta = precedente
+
+
+def _testo_parametri(parametri, executemany):
+    if executemany:
+        testo = f"[{len(parametri)} righe] {parametri[:3]!r}"
+    else:
+        testo = repr(parametri)
+    return testo[:_MAX_PARAMETRI]
+
+
+class RegistroQueryLente:
+    """Misura gli statement di un engine e passa quelli lenti al thread del registro."""
+
+    def __init__(self, engine, soglia_ms=SLOW_QUERY_MS, file_log=SLOW_QUERY_LOG, max_coda=100):
+        self.engine = engine
+        self.soglia = soglia_ms / 1000
+        self.file_log = file_log
+        self.max_coda = max_coda
+        self.scartate = 0
+        self._ultimi_explain = {}       # statement -> istante dell'ultimo EXPLAIN
+        self._lock = threading.Lock()
+        self._coda = None
+        self._pid = None
+        self._log = None
+
+        event.listen(engine, 'before_cursor_execute', self._prima)
+        event.listen(engine, 'after_cursor_execute', self._dopo)
+        event.listen(engine, 'handle_error', self._errore)
+
+    # --- eventi dell'engine (thread della richiesta) ---
+
+    def _prima(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_lente_inizio', []).append(time.perf_counter())
+
+    def _errore(self, contesto):
+        inizi = contesto.connection.info.get('query_lente_inizio') if contesto.connection is not None else None
+        if inizi:
+            inizi.pop()
+
+    def _dopo(self, conn, cursor, statement, parameters, context, executemany):
+        durata = time.perf_counter() - conn.info['query_lente_inizio'].pop()
+        if durata < self.soglia or conn.get_execution_options().get(ESCLUDI):
+            return
+        voce = {
+            'istante': datetime.now(),
+            'durata_ms': round(durata * 1000),
+            'rotta': rotta_corrente(),
+            'statement': statement,
+            'parametri': parameters,
+            'executemany': executemany,
+        }
+        try:
+            self._coda_attiva().put_nowait(voce)
+        except queue.Full:
+            with self._lock:
+                self.scartate += 1
+
+    # --- thread del registro ---
+
+    def _coda_attiva(self):
+        """Coda e thread vengono creati al primo uso in ogni processo (anche dopo il fork)."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._coda = queue.Queue(maxsize=self.max_coda)
+                threading.Thread(target=self._lavora, args=(self._coda,), name='query-lente', daemon=True).start()
+            return self._coda
+
+    def _logger_file(self):
+        if self._log is None:
+            self._log = logging.getLogger('orienta.query_lente')
+            self._log.propagate = False
+            if not self._log.handlers:
+                gestore = RotatingFileHandler(self.file_log, maxBytes=10 * 1024 * 1024, backupCount=5,
+                                              encoding='utf-8')
+                gestore.setFormatter(logging.Formatter('%(message)s'))
+                self._log.addHandler(gestore)
+                self._log.setLevel(logging.INFO)
+        return self._log
+
+    def _lavora(self, coda):
+        while True:
+            voce = coda.get()
+            try:
+                self._registra(voce)
+            except Exception:
+                logger.exception("Registrazione della query lenta fallita")
+
+    def _registra(self, voce):
+        parametri_driver = voce.pop('parametri')
+        executemany = voce.pop('executemany')
+        parametri = _testo_parametri(parametri_driver, executemany)
+        self._logger_file().info("%s %d ms [%s] %s -- %s", voce['istante'].isoformat(timespec='seconds'),
+                                 voce['durata_ms'], voce['rotta'], ' '.join(voce['statement'].split()), parametri)
+        piano = None
+        if not executemany and _CON_PIANO.match(voce['statement']) and self._da_analizzare(voce['statement']):
+            try:
+                piano = self.piano(voce['statement'], parametri_driver)
+            except Exception as e:
+                piano = f"EXPLAIN non riuscito: {e}"
+
+        from database.models import QueryLenta
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(**{ESCLUDI: True})
+            conn.execute(insert(QueryLenta), dict(voce, parametri=parametri, piano=piano))
+            conn.commit()
+
+    def _da_analizzare(self, statement):
+        adesso = time.monotonic()
+        with self._lock:
+            ultimo = self._ultimi_explain.get(statement)
+            if ultimo is not None and adesso - ultimo < SLOW_QUERY_EXPLAIN_INTERVALLO:
+                return False
+            self._ultimi_explain[statement] = adesso
+            if len(self._ultimi_explain) > 1000:
+                self._ultimi_explain.clear()
+        return True
+
+    def piano(self, statement, parametri):
+        """Piano di esecuzione dello statement, in una transazione annullata al termine."""
+        dialetto = self.engine.dialect.name
+        if dialetto == 'postgresql':
+            opzioni = '(ANALYZE, BUFFERS)' if _SELECT.match(statement) else ''
+            prefisso = f"EXPLAIN {opzioni} "
+        elif dialetto == 'sqlite':
+            prefisso = "EXPLAIN QUERY PLAN "
+        else:
+            return None
+
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(**{ESCLUDI: True})
+            with conn.begin() as transazione:
+                if dialetto == 'postgresql':
+                    # Non restare in attesa dei lock della transazione che ha eseguito la query
+                    conn.exec_driver_sql(f"SET LOCAL statement_timeout = {SLOW_QUERY_EXPLAIN_TIMEOUT_MS}")
+                    conn.exec_driver_sql("SET LOCAL lock_timeout = 1000")
+                righe = conn.exec_driver_sql(prefisso + statement, parametri).all()
+                transazione.rollback()
+        if dialetto == 'sqlite':
+            return '\n'.join(str(r[-1]) for r in righe)
+        return '\n'.join(r[0] for r in righe)
+
+
+def installa(engine, soglia_ms=SLOW_QUERY_MS):
+    """Attiva il registro sull'engine; None se disattivato (soglia <= 0)."""
+    if soglia_ms <= 0:
+        return None
+    return RegistroQueryLente(engine, soglia_ms=soglia_ms)
@@ -0,0 +1,109 @@
+from datetime import date
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+
+from database.models import (
+    AttivitaOrientamento, PersonaleUniversitario, Struttura, Scuola, IndirizzoScolastico, PersonaleScolastico,
+    UtenteApplicazione
+)
+
+
+# Modelli di sola lettura per liste e select: tuple leggere popolate da select
+# di sole colonne, senza istanze ORM né tracciamento nell'identity map.
+
+class AttivitaRiga(NamedTuple):
+    id_attivita: int
+    nome: str
+    data_inizio: date
+    data_fine: date
+
+
+class PersonaleRiga(NamedTuple):
+    email: str
+    nome: str
+    cognome: str
+
+
+class StrutturaRiga(NamedTuple):
+    nome: str
+
+
+class ScuolaOpzione(NamedTuple):
+    codice_meccanografico: str
+    nome: str
+
+
+class ScuolaRiga(NamedTuple):
+    codice_meccanografico: str
+    nome: str
+    email: str
+    numero_telefonico: str
+    via: str
+    numero_civico: int
+    comune: str
+    dirigente_nome: str
+    dirigente_cognome: str
+    dirigente_email: str
+
+
+class IndirizzoRiga(NamedTuple):
+    codice_meccanografico: str
+    scuola_nome: str
+    indirizzo: str
+    referente_nome: str
+    referente_cognome: str
+    referente_email: str
+
+
+class ReferenteRiga(NamedTuple):
+    email: str
+    ruolo: str
+    struttura_afferita: Optional[str]
+
+
+STMT_ATTIVITA = select(
+    AttivitaOrientamento.id_attivita, AttivitaOrientamento.nome,
+    AttivitaOrientamento.data_inizio, AttivitaOrientamento.data_fine
+)
+
+STMT_PERSONALE = select(
+    PersonaleUniversitario.email, PersonaleUniversitario.nome, PersonaleUniversitario.cognome
+).order_by(PersonaleUniversitario.cognome, PersonaleUniversitario.nome)
+
+STMT_STRUTTURE = select(Struttura.nome).order_by(Struttura.nome)
+
+STMT_SCUOLE_OPZIONI = select(Scuola.codice_meccanografico, Scuola.nome).order_by(Scuola.nome)
+
+STMT_SCUOLE = select(
+    Scuola.codice_meccanografico, Scuola.nome, Scuola.email, Scuola.numero_telefonico,
+    Scuola.via, Scuola.numero_civico, Scuola.comune,
+    PersonaleScolastico.nome, PersonaleScolastico.cognome, PersonaleScolastico.email
+).join(PersonaleScolastico, Scuola.dirigente == PersonaleScolastico.email).order_by(Scuola.nome)
+
+STMT_INDIRIZZI = select(
+    IndirizzoScolastico.codice_meccanografico, Scuola.nome, IndirizzoScolastico.indirizzo,
+    PersonaleScolastico.nome, PersonaleScolastico.cognome, PersonaleScolastico.email
+).join(
+    Scuola, IndirizzoScolastico.codice_meccanografico == Scuola.codice_meccanografico
+).join(
+    PersonaleScolastico, IndirizzoScolastico.referente == PersonaleScolastico.email
+).order_by(Scuola.nome, IndirizzoScolastico.indirizzo)
+
+STMT_REFERENTI = select(
+    UtenteApplicazione.email, UtenteApplicazione.ruolo, UtenteApplicazione.struttura_afferita
+).order_by(UtenteApplicazione.email)
+
+
+def righe(session_db, stmt, tipo, params=None):
+    """Esegue uno statement di sole colonne e restituisce una lista di `tipo`."""
+    return [tipo._make(r) for r in session_db.execute(stmt, params)]
+
+
+def righe_lazy(session_db, stmt, tipo, params=None):
+    """
+    Come righe(), ma la query parte solo alla prima iterazione: le pagine
+    con la tabella in cache (vedi {% cache %}) non la eseguono affatto.
+    """
+    for r in session_db.execute(stmt, params):
+        yield tipo._make(r)
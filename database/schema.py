@@ -0,0 +1,48 @@
+from sqlalchemy import select, inspect
+
+from database.db_connection import Base
+
+
+def _aggiungi_colonne(engine):
+    """ALTER TABLE ... ADD COLUMN per le colonne dei modelli assenti nelle tabelle esistenti."""
+    esistenti = inspect(engine)
+    with engine.begin() as conn:
+        for tabella in Base.metadata.sorted_tables:
+            presenti = {c['name'] for c in esistenti.get_columns(tabella.name)}
+            for colonna in tabella.columns:
+                if colonna.name in presenti:
+                    continue
+                tipo = colonna.type.compile(dialect=engine.dialect)
+                ddl = f'ALTER TABLE {tabella.name} ADD COLUMN {colonna.name} {tipo}'
+                # Le colonne NOT NULL si possono aggiungere solo con un default per le righe esistenti
+                if colonna.server_default is not None:
+                    ddl += f' DEFAULT {colonna.server_default.arg}'
+                    if not colonna.nullable:
+                        ddl += ' NOT NULL'
+                conn.exec_driver_sql(ddl)
+
+
+def aggiorna_schema(engine):
+    """
+    Porta uno schema esistente allineato ai modelli senza toccare i dati:
+    crea le tabelle mancanti, aggiunge le colonne nuove e gli indici dichiarati
+    che non esistono ancora, calcola le chiavi di edizione mancanti, copia la
+    data di inizio delle attività nelle partecipazioni che ne sono prive,
+    installa i trigger dei contatori KPI (solo PostgreSQL) e li popola se la
+    tabella è vuota. Ogni passo è idempotente.
+    """
+    from database import counters, edizioni, partizioni  # importano anche i modelli, registrandoli nel metadata
+    from database.models import KpiContatore
+
+    Base.metadata.create_all(engine, checkfirst=True)
+    _aggiungi_colonne(engine)
+    for tabella in Base.metadata.sorted_tables:
+        for indice in tabella.indexes:
+            indice.create(engine, checkfirst=True)
+
+    with engine.begin() as conn:
+        edizioni.allinea_chiavi(conn)
+        partizioni.allinea_date(conn)
+        counters.installa_trigger(conn)
+        if conn.execute(select(KpiContatore.anno).limit(1)).first() is None:
+            counters.ricostruisci(conn)
@@ -0,0 +1,70 @@
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+# Versione dei dati per ogni tabella del database (per processo).
+# Viene incrementata a ogni commit che tocca la tabella e serve come
+# chiave di invalidazione per le cache dei frammenti di template.
+_versioni = {}
+_lock = threading.Lock()
+
+
+def data_version(*tabelle):
+    """
+    Restituisce la versione corrente delle tabelle indicate, come tupla
+    utilizzabile all'interno di una chiave di cache.
+    """
+    with _lock:
+        return tuple(_versioni.get(t, 0) for t in tabelle)
+
+
+def _tabelle_modificate(session):
+    return session.info.setdefault('tabelle_modificate', set())
+
+
+def segna_tabelle(session, *tabelle):
+    """Tabelle modificate con statement Core: le loro versioni crescono al commit."""
+    _tabelle_modificate(session).update(tabelle)
+
+
+@event.listens_for(Session, 'after_flush')
+def _registra_flush(session, flush_context):
+    """Annota le tabelle toccate da INSERT/UPDATE/DELETE della unit of work."""
+    modificate = _tabelle_modificate(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        tabella = getattr(obj, '__tablename__', None)
+        if tabella:
+            modificate.add(tabella)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _registra_bulk(orm_execute_state):
+    """Annota le tabelle toccate da query(...).delete() e update() massivi."""
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        tabella = getattr(orm_execute_state.statement, 'table', None)
+        if tabella is not None:
+            _tabelle_modificate(orm_execute_state.session).add(tabella.name)
+
+
+def incrementa_versioni(tabelle):
+    """
+    Invalida le chiavi di cache che dipendono dalle tabelle indicate. Chiamata
+    al commit e, per le modifiche fatte da altri processi, dal bus degli eventi.
+    """
+    with _lock:
+        for tabella in tabelle:
+            _versioni[tabella] = _versioni.get(tabella, 0) + 1
+
+
+@event.listens_for(Session, 'after_commit')
+def _incrementa_versioni(session):
+    modificate = session.info.pop('tabelle_modificate', None)
+    if modificate:
+        incrementa_versioni(modificate)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _scarta_modifiche(session):
+    session.info.pop('tabelle_modificate', None)
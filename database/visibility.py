@@ -0,0 +1,38 @@
+from sqlalchemy import select, union
+
+from database.models import AttivitaOrientamento, Collabora
+
+
+ATENEO = 'Ateneo di Verona'
+
+
+def ids_visibili(struttura):
+    """
+    Id delle attività visibili a una struttura: quelle che organizza UNION
+    quelle a cui collabora. Ogni ramo usa il proprio indice (struttura
+    organizzante / nome_struttura di collabora) e l'UNION elimina i duplicati,
+    a differenza di OUTER JOIN + OR che moltiplica le attività con più
+    collaboratori. Il nome della struttura è un parametro legato, quindi lo
+    statement compilato resta in cache per tutte le strutture.
+    """
+    return union(
+        select(AttivitaOrientamento.id_attivita).where(AttivitaOrientamento.struttura_organizzante == struttura),
+        select(Collabora.id_attivita).where(Collabora.nome_struttura == struttura),
+    )
+
+
+def applica_visibilita(stmt, struttura):
+    """
+    Restringe uno statement (select() o Query) sulle attività alla visibilità
+    della struttura indicata. L'Ateneo vede tutte le attività.
+    """
+    if struttura == ATENEO:
+        return stmt
+    return stmt.where(AttivitaOrientamento.id_attivita.in_(ids_visibili(struttura)))
+
+
+def struttura_resoconto(struttura, dip_filter):
+    """Struttura di cui mostrare il resoconto: l'Ateneo può filtrare per dipartimento."""
+    if struttura == ATENEO and dip_filter:
+        return dip_filter
+    return struttura
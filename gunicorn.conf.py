@@ -0,0 +1,42 @@
+import os
+
+from database.db_connection import Database
+from database import parallelo
+from services import eventi, export_xlsx, grafici
+
+
+# Avvio: gunicorn -c gunicorn.conf.py
+wsgi_app = "app:create_app()"
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+# Worker a thread: uno stream SSE servito dalla rotta Flask tiene un thread, non
+# l'intero worker. Al più metà dei thread va agli stream; per molte dashboard
+# aperte servire l'app con asgi.py (uvicorn), dove gli stream non usano thread.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+os.environ.setdefault('SSE_MAX_STREAM_WSGI', str(max(threads // 2, 1)))
+
+# Con più worker gli eventi SSE devono raggiungere gli stream degli altri
+# processi: solo il backend PostgreSQL (LISTEN/NOTIFY) lo fa. Va impostato
+# prima che preload_app importi services.eventi.
+if workers > 1 and os.environ.setdefault('EVENTI_BACKEND', 'postgres') != 'postgres':
+    raise RuntimeError(f"EVENTI_BACKEND={os.environ['EVENTI_BACKEND']} consegna gli eventi solo nel processo "
+                       f"che li pubblica: con {workers} worker usare EVENTI_BACKEND=postgres")
+
+# L'app (template precompilati, engine, moduli delle rotte) viene costruita una
+# sola volta nel master e condivisa copy-on-write con i worker.
+preload_app = True
+
+
+def post_fork(server, worker):
+    """
+    Ogni worker crea il proprio pool: le connessioni del master non vanno
+    condivise e i thread dei pool (query, grafici, export) non esistono nel figlio.
+    Il listener degli eventi parte subito, così il worker invalida le proprie
+    cache per le modifiche degli altri anche senza dashboard aperte.
+    """
+    Database().dispose_after_fork()
+    parallelo.chiudi_pool()
+    grafici.chiudi_pool()
+    export_xlsx.chiudi_pool()
+    eventi.bus.avvia_listener()
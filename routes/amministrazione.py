@@ -0,0 +1,35 @@
+from flask import Blueprint, render_template, session, send_file
+
+from routes.common import login_required
+from services import profiler
+
+bp = Blueprint('amministrazione', __name__)
+
+
+# --- PROFILI DELLE RICHIESTE (SOLO UFFICIO ORIENTAMENTO) ---
+
+@bp.route('/admin/profili')
+@login_required
+def profili():
+    """Catture recenti del profiler, dalla più lenta (vedi services/profiler.py)."""
+    if session.get('ruolo') != 'Ufficio Orientamento':
+        return "Accesso Negato", 403
+
+    return render_template('profili.html',
+                           catture=profiler.elenco_catture(),
+                           frazione=profiler.PROFILER_FRAZIONE,
+                           header=profiler.HEADER,
+                           struttura=session.get('struttura'))
+
+
+@bp.route('/admin/profili/<nome>')
+@login_required
+def scarica_profilo(nome):
+    """File collapsed stack di una cattura, da aprire con speedscope o flamegraph.pl."""
+    if session.get('ruolo') != 'Ufficio Orientamento':
+        return "Accesso Negato", 403
+
+    percorso = profiler.percorso_cattura(nome)
+    if percorso is None:
+        return "Cattura non trovata", 404
+    return send_file(percorso, mimetype='text/plain', as_attachment=True, download_name=nome)
@@ -0,0 +1,496 @@
+from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+
+from database.db_connection import Database
+from database.models import (
+    PersonaleUniversitario, Scuola, IndirizzoScolastico, PersonaleScolastico
+)
+from database.read_models import (
+    righe_lazy, PersonaleRiga, ScuolaRiga, IndirizzoRiga, STMT_PERSONALE, STMT_SCUOLE, STMT_INDIRIZZI
+)
+from routes.common import (
+    login_required, get_common_options, verifica_versione, VersioneNonValida, MSG_CONFLITTO
+)
+
+bp = Blueprint('anagrafiche', __name__)
+
+
+def upsert_personale_scolastico(session_db, email, nome, cognome):
+    """Gestisce inserimento/check personale scolastico."""
+    personale = session_db.get(PersonaleScolastico, email)
+    if personale:
+        if personale.nome.lower() == nome.lower() and personale.cognome.lower() == cognome.lower():
+            return True, None
+        else:
+            error_msg = f"L'email '{email}' è già associata a '{personale.nome} {personale.cognome}'."
+            return False, error_msg
+    else:
+        nuovo_personale = PersonaleScolastico(
+            email=email,
+            nome=nome,
+            cognome=cognome
+        )
+        session_db.add(nuovo_personale)
+        return True, None
+
+
+# --- LISTE SEMPLICI ---
+
+@bp.route('/personale')
+@login_required
+def personale_universitario():
+    session_db = Database().get_session()
+    # La query viene eseguita solo se il frammento della tabella non è in cache
+    personale = righe_lazy(session_db, STMT_PERSONALE, PersonaleRiga)
+    return render_template('personale.html',
+                           personale_list=personale,
+                           struttura=session.get('struttura'))
+
+
+@bp.route('/scuole')
+@login_required
+def scuole():
+    session_db = Database().get_session()
+    scuole_list = righe_lazy(session_db, STMT_SCUOLE, ScuolaRiga)
+    return render_template('scuola.html',
+                           scuole_list=scuole_list,
+                           struttura=session.get('struttura'))
+
+
+@bp.route('/indirizzi')
+@login_required
+def indirizzi_scolastici():
+    session_db = Database().get_session()
+    indirizzi_list = righe_lazy(session_db, STMT_INDIRIZZI, IndirizzoRiga)
+    return render_template('indirizzi.html',
+                           indirizzi_list=indirizzi_list,
+                           struttura=session.get('struttura'))
+
+
+# --- CRUD PERSONALE ---
+
+@bp.route('/personale/inserisci', methods=['GET', 'POST'])
+@login_required
+def inserisci_personale():
+    session_db = Database().get_session()
+    if session.get('ruolo') != 'Ufficio Orientamento' and session.get('struttura') == 'Ateneo di Verona':
+        return "Non autorizzato", 403
+
+    error = None
+    return_to = request.values.get('return_to')
+    return_id = request.values.get('return_id')
+
+    if request.method == 'POST':
+        email = request.form.get('email')
+        try:
+            existing_personale = session_db.get(PersonaleUniversitario, email)
+            if existing_personale:
+                raise IntegrityError(
+                    f"L'email '{email}' è già associata a '{existing_personale.nome} {existing_personale.cognome}'.",
+                    params=None, orig=None)
+
+            nuovo_personale = PersonaleUniversitario(
+                email=email,
+                nome=request.form['nome'],
+                cognome=request.form['cognome']
+            )
+            session_db.add(nuovo_personale)
+            session_db.commit()
+
+            if return_to:
+                if return_id:
+                    return redirect(url_for(return_to, id_attivita=int(return_id)))
+                else:
+                    return redirect(url_for(return_to))
+            return redirect(url_for('anagrafiche.personale_universitario'))
+
+        except IntegrityError as e:
+            session_db.rollback()
+            if e.orig:
+                error = str(e.orig.args[0]).capitalize()
+            else:
+                error = f"L'email '{email}' è già esistente."
+            return render_template('form_personale.html', modalita='inserisci', personale=None, error=error,
+                                   form_data=request.form, return_to=return_to, return_id=return_id)
+        except Exception as e:
+            session_db.rollback()
+            error = str(e).capitalize()
+            return render_template('form_personale.html', modalita='inserisci', personale=None, error=error,
+                                   form_data=request.form, return_to=return_to, return_id=return_id)
+
+    return render_template('form_personale.html', modalita='inserisci', personale=None, error=error, form_data=None,
+                           return_to=return_to, return_id=return_id)
+
+
+@bp.route('/personale/modifica/<string:email>', methods=['GET', 'POST'])
+@login_required
+def modifica_personale(email):
+    session_db = Database().get_session()
+    if session.get('ruolo') != 'Ufficio Orientamento' and session.get('struttura') == 'Ateneo di Verona':
+        return "Non autorizzato", 403
+
+    personale = session_db.get(PersonaleUniversitario, email)
+    if not personale:
+        return "Personale non trovato", 404
+
+    error = None
+    return_to = request.values.get('return_to')
+    return_id = request.values.get('return_id')
+
+    if request.method == 'POST':
+        try:
+            personale.nome = request.form['nome']
+            personale.cognome = request.form['cognome']
+            session_db.commit()
+
+            if return_to:
+                if return_id:
+                    return redirect(url_for(return_to, id_attivita=int(return_id)))
+                else:
+                    return redirect(url_for(return_to))
+            return redirect(url_for('anagrafiche.personale_universitario'))
+
+        except Exception as e:
+            session_db.rollback()
+            error = str(e).capitalize()
+
+    return render_template('form_personale.html',
+                           modalita='modifica',
+                           personale=personale,
+                           error=error,
+                           form_data=request.form if error else None,
+                           return_to=return_to,
+                           return_id=return_id)
+
+
+@bp.route('/personale/cancella/<string:email>', methods=['POST'])
+@login_required
+def cancella_personale(email):
+    session_db = Database().get_session()
+    if session.get('ruolo') != 'Ufficio Orientamento' and session.get('struttura') == 'Ateneo di Verona':
+        return jsonify({'success': False, 'error': 'Non autorizzato'}), 403
+
+    personale = session_db.get(PersonaleUniversitario, email)
+    if not personale:
+        return jsonify({'success': False, 'error': 'Personale non trovato'}), 404
+
+    try:
+        session_db.delete(personale)
+        session_db.commit()
+        return jsonify({'success': True})
+    except IntegrityError:
+        session_db.rollback()
+        return jsonify(
+            {'success': False, 'error': 'Impossibile cancellare: questo utente è referenziato in altre tabelle.'}), 400
+    except Exception as e:
+        session_db.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# --- CRUD SCUOLA ---
+
+@bp.route('/scuole/inserisci', methods=['GET', 'POST'])
+@login_required
+def inserisci_scuola():
+    session_db = Database().get_session()
+    if session.get('ruolo') != 'Ufficio Orientamento' and session.get('struttura') == 'Ateneo di Verona':
+        return "Non autorizzato", 403
+
+    error = None
+    return_to = request.values.get('return_to')
+    return_id = request.values.get('return_id')
+
+    if request.method == 'POST':
+        try:
+            numero_completo = request.form['numero_telefonico']
+            if not numero_completo or not numero_completo.startswith('+'):
+                raise Exception("Numero di telefono non valido o mancante.")
+
+            success, error_msg = upsert_personale_scolastico(
+                session_db,
+                request.form['dirigente_email'],
+                request.form['dirigente_nome'],
+                request.form['dirigente_cognome']
+            )
+
+            if not success:
+                raise Exception(error_msg)
+
+            nuova_scuola = Scuola(
+                codice_meccanografico=request.form['codice_meccanografico'],
+                nome=request.form['nome'],
+                email=request.form['email'],
+                numero_telefonico=numero_completo,
+                via=request.form['via'],
+                numero_civico=int(request.form['numero_civico']),
+                comune=request.form['comune'],
+                dirigente=request.form['dirigente_email']
+            )
+            session_db.add(nuova_scuola)
+            session_db.commit()
+
+            if return_to:
+                if return_id:
+                    return redirect(url_for(return_to, id_attivita=int(return_id)))
+                else:
+                    return redirect(url_for(return_to))
+            return redirect(url_for('anagrafiche.scuole'))
+
+        except IntegrityError:
+            session_db.rollback()
+            error = "Codice Meccanografico già esistente."
+        except Exception as e:
+            session_db.rollback()
+            error = str(e).capitalize()
+
+    return render_template('form_scuola.html',
+                           modalita='inserisci',
+                           scuola=None,
+                           error=error,
+                           form_data=request.form if error else None,
+                           return_to=return_to,
+                           return_id=return_id)
+
+
+@bp.route('/scuole/modifica/<string:cm>', methods=['GET', 'POST'])
+@login_required
+def modifica_scuola(cm):
+    session_db = Database().get_session()
+    if session.get('ruolo') != 'Ufficio Orientamento' and session.get('struttura') == 'Ateneo di Verona':
+        return "Non autorizzato", 403
+
+    scuola = session_db.get(Scuola, cm)
+    if not scuola:
+        return "Scuola non trovata", 404
+
+    error = None
+    stato = 200
+    return_to = request.values.get('return_to')
+    return_id = request.values.get('return_id')
+
+    if request.method == 'POST':
+        try:
+            verifica_versione(scuola, request.form)
+            numero_completo = request.form['numero_telefonico']
+            if not numero_completo or not numero_completo.startswith('+'):
+                raise Exception("Numero di telefono non valido o mancante.")
+
+            success, error_msg = upsert_personale_scolastico(
+                session_db,
+                request.form['dirigente_email'],
+                request.form['dirigente_nome'],
+                request.form['dirigente_cognome']
+            )
+
+            if not success:
+                raise Exception(error_msg)
+
+            scuola.nome = request.form['nome']
+            scuola.email = request.form['email']
+            scuola.numero_telefonico = numero_completo
+            scuola.via = request.form['via']
+            scuola.numero_civico = int(request.form['numero_civico'])
+            scuola.comune = request.form['comune']
+            scuola.dirigente = request.form['dirigente_email']
+
+            session_db.commit()
+
+            if return_to:
+                if return_id:
+                    return redirect(url_for(return_to, id_attivita=int(return_id)))
+                else:
+                    return redirect(url_for(return_to))
+            return redirect(url_for('anagrafiche.scuole'))
+        except StaleDataError:
+            session_db.rollback()
+            error = MSG_CONFLITTO
+            stato = 409
+        except VersioneNonValida as e:
+            session_db.rollback()
+            error = str(e)
+            stato = 400
+        except Exception as e:
+            session_db.rollback()
+            error = str(e).capitalize()
+
+    return render_template('form_scuola.html',
+                           modalita='modifica',
+                           scuola=scuola,
+                           error=error,
+                           form_data=request.form if error else None,
+                           return_to=return_to,
+                           return_id=return_id), stato
+
+
+@bp.route('/scuole/cancella/<string:cm>', methods=['POST'])
+@login_required
+def cancella_scuola(cm):
+    session_db = Database().get_session()
+    if session.get('ruolo') != 'Ufficio Orientamento' and session.get('struttura') == 'Ateneo di Verona':
+        return jsonify({'success': False, 'error': 'Non autorizzato'}), 403
+
+    scuola = session_db.get(Scuola, cm)
+    if not scuola:
+        return jsonify({'success': False, 'error': 'Scuola non trovata'}), 404
+
+    try:
+        session_db.delete(scuola)
+        session_db.commit()
+        return jsonify({'success': True})
+    except IntegrityError:
+        session_db.rollback()
+        return jsonify(
+            {'success': False, 'error': 'Impossibile cancellare. Verifica che non ci siano riferimenti pendenti.'}), 400
+    except Exception as e:
+        session_db.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# --- CRUD INDIRIZZI ---
+
+@bp.route('/indirizzi/inserisci', methods=['GET', 'POST'])
+@login_required
+def inserisci_indirizzo():
+    session_db = Database().get_session()
+    if session.get('ruolo') != 'Ufficio Orientamento' and session.get('struttura') == 'Ateneo di Verona':
+        return "Non autorizzato", 403
+
+    error = None
+    return_to = request.values.get('return_to')
+    return_id = request.values.get('return_id')
+
+    if request.method == 'POST':
+        try:
+            success, error_msg = upsert_personale_scolastico(
+                session_db,
+                request.form['referente_email'],
+                request.form['referente_nome'],
+                request.form['referente_cognome']
+            )
+
+            if not success:
+                raise Exception(error_msg)
+
+            nuovo_indirizzo = IndirizzoScolastico(
+                codice_meccanografico=request.form['codice_meccanografico'],
+                indirizzo=request.form['indirizzo'],
+                referente=request.form['referente_email']
+            )
+            session_db.add(nuovo_indirizzo)
+            session_db.commit()
+
+            if return_to:
+                if return_id:
+                    return redirect(url_for(return_to, id_attivita=int(return_id)))
+                else:
+                    return redirect(url_for(return_to))
+            return redirect(url_for('anagrafiche.indirizzi_scolastici'))
+
+        except IntegrityError:
+            session_db.rollback()
+            error = "Questo indirizzo esiste già per la scuola selezionata (chiave duplicata)."
+        except Exception as e:
+            session_db.rollback()
+            error = str(e).capitalize()
+
+    _, _, scuole_opt = get_common_options(session_db)
+    return render_template('form_indirizzo.html',
+                           modalita='inserisci',
+                           indirizzo_data=None,
+                           scuole_opt=scuole_opt,
+                           error=error,
+                           form_data=request.form if error else None,
+                           return_to=return_to,
+                           return_id=return_id)
+
+
+@bp.route('/indirizzi/modifica/<string:cm>/<path:indirizzo>', methods=['GET', 'POST'])
+@login_required
+def modifica_indirizzo(cm, indirizzo):
+    session_db = Database().get_session()
+    if session.get('ruolo') != 'Ufficio Orientamento' and session.get('struttura') == 'Ateneo di Verona':
+        return "Non autorizzato", 403
+
+    pk = (cm, indirizzo)
+    indirizzo_data = session_db.get(IndirizzoScolastico, pk)
+
+    if not indirizzo_data:
+        return "Indirizzo non trovato", 404
+
+    error = None
+    stato = 200
+    return_to = request.values.get('return_to')
+    return_id = request.values.get('return_id')
+
+    if request.method == 'POST':
+        try:
+            verifica_versione(indirizzo_data, request.form)
+            success, error_msg = upsert_personale_scolastico(
+                session_db,
+                request.form['referente_email'],
+                request.form['referente_nome'],
+                request.form['referente_cognome']
+            )
+
+            if not success:
+                raise Exception(error_msg)
+
+            indirizzo_data.referente = request.form['referente_email']
+
+            session_db.commit()
+
+            if return_to:
+                if return_id:
+                    return redirect(url_for(return_to, id_attivita=int(return_id)))
+                else:
+                    return redirect(url_for(return_to))
+            return redirect(url_for('anagrafiche.indirizzi_scolastici'))
+        except StaleDataError:
+            session_db.rollback()
+            error = MSG_CONFLITTO
+            stato = 409
+        except VersioneNonValida as e:
+            session_db.rollback()
+            error = str(e)
+            stato = 400
+        except Exception as e:
+            session_db.rollback()
+            error = str(e).capitalize()
+
+    _, _, scuole_opt = get_common_options(session_db)
+    return render_template('form_indirizzo.html',
+                           modalita='modifica',
+                           indirizzo_data=indirizzo_data,
+                           scuole_opt=scuole_opt,
+                           error=error,
+                           form_data=request.form if error else None,
+                           return_to=return_to,
+                           return_id=return_id), stato
+
+
+@bp.route('/indirizzi/cancella/<string:cm>/<path:indirizzo>', methods=['POST'])
+@login_required
+def cancella_indirizzo(cm, indirizzo):
+    session_db = Database().get_session()
+    if session.get('ruolo') != 'Ufficio Orientamento' and session.get('struttura') == 'Ateneo di Verona':
+        return jsonify({'success': False, 'error': 'Non autorizzato'}), 403
+
+    pk = (cm, indirizzo)
+    indirizzo_data = session_db.get(IndirizzoScolastico, pk)
+
+    if not indirizzo_data:
+        return jsonify({'success': False, 'error': 'Indirizzo non trovato'}), 404
+
+    try:
+        session_db.delete(indirizzo_data)
+        session_db.commit()
+        return jsonify({'success': True})
+    except IntegrityError:
+        session_db.rollback()
+        return jsonify(
+            {'success': False, 'error': 'Impossibile cancellare: questo indirizzo è referenziato nelle attività.'}), 400
+    except Exception as e:
+        session_db.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
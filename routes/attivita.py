@@ -0,0 +1,301 @@
+import re
+from datetime import date
+
+from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify
+
+from sqlalchemy.exc import IntegrityError, DataError
+from sqlalchemy.orm.exc import StaleDataError
+
+from database.db_connection import Database
+from database.queries import STMT_ATTIVITA_MODIFICA
+from database.read_models import righe, AttivitaRiga, STMT_ATTIVITA
+from database.visibility import applica_visibilita
+from database.models import (
+    AttivitaOrientamento, Collabora, Supervisiona, Partecipa
+)
+from routes.common import (
+    login_required, get_common_options, risposta_api, verifica_versione, VersioneNonValida, MSG_CONFLITTO
+)
+from services import api
+from services.eventi import pubblica_attivita
+from services.importa import importa_partecipazioni
+from services.resoconto import contributo_attivita
+
+bp = Blueprint('attivita', __name__)
+
+
+# ==============================================================================
+# HELPER FUNCTIONS
+# ==============================================================================
+
+def parse_partecipanti_form(form_data):
+    partecipanti = []
+    temp_data = {}
+    scuole_map = {}
+    regex_scuola_id = re.compile(r'scuole\[(\d+)\]\[id\]')
+    regex_indirizzo = re.compile(r'scuole\[(\d+)\]\[indirizzi\]\[(\d+)\]\[(\w+)\]')
+
+    for key, values in form_data.lists():
+        match_s = regex_scuola_id.match(key)
+        if match_s:
+            scuole_map[int(match_s.group(1))] = values[0]
+            continue
+        match_i = regex_indirizzo.match(key)
+        if match_i:
+            idx_s, idx_i, field = int(match_i.group(1)), int(match_i.group(2)), match_i.group(3)
+            if idx_s not in temp_data: temp_data[idx_s] = {}
+            if idx_i not in temp_data[idx_s]: temp_data[idx_s][idx_i] = {}
+            if field == 'classi': temp_data[idx_s][idx_i][field] = ", ".join(values)
+            else: temp_data[idx_s][idx_i][field] = values[0] if values else None
+
+    for idx_s, indirizzi in temp_data.items():
+        cm = scuole_map.get(idx_s)
+        if not cm: continue
+        for dati in indirizzi.values():
+            if not dati.get('id'): continue
+            def to_int_or_none(val): return int(val) if val and val.strip() else None
+            partecipanti.append({
+                'codice_meccanografico': cm,
+                'indirizzo': dati.get('id'),
+                'totale_studenti': to_int_or_none(dati.get('tot')),
+                'totale_maschi': to_int_or_none(dati.get('maschi')),
+                'totale_femmine': to_int_or_none(dati.get('femmine')),
+                'altro': to_int_or_none(dati.get('altro')),
+                'classi': dati.get('classi') or None
+            })
+    return partecipanti
+
+
+def salva_attivita_db(session_db, form_data, attivita_esistente=None):
+    """Gestisce il salvataggio (Inserimento o Update) di un'attività nel DB."""
+    try:
+        is_new = attivita_esistente is None
+        attivita = attivita_esistente if not is_new else AttivitaOrientamento()
+        prima = None if is_new else contributo_attivita(session_db, attivita.id_attivita)
+
+        attivita.nome = form_data.get('titolo')
+        attivita.descrizione = form_data.get('descrizione') or None
+        attivita.data_inizio = date.fromisoformat(form_data.get('data_inizio'))
+        attivita.data_fine = date.fromisoformat(form_data.get('data_fine'))
+        attivita.totale_ore = int(form_data.get('totale_ore')) if form_data.get('totale_ore') else None
+        attivita.docente_presidente = form_data.get('referente')
+        attivita.struttura_organizzante = form_data.get('dip_organizzante')
+
+        if is_new:
+            session_db.add(attivita)
+        else:
+            # La versione deve crescere anche quando cambiano solo supervisori,
+            # collaboratori o partecipanti (righe di altre tabelle): l'UPDATE
+            # usa comunque la versione letta nella WHERE
+            attivita.versione = attivita.versione + 1
+
+        session_db.flush()
+
+        if not is_new:
+            session_db.query(Supervisiona).filter_by(id_attivita=attivita.id_attivita).delete()
+            session_db.query(Collabora).filter_by(id_attivita=attivita.id_attivita).delete()
+            session_db.query(Partecipa).filter_by(id_attivita=attivita.id_attivita).delete()
+
+        for email in set(form_data.getlist('supervisori[]')):
+            if email:
+                session_db.add(Supervisiona(id_attivita=attivita.id_attivita, docente_supervisore=email))
+
+        for strut in set(form_data.getlist('collaboratori[]')):
+            if strut:
+                session_db.add(Collabora(id_attivita=attivita.id_attivita, nome_struttura=strut))
+
+        for p in parse_partecipanti_form(form_data):
+            session_db.add(Partecipa(id_attivita=attivita.id_attivita, data_inizio=attivita.data_inizio, **p))
+
+        session_db.commit()
+        pubblica_attivita(session_db, attivita.id_attivita, prima)
+        return True, None
+    except StaleDataError:
+        session_db.rollback()
+        raise
+    except IntegrityError:
+        session_db.rollback()
+        return False, "Errore di integrità nel database."
+    except Exception as e:
+        session_db.rollback()
+        return False, f"Errore imprevisto: {str(e)}"
+
+
+def dati_modulo(form_data, attivita):
+    """Dati del modulo inviato, nel formato di modifica_attivita, con la versione attuale dell'attività."""
+    dati_attivita = {
+        'id': attivita.id_attivita, 'titolo': form_data.get('titolo'), 'descrizione': form_data.get('descrizione'),
+        'totale_ore': form_data.get('totale_ore'), 'data_inizio': form_data.get('data_inizio'),
+        'data_fine': form_data.get('data_fine'), 'referente': form_data.get('referente'),
+        'dip_organizzante': form_data.get('dip_organizzante'),
+        'supervisori': [e for e in form_data.getlist('supervisori[]') if e],
+        'collaboratori': [s for s in form_data.getlist('collaboratori[]') if s],
+        'versione': attivita.versione
+    }
+    part_map = {}
+    for p in parse_partecipanti_form(form_data):
+        part_map.setdefault(p['codice_meccanografico'], []).append(
+            {'indirizzo': p['indirizzo'], 'tot': p['totale_studenti'], 'maschi': p['totale_maschi'],
+             'femmine': p['totale_femmine'], 'altro': p['altro'], 'classi': p['classi']})
+    return dati_attivita, part_map
+
+
+def render_modifica(session_db, dati_attivita, part_map, error=None):
+    """Modulo di modifica di un'attività, con gli indirizzi delle scuole presenti già inclusi."""
+    # Indirizzi di tutte le scuole già presenti, inclusi nella pagina: nessuna chiamata API all'apertura
+    stmt, params, payload = api.api_indirizzi_scuole(','.join(part_map))
+    indirizzi_preload = payload(session_db.execute(stmt, params).all()) if stmt is not None else {}
+
+    p_opt, strutture, s_opt = get_common_options(session_db)
+    return render_template('form_attivita.html', modalita='modifica', attivita=dati_attivita,
+                           scuole_preload=[{'id_scuola': cm, 'indirizzi': inds} for cm, inds in part_map.items()],
+                           indirizzi_preload=indirizzi_preload,
+                           personale_opt=p_opt, strutture=strutture, scuole_opt=s_opt, error=error)
+
+# ==============================================================================
+# ROTTE ATTIVITA'
+# ==============================================================================
+
+@bp.route('/attivita')
+@login_required
+def attivita():
+    session_db = Database().get_session()
+    oggi, struttura = date.today(), session.get('struttura')
+    ordine = (
+        AttivitaOrientamento.data_inizio.asc(), AttivitaOrientamento.data_fine.asc(), AttivitaOrientamento.nome.asc())
+    base = applica_visibilita(STMT_ATTIVITA, struttura)
+    prog = righe(session_db, base.where(AttivitaOrientamento.data_inizio > oggi).order_by(*ordine), AttivitaRiga)
+    svolte = righe(session_db, base.where(AttivitaOrientamento.data_inizio <= oggi).order_by(*ordine), AttivitaRiga)
+    return render_template('attivita.html',
+                           attivita_svolte=[
+                               {'id': a.id_attivita, 'titolo': a.nome, 'inizio': a.data_inizio.strftime("%d/%m/%Y"),
+                                'fine': a.data_fine.strftime("%d/%m/%Y")} for a in svolte],
+                           attivita_programmate=[
+                               {'id': a.id_attivita, 'titolo': a.nome, 'inizio': a.data_inizio.strftime("%d/%m/%Y"),
+                                'fine': a.data_fine.strftime("%d/%m/%Y")} for a in prog],
+                           struttura=struttura, user=session['user'])
+
+
+@bp.route('/inserisci_attivita', methods=['GET', 'POST'])
+@login_required
+def inserisci_attivita():
+    session_db = Database().get_session()
+    if request.method == 'POST':
+        success, msg = salva_attivita_db(session_db, request.form)
+        if success:
+            return redirect(url_for('attivita.attivita'))
+        else:
+            return f"Errore inserimento: {msg}", 400
+    p_opt, strutture, s_opt = get_common_options(session_db)
+    return render_template('form_attivita.html', modalita='inserisci', attivita=None, personale_opt=p_opt,
+                           strutture=strutture, scuole_opt=s_opt)
+
+
+@bp.route('/modifica_attivita/<int:id_attivita>', methods=['GET', 'POST'])
+@login_required
+def modifica_attivita(id_attivita):
+    session_db = Database().get_session()
+    attivita = session_db.execute(STMT_ATTIVITA_MODIFICA, {'id_attivita': id_attivita}).scalars().first()
+    if not attivita: return "Attività non trovata", 404
+    if session['ruolo'] != 'Ufficio Orientamento' and attivita.struttura_organizzante != session['struttura']:
+        return "Non hai i permessi per modificare questa attività", 403
+
+    if request.method == 'POST':
+        try:
+            verifica_versione(attivita, request.form)
+            success, msg = salva_attivita_db(session_db, request.form, attivita_esistente=attivita)
+        except StaleDataError:
+            error, stato = MSG_CONFLITTO, 409
+        except VersioneNonValida as e:
+            error, stato = str(e), 400
+        else:
+            if success:
+                return redirect(url_for('attivita.attivita'))
+            return f"Errore modifica: {msg}", 400
+        # Il modulo torna con i dati inviati e la versione attuale del record
+        session_db.rollback()
+        attivita = session_db.get(AttivitaOrientamento, id_attivita)
+        if not attivita: return "Attività non trovata", 404
+        dati_attivita, part_map = dati_modulo(request.form, attivita)
+        return render_modifica(session_db, dati_attivita, part_map, error), stato
+
+    dati_attivita = {
+        'id': attivita.id_attivita, 'titolo': attivita.nome, 'descrizione': attivita.descrizione,
+        'totale_ore': attivita.totale_ore, 'data_inizio': attivita.data_inizio.isoformat(),
+        'data_fine': attivita.data_fine.isoformat(), 'referente': attivita.docente_presidente,
+        'dip_organizzante': attivita.struttura_organizzante,
+        'supervisori': [s.docente_supervisore for s in attivita.supervisioni],
+        'collaboratori': [c.nome_struttura for c in attivita.collaborazioni],
+        'versione': attivita.versione
+    }
+    part_map = {}
+    for p in attivita.partecipazioni:
+        if p.codice_meccanografico not in part_map: part_map[p.codice_meccanografico] = []
+        part_map[p.codice_meccanografico].append(
+            {'indirizzo': p.indirizzo, 'tot': p.totale_studenti, 'maschi': p.totale_maschi,
+             'femmine': p.totale_femmine, 'altro': p.altro, 'classi': p.classi})
+    return render_modifica(session_db, dati_attivita, part_map)
+
+
+@bp.route('/cancella_attivita/<int:id_attivita>', methods=['POST'])
+@login_required
+def cancella_attivita(id_attivita):
+    session_db = Database().get_session()
+    attivita = session_db.get(AttivitaOrientamento, id_attivita)
+
+    if not attivita:
+        return jsonify({'success': False, 'error': 'Attività non trovata'}), 404
+    if session['ruolo'] != 'Ufficio Orientamento' and attivita.struttura_organizzante != session['struttura']:
+        return jsonify({'success': False, 'error': 'Non hai i permessi per cancellare questa attività'}), 403
+
+    prima = contributo_attivita(session_db, id_attivita)
+    try:
+        session_db.query(Supervisiona).filter_by(id_attivita=id_attivita).delete()
+        session_db.query(Collabora).filter_by(id_attivita=id_attivita).delete()
+        session_db.query(Partecipa).filter_by(id_attivita=id_attivita).delete()
+
+        session_db.delete(attivita)
+        session_db.commit()
+        pubblica_attivita(session_db, id_attivita, prima)
+        return jsonify({'success': True})
+    except Exception as e:
+        session_db.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@bp.route('/import/partecipazioni', methods=['POST'])
+@login_required
+def importa_partecipazioni_csv():
+    """
+    Import massivo delle partecipazioni: il CSV arriva come corpo della
+    richiesta (text/csv) o come campo 'file' di un form, e viene letto in
+    streaming senza caricarlo in memoria.
+    """
+    if session['ruolo'] != 'Ufficio Orientamento':
+        return jsonify({'success': False, 'error': 'Non autorizzato'}), 403
+
+    file = request.files['file'].stream if 'file' in request.files else request.stream
+    session_db = Database().get_session()
+    try:
+        righe = importa_partecipazioni(session_db, file)
+        session_db.commit()
+        return jsonify({'success': True, 'righe': righe})
+    except (ValueError, IntegrityError, DataError) as e:
+        session_db.rollback()
+        return jsonify({'success': False, 'error': str(getattr(e, 'orig', e))}), 400
+    except Exception as e:
+        session_db.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@bp.route('/api/indirizzi')
+@login_required
+def get_indirizzi_scuole():
+    """Indirizzi di più scuole in una sola query: /api/indirizzi?scuole=CM1,CM2,..."""
+    return risposta_api(*api.api_indirizzi_scuole(request.args.get('scuole', '')))
+
+
+@bp.route('/api/indirizzi/<codice_scuola>')
+@login_required
+def get_indirizzi_scuola(codice_scuola):
+    return risposta_api(*api.api_indirizzi_scuola(codice_scuola))
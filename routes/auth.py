@@ -0,0 +1,34 @@
+from flask import Blueprint, render_template, request, redirect, url_for, session
+
+from bcrypt import checkpw
+
+from database.db_connection import Database
+from database.queries import STMT_UTENTE_PER_EMAIL
+from routes.common import login_required
+
+bp = Blueprint('auth', __name__)
+
+
+@bp.route('/', methods=['GET', 'POST'])
+def login():
+    error = None
+    session_db = Database().get_session()
+    if request.method == 'POST':
+        email, password = request.form['email'], request.form['password']
+        utente = session_db.execute(STMT_UTENTE_PER_EMAIL, {'email': email}).scalars().first()
+        if utente and checkpw(password.encode('utf-8'), utente.password.encode('utf-8')):
+            session.permanent = True
+            session['user'] = utente.email
+            session['ruolo'] = utente.ruolo
+            session['struttura'] = utente.struttura_afferita
+            return redirect(url_for('attivita.attivita'))
+        else:
+            error = "Email o password non corretti"
+    return render_template('login.html', error=error)
+
+
+@bp.route('/logout', methods=['POST'])
+@login_required
+def logout():
+    session.clear()
+    return redirect(url_for('auth.login'))
@@ -0,0 +1,87 @@
+from functools import wraps
+from collections import Counter
+
+from flask import session, redirect, url_for, jsonify
+from sqlalchemy.orm.exc import StaleDataError
+
+from database.db_connection import Database
+from database.versioning import data_version
+from services.template_cache import fragment_cache
+
+from database.read_models import (
+    righe, PersonaleRiga, ScuolaOpzione, StrutturaRiga, STMT_PERSONALE, STMT_SCUOLE_OPZIONI, STMT_STRUTTURE
+)
+
+
+MSG_CONFLITTO = ("Il record è stato modificato da un altro utente dopo l'apertura del modulo. "
+                 "Il modulo riporta le tue modifiche sulla versione attuale: verificale e salva di nuovo.")
+MSG_VERSIONE_NON_VALIDA = "Versione del record mancante o non valida: ricarica la pagina e riapplica le modifiche."
+
+
+class VersioneNonValida(ValueError):
+    """Modulo di modifica inviato senza una versione intera del record."""
+
+
+def verifica_versione(record, form):
+    """
+    Solleva StaleDataError se il modulo è stato aperto su una versione del
+    record diversa da quella attuale, VersioneNonValida se non la riporta. Il
+    commit ripete lo stesso controllo in SQL (UPDATE ... WHERE versione = ?)
+    per le modifiche concorrenti successive.
+    """
+    inviata = form.get('versione', type=int)
+    if inviata is None:
+        raise VersioneNonValida(MSG_VERSIONE_NON_VALIDA)
+    if inviata != record.versione:
+        raise StaleDataError(MSG_CONFLITTO)
+
+
+def login_required(f):
+    """Decoratore per proteggere le rotte richiedendo che l'utente sia loggato."""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user' not in session:
+            return redirect(url_for('auth.login'))
+        # Autore delle modifiche per il registro (database/audit.py)
+        Database().get_session().info['utente'] = session['user']
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+def _opzioni_personale(session_db):
+    p_raw = righe(session_db, STMT_PERSONALE, PersonaleRiga)
+    p_counts = Counter((p.nome.lower(), p.cognome.lower()) for p in p_raw)
+    return [{'id': p.email, 'text': f"{p.cognome} {p.nome} - {p.email}" if p_counts[(
+        p.nome.lower(), p.cognome.lower())] > 1 else f"{p.cognome} {p.nome}"} for p in p_raw]
+
+
+def _opzioni_scuole(session_db):
+    s_raw = righe(session_db, STMT_SCUOLE_OPZIONI, ScuolaOpzione)
+    s_counts = Counter(s.nome.lower() for s in s_raw)
+    return [{'id': s.codice_meccanografico,
+             'text': f"{s.nome} - {s.codice_meccanografico}" if s_counts[s.nome.lower()] > 1 else s.nome} for s in
+            s_raw]
+
+
+def _opzioni(nome, tabella, calcola):
+    """
+    Lista di opzioni nella cache dei frammenti, con la stessa chiave di versione
+    dei blocchi {% cache %} che la usano: finché la tabella non cambia la
+    richiesta non esegue query.
+    """
+    return fragment_cache.get_or_render(('opzioni', nome, data_version(tabella)), calcola)
+
+
+def get_common_options(session_db):
+    """Recupera liste per select (le liste restituite sono condivise: non modificarle)."""
+    p_opt = _opzioni('personale', 'personale_universitario', lambda: _opzioni_personale(session_db))
+    strutture = _opzioni('strutture', 'struttura', lambda: righe(session_db, STMT_STRUTTURE, StrutturaRiga))
+    s_opt = _opzioni('scuole', 'scuola', lambda: _opzioni_scuole(session_db))
+    return p_opt, strutture, s_opt
+
+
+def risposta_api(stmt, params, payload):
+    """Esegue lo statement di un'API JSON (se presente) e restituisce il payload."""
+    rows = Database().get_session().execute(stmt, params).all() if stmt is not None else []
+    return jsonify(payload(rows))
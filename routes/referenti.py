@@ -0,0 +1,186 @@
+from datetime import datetime
+
+from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify
+
+from bcrypt import hashpw, gensalt
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from database.audit import cerca_modifiche
+from database.db_connection import Database
+from database.models import UtenteApplicazione, PersonaleUniversitario
+from database.read_models import (
+    righe, righe_lazy, ReferenteRiga, StrutturaRiga, STMT_REFERENTI, STMT_STRUTTURE
+)
+from routes.common import login_required
+
+bp = Blueprint('referenti', __name__)
+
+
+# --- CRUD REFERENTI (UTENTI APP - SOLO UFFICIO ORIENTAMENTO) ---
+
+@bp.route('/referenti')
+@login_required
+def lista_referenti():
+    if session.get('ruolo') != 'Ufficio Orientamento':
+        return "Accesso Negato", 403
+
+    session_db = Database().get_session()
+    referenti = righe_lazy(session_db, STMT_REFERENTI, ReferenteRiga)
+
+    return render_template('referenti.html', referenti_list=referenti, struttura=session.get('struttura'))
+
+
+@bp.route('/referenti/inserisci', methods=['GET', 'POST'])
+@login_required
+def inserisci_referente():
+    if session.get('ruolo') != 'Ufficio Orientamento':
+        return "Accesso Negato", 403
+
+    session_db = Database().get_session()
+    error = None
+
+    if request.method == 'POST':
+        try:
+            email = request.form['email']
+            nome = request.form['nome']
+            cognome = request.form['cognome']
+            password = request.form['password']
+            confirm_password = request.form['confirm_password']
+            ruolo = request.form['ruolo']
+            struttura_afferita = request.form['struttura_afferita']
+
+            if password != confirm_password:
+                raise Exception("Le password non coincidono.")
+
+            personale = session_db.get(PersonaleUniversitario, email)
+
+            if personale:
+                if personale.nome.lower() != nome.lower() or personale.cognome.lower() != cognome.lower():
+                    raise Exception("Questa email è già associata ad un altro utente (nome/cognome diversi).")
+            else:
+                nuovo_personale = PersonaleUniversitario(email=email, nome=nome, cognome=cognome)
+                session_db.add(nuovo_personale)
+                session_db.flush()
+
+            hashed_pw = hashpw(password.encode('utf-8'), gensalt()).decode('utf-8')
+
+            nuovo_utente = UtenteApplicazione(
+                email=email,
+                password=hashed_pw,
+                ruolo=ruolo,
+                struttura_afferita=struttura_afferita
+            )
+            session_db.add(nuovo_utente)
+            session_db.commit()
+
+            return redirect(url_for('referenti.lista_referenti'))
+
+        except IntegrityError:
+            session_db.rollback()
+            error = "Utente già esistente."
+        except Exception as e:
+            session_db.rollback()
+            error = str(e)
+
+    strutture = righe(session_db, STMT_STRUTTURE, StrutturaRiga)
+    return render_template('form_referente.html',
+                           modalita='inserisci',
+                           referente=None,
+                           strutture=strutture,
+                           error=error,
+                           struttura=session.get('struttura'))
+
+
+@bp.route('/referenti/modifica/<string:email>', methods=['GET', 'POST'])
+@login_required
+def modifica_referente(email):
+    if session.get('ruolo') != 'Ufficio Orientamento':
+        return "Accesso Negato", 403
+
+    session_db = Database().get_session()
+    referente = session_db.get(UtenteApplicazione, email, options=[joinedload(UtenteApplicazione.informazioni_personali)])
+
+    if not referente:
+        return "Referente non trovato", 404
+
+    is_self = (email == session.get('user'))
+    error = None
+
+    if request.method == 'POST':
+        try:
+            if not is_self:
+                nome = request.form['nome']
+                cognome = request.form['cognome']
+                ruolo = request.form['ruolo']
+                struttura_afferita = request.form['struttura_afferita']
+
+                if referente.informazioni_personali:
+                    referente.informazioni_personali.nome = nome
+                    referente.informazioni_personali.cognome = cognome
+
+                referente.ruolo = ruolo
+                referente.struttura_afferita = struttura_afferita
+
+            new_password = request.form.get('password')
+            if new_password and new_password.strip():
+                hashed_pw = hashpw(new_password.encode('utf-8'), gensalt()).decode('utf-8')
+                referente.password = hashed_pw
+
+            session_db.commit()
+            return redirect(url_for('referenti.lista_referenti'))
+
+        except Exception as e:
+            session_db.rollback()
+            error = str(e)
+
+    strutture = righe(session_db, STMT_STRUTTURE, StrutturaRiga)
+    return render_template('form_referente.html',
+                           modalita='modifica',
+                           referente=referente,
+                           strutture=strutture,
+                           error=error,
+                           is_self=is_self,
+                           struttura=session.get('struttura'))
+
+
+@bp.route('/referenti/cancella/<string:email>', methods=['POST'])
+@login_required
+def cancella_referente(email):
+    if session.get('ruolo') != 'Ufficio Orientamento':
+        return jsonify({'success': False, 'error': 'Non autorizzato'}), 403
+
+    session_db = Database().get_session()
+    referente = session_db.get(UtenteApplicazione, email)
+
+    if not referente:
+        return jsonify({'success': False, 'error': 'Referente non trovato'}), 404
+
+    if referente.email == session.get('user'):
+        return jsonify({'success': False, 'error': 'Non puoi cancellare il tuo stesso account.'}), 400
+
+    try:
+        session_db.delete(referente)
+        session_db.commit()
+        return jsonify({'success': True})
+    except Exception as e:
+        session_db.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@bp.route('/api/registro_modifiche')
+@login_required
+def api_registro_modifiche():
+    """Registro modifiche: ?entita=<tabella>&chiave=<pk>&dal=<data>&al=<data>&limite=<n>"""
+    if session.get('ruolo') != 'Ufficio Orientamento':
+        return jsonify({'error': 'Accesso Negato'}), 403
+
+    try:
+        dal = datetime.fromisoformat(request.args['dal']) if request.args.get('dal') else None
+        al = datetime.fromisoformat(request.args['al']) if request.args.get('al') else None
+    except ValueError:
+        return jsonify({'error': 'Date non valide (formato ISO, es. 2024-01-31)'}), 400
+    limite = min(request.args.get('limite', 200, type=int), 1000)
+
+    return jsonify(cerca_modifiche(Database().get_session(), request.args.get('entita'), request.args.get('chiave'),
+                                   dal, al, limite))
@@ -0,0 +1,288 @@
+import os
+
+from flask import (
+    Blueprint, render_template, request, session, Response, jsonify, stream_with_context, send_file, redirect, url_for
+)
+
+from database.counters import anni_disponibili
+from database.db_connection import Database
+from database.versioning import data_version
+from database.visibility import struttura_resoconto
+from database.models import Struttura
+from routes.common import login_required, risposta_api
+from services.export import stream_export_csv
+from services import export_xlsx, grafici
+from services.analisi import copertura_comuni
+from services.resoconto import WIDGET_RESOCONTO, confronto_strutture
+from services.snapshot import aggregati_snapshot, righe_export_snapshot, anni_chiusi
+from services.cache_dati import cache_report
+from services.eventi import stream_sse
+from services.resoconto_attivita import carica_dettaglio, contesto_resoconto, versione_resoconto
+from services import api
+
+bp = Blueprint('reportistica', __name__)
+
+
+# --- ROTTE RESOCONTO ATTIVITA' (DETTAGLIO) E EXPORT ---
+
+@bp.route('/resoconto_attivita/<int:id_attivita>')
+@login_required
+def resoconto_attivita(id_attivita):
+    session_db = Database().get_session()
+
+    attivita = carica_dettaglio(session_db, id_attivita)
+
+    if not attivita:
+        return "Attività non trovata", 404
+
+    # ?stampa=1: grafici come immagini renderizzate dal server, senza JavaScript
+    stampa = request.args.get('stampa') == '1' and grafici.grafici_disponibili()
+    return render_template('resoconto_attivita.html',
+                           struttura=session.get('struttura'),
+                           stampa=stampa,
+                           **contesto_resoconto(attivita))
+
+
+MSG_GRAFICI_NON_DISPONIBILI = "Grafici lato server non disponibili: installare il pacchetto matplotlib."
+
+
+@bp.route('/resoconto_attivita/<int:id_attivita>/grafico/<nome>.<formato>')
+@login_required
+def resoconto_attivita_grafico(id_attivita, nome, formato):
+    """
+    Grafico del resoconto (scuole, indirizzi, sesso) in PNG o SVG. L'ETag
+    deriva dalla versione dell'attività: 304 e file già in cache senza
+    caricarne il dettaglio; se il rendering non termina in tempo la
+    risposta è 202 con Retry-After.
+    """
+    if nome not in grafici.GRAFICI or formato not in grafici.FORMATI:
+        return "Grafico non trovato", 404
+    if not grafici.grafici_disponibili():
+        return MSG_GRAFICI_NON_DISPONIBILI, 501
+
+    session_db = Database().get_session()
+    versione = versione_resoconto(session_db, id_attivita)
+    if versione is None:
+        return "Attività non trovata", 404
+    etag = grafici.etag(id_attivita, versione, nome, formato)
+    if etag in request.if_none_match:
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    percorso = grafici.file_per_etag(etag, formato)
+    if percorso is not None:
+        return send_file(percorso, mimetype=grafici.FORMATI[formato], etag=etag, max_age=0)
+
+    attivita = carica_dettaglio(session_db, id_attivita)
+    if not attivita:
+        return "Attività non trovata", 404
+    etichette, valori = grafici.dati_grafico(contesto_resoconto(attivita), nome)
+    if not sum(valori):
+        return "Nessun dato per il grafico", 404
+
+    percorso, chiave = grafici.file_grafico(nome, formato, etichette, valori)
+    if percorso is None:
+        return Response("Grafico in preparazione", status=202, headers={'Retry-After': '2'})
+    grafici.registra_etag(etag, chiave)
+    return send_file(percorso, mimetype=grafici.FORMATI[formato], etag=etag, max_age=0)
+
+
+@bp.route('/export/report.csv')
+@login_required
+def export_report():
+    if session.get('struttura') != 'Ateneo di Verona':
+        return "Non autorizzato", 403
+
+    anno = request.args.get('year', type=int)
+    # stream_with_context: la sessione resta aperta finché lo stream non termina
+    contenuto = stream_export_csv(Database().get_session(), anno, righe=righe_export_snapshot(anno))
+
+    nome_file = f"report_attivita_{anno}.csv" if anno else "report_attivita.csv"
+    response = Response(stream_with_context(contenuto), mimetype='text/csv')
+    response.headers["Content-Disposition"] = f"attachment; filename={nome_file}"
+    response.headers["Content-Type"] = "text/csv; charset=utf-8"
+    return response
+
+
+MSG_XLSX_NON_DISPONIBILE = "Export XLSX non disponibile: installare il pacchetto xlsxwriter."
+
+
+def _risposta_xlsx(percorso, nome_file):
+    response = Response(export_xlsx.invia_file(percorso),
+                        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    response.headers["Content-Disposition"] = f"attachment; filename={nome_file}"
+    response.headers["Content-Length"] = str(os.path.getsize(percorso))
+    return response
+
+
+@bp.route('/export/report.xlsx')
+@login_required
+def export_report_xlsx():
+    """
+    Stesso contenuto di export_report, in un foglio Excel con date e numeri
+    tipizzati. Il file viene generato in background: la risposta rimanda alla
+    pagina da cui scaricarlo quando è pronto.
+    """
+    if session.get('struttura') != 'Ateneo di Verona':
+        return "Non autorizzato", 403
+    if not export_xlsx.xlsx_disponibile():
+        return MSG_XLSX_NON_DISPONIBILE, 501
+
+    id_export = export_xlsx.avvia_export(request.args.get('year', type=int))
+    return redirect(url_for('reportistica.scarica_export_xlsx', id_export=id_export), 303)
+
+
+@bp.route('/export/xlsx/<id_export>')
+@login_required
+def scarica_export_xlsx(id_export):
+    """Il file dell'export se pronto, altrimenti una pagina che si ricarica da sola (202)."""
+    if session.get('struttura') != 'Ateneo di Verona':
+        return "Non autorizzato", 403
+
+    stato, valore = export_xlsx.stato_export(id_export)
+    if stato is None:
+        return "Export non trovato o scaduto", 404
+    if stato == 'errore':
+        return f"Export non riuscito: {valore}", 500
+    if stato == 'pronto':
+        return send_file(valore, as_attachment=True, download_name=export_xlsx.nome_download(id_export),
+                         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    return render_template('export_in_corso.html'), 202, {'Refresh': '2', 'Retry-After': '2'}
+
+
+@bp.route('/resoconto_attivita/<int:id_attivita>/export.xlsx')
+@login_required
+def resoconto_attivita_xlsx(id_attivita):
+    if not export_xlsx.xlsx_disponibile():
+        return MSG_XLSX_NON_DISPONIBILE, 501
+
+    percorso = export_xlsx.file_temporaneo()
+    try:
+        partecipazioni = export_xlsx.scrivi_attivita(Database().get_session(), id_attivita, percorso)
+    except Exception:
+        os.remove(percorso)
+        raise
+    if partecipazioni is None:
+        os.remove(percorso)
+        return "Attività non trovata", 404
+    return _risposta_xlsx(percorso, f"resoconto_attivita_{id_attivita}.xlsx")
+
+
+# --- DASHBOARD GENERALE (/resoconto) ---
+
+@bp.route('/resoconto')
+@login_required
+def resoconto():
+    """
+    Struttura della dashboard: filtri e contenitori vuoti. I dati di ogni
+    widget vengono richiesti in parallelo dal browser a /api/resoconto/<widget>.
+    """
+    session_db = Database().get_session()
+    struttura = session.get('struttura')
+    dip_filter = request.args.get('dip_filter')
+    anno = request.args.get('year', type=int)
+
+    all_dips = []
+    if struttura == 'Ateneo di Verona':
+        all_dips = [r[0] for r in session_db.query(Struttura.nome).order_by(Struttura.nome).all()]
+
+    # scope, anno e anno_chiuso servono agli aggiornamenti in tempo reale (SSE)
+    return render_template('resoconto.html',
+                           struttura=struttura,
+                           scope=struttura_resoconto(struttura, dip_filter),
+                           anno=anno,
+                           anno_chiuso=anno in anni_chiusi(),
+                           selected_year=request.args.get('year', 'storico'),
+                           years_list=anni_disponibili(session_db),
+                           dip_filter=dip_filter,
+                           all_dips=all_dips,
+                           chart_sesso_labels=['Maschi', 'Femmine', 'Altro'])
+
+
+# Tabelle da cui dipendono i widget del resoconto (invalidazione della cache)
+TABELLE_RESOCONTO = ('attivita_orientamento', 'collabora', 'partecipa', 'indirizzo_scolastico', 'scuola')
+
+
+def _risposta_cache(chiave, calcola):
+    """
+    Dato dalla cache stale-while-revalidate, con l'header Age (secondi dal
+    calcolo). `calcola(session_db)` gira su una sessione propria perché può
+    essere eseguita in background.
+    """
+    def calcola_con_sessione():
+        with Database().session_factory() as session_db:
+            return calcola(session_db)
+
+    # Richieste con Cache-Control: no-cache (ricaricamento dopo un evento
+    # di modifica): niente dato calcolato su una versione superata
+    rivalida = bool(request.cache_control.no_cache) or request.cache_control.max_age == 0
+    valore, eta = cache_report.get(chiave, data_version(*TABELLE_RESOCONTO), calcola_con_sessione, rivalida)
+    response = jsonify(valore)
+    response.headers['Age'] = str(eta)
+    return response
+
+
+@bp.route('/api/resoconto/eventi')
+@login_required
+def api_resoconto_eventi():
+    """
+    Stream SSE delle modifiche alle attività visibili alla struttura dell'utente.
+    Con asgi.py lo stream è servito dall'event loop e non arriva qui.
+    """
+    stream = stream_sse(session.get('struttura'))
+    if stream is None:
+        # Il browser non riprova dopo un 503: la dashboard resta senza aggiornamenti in tempo reale
+        return "Troppi stream di aggiornamento aperti", 503, {'Retry-After': '60'}
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@bp.route('/api/resoconto/<widget>')
+@login_required
+def api_resoconto(widget):
+    """Dati di un singolo widget del resoconto, con gli stessi filtri di /resoconto (year, dip_filter)."""
+    struttura = session.get('struttura')
+
+    if widget == 'confronto':
+        if struttura != 'Ateneo di Verona':
+            return jsonify({'error': 'Non autorizzato'}), 403
+        return _risposta_cache(('resoconto', widget), lambda s: dict(
+            zip(('studenti', 'attivita'), confronto_strutture(s))))
+
+    if widget not in WIDGET_RESOCONTO:
+        return jsonify({'error': 'Widget sconosciuto'}), 404
+    chiave, calcola = WIDGET_RESOCONTO[widget]
+
+    scope = struttura_resoconto(struttura, request.args.get('dip_filter'))
+    anno = request.args.get('year', type=int)
+
+    # Anni chiusi: dato dallo snapshot; altrimenti calcolo sulle tabelle
+    aggregati = aggregati_snapshot(anno, scope)
+    if aggregati is not None:
+        return jsonify(aggregati[chiave])
+    return _risposta_cache(('resoconto', widget, scope, anno), lambda s: calcola(s, scope, anno))
+
+
+@bp.route('/api/cerca_attivita')
+@login_required
+def api_cerca_attivita():
+    return risposta_api(*api.api_cerca_attivita(request.args.get('q', ''), session.get('struttura')))
+
+
+@bp.route('/api/confronta_edizioni')
+@login_required
+def api_confronta_edizioni():
+    return risposta_api(*api.api_confronta_edizioni(request.args.get('ids', '')))
+
+
+@bp.route('/api/serie_edizioni')
+@login_required
+def api_serie_edizioni():
+    return risposta_api(*api.api_serie_edizioni(request.args.get('id', ''), session.get('struttura')))
+
+
+@bp.route('/api/copertura_comuni')
+@login_required
+def api_copertura_comuni():
+    """Copertura per comune, con gli stessi filtri di /resoconto (year, dip_filter)."""
+    scope = struttura_resoconto(session.get('struttura'), request.args.get('dip_filter'))
+    anno = request.args.get('year', type=int)
+    return jsonify(copertura_comuni(Database().get_session(), scope, anno))
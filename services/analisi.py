@@ -0,0 +1,117 @@
+from sqlalchemy import select, func, case, extract, literal
+
+from database.models import AttivitaOrientamento, Partecipa, Scuola, IndirizzoScolastico
+from database.parallelo import esegui_in_parallelo
+from database.periodi import intervallo_anno
+from database.visibility import ATENEO, ids_visibili
+
+
+def _filtri_attivita(scope, fine=None):
+    """
+    Condizioni sulle partecipazioni e le loro attività: visibilità della
+    struttura e, se indicata, data limite (anche sulla copia in partecipa,
+    per escludere le partizioni successive).
+    """
+    filtri = []
+    if scope != ATENEO:
+        filtri.append(AttivitaOrientamento.id_attivita.in_(ids_visibili(scope)))
+    if fine is not None:
+        filtri += [AttivitaOrientamento.data_inizio < fine, Partecipa.data_inizio < fine]
+    return filtri
+
+
+def copertura_comuni(session_db, scope, anno=None):
+    """
+    Copertura territoriale per comune delle attività visibili a `scope`, in un
+    anno o sull'intero storico:
+    - scuole raggiunte sul totale delle scuole registrate nel comune;
+    - scuole ricorrenti: tra quelle raggiunte, quante hanno partecipato in
+      almeno due anni diversi (fino all'anno selezionato compreso);
+    - indirizzi raggiunti sul totale degli indirizzi registrati;
+    - studenti coinvolti.
+    Quattro query aggregate indipendenti, eseguite in parallelo (nessuna riga
+    di partecipazione arriva in Python), unite per comune.
+    """
+    inizio, fine = intervallo_anno(anno) if anno is not None else (None, None)
+    nel_periodo = literal(1) if inizio is None else case((AttivitaOrientamento.data_inizio >= inizio, 1), else_=0)
+
+    # Una riga per scuola: anni distinti di partecipazione e presenza nel periodo
+    per_scuola = (
+        select(
+            Partecipa.codice_meccanografico,
+            func.count(func.distinct(extract('year', AttivitaOrientamento.data_inizio))).label('anni'),
+            func.max(nel_periodo).label('nel_periodo'),
+        )
+        .join(AttivitaOrientamento, Partecipa.id_attivita == AttivitaOrientamento.id_attivita)
+        .where(*_filtri_attivita(scope, fine))
+        .group_by(Partecipa.codice_meccanografico)
+        .subquery()
+    )
+    q_scuole = (
+        select(
+            Scuola.comune,
+            func.count().label('raggiunte'),
+            func.coalesce(func.sum(case((per_scuola.c.anni >= 2, 1), else_=0)), 0).label('ricorrenti'),
+        )
+        .join(per_scuola, per_scuola.c.codice_meccanografico == Scuola.codice_meccanografico)
+        .where(per_scuola.c.nel_periodo == 1)
+        .group_by(Scuola.comune)
+    )
+
+    # Una riga per indirizzo raggiunto nel periodo, con i suoi studenti
+    filtri_periodo = _filtri_attivita(scope, fine)
+    if inizio is not None:
+        filtri_periodo += [AttivitaOrientamento.data_inizio >= inizio, Partecipa.data_inizio >= inizio]
+    per_indirizzo = (
+        select(
+            Partecipa.codice_meccanografico,
+            Partecipa.indirizzo,
+            func.coalesce(func.sum(Partecipa.totale_studenti), 0).label('studenti'),
+        )
+        .join(AttivitaOrientamento, Partecipa.id_attivita == AttivitaOrientamento.id_attivita)
+        .where(*filtri_periodo)
+        .group_by(Partecipa.codice_meccanografico, Partecipa.indirizzo)
+        .subquery()
+    )
+    q_indirizzi = (
+        select(Scuola.comune, func.count().label('raggiunti'), func.sum(per_indirizzo.c.studenti).label('studenti'))
+        .join(per_indirizzo, per_indirizzo.c.codice_meccanografico == Scuola.codice_meccanografico)
+        .group_by(Scuola.comune)
+    )
+
+    q_scuole_registrate = select(Scuola.comune, func.count()).group_by(Scuola.comune)
+    q_indirizzi_registrati = select(Scuola.comune, func.count()) \
+        .select_from(IndirizzoScolastico).join(Scuola).group_by(Scuola.comune)
+
+    comuni = {}
+
+    def riga(comune):
+        return comuni.setdefault(comune, {
+            'comune': comune, 'scuole_registrate': 0, 'scuole_raggiunte': 0, 'scuole_ricorrenti': 0,
+            'indirizzi_registrati': 0, 'indirizzi_raggiunti': 0, 'studenti': 0,
+        })
+
+    scuole_registrate, indirizzi_registrati, scuole, indirizzi = esegui_in_parallelo(
+        [lambda s, q=q: s.execute(q).all() for q in (q_scuole_registrate, q_indirizzi_registrati, q_scuole, q_indirizzi)],
+        session_db)
+
+    for comune, n in scuole_registrate:
+        riga(comune)['scuole_registrate'] = n
+    for comune, n in indirizzi_registrati:
+        riga(comune)['indirizzi_registrati'] = n
+    for r in scuole:
+        riga(r.comune).update(scuole_raggiunte=r.raggiunte, scuole_ricorrenti=r.ricorrenti)
+    for r in indirizzi:
+        riga(r.comune).update(indirizzi_raggiunti=r.raggiunti, studenti=r.studenti or 0)
+
+    risultato = []
+    for r in sorted(comuni.values(), key=lambda r: (-r['studenti'], r['comune'])):
+        r['copertura_scuole'] = _percentuale(r['scuole_raggiunte'], r['scuole_registrate'])
+        r['tasso_ricorrenza'] = _percentuale(r['scuole_ricorrenti'], r['scuole_raggiunte'])
+        r['copertura_indirizzi'] = _percentuale(r['indirizzi_raggiunti'], r['indirizzi_registrati'])
+        risultato.append(r)
+    return risultato
+
+
+def _percentuale(parte, totale):
+    return round(parte * 100 / totale, 1) if totale else None
@@ -0,0 +1,94 @@
+from database.queries import (
+    STMT_INDIRIZZI_SCUOLA, STMT_INDIRIZZI_SCUOLE, STMT_CERCA_ATTIVITA, STMT_CERCA_ATTIVITA_STRUTTURA,
+    STMT_CONFRONTA_EDIZIONI, STMT_SERIE_EDIZIONI, STMT_SERIE_EDIZIONI_STRUTTURA
+)
+from database.visibility import ATENEO
+
+
+# Logica delle API JSON, indipendente dal framework: ogni funzione restituisce
+# lo statement da eseguire (o None se la richiesta non richiede query), i suoi
+# parametri e una funzione che trasforma le righe nel payload JSON.
+
+def api_indirizzi_scuola(codice_scuola):
+    return STMT_INDIRIZZI_SCUOLA, {'codice_scuola': codice_scuola}, \
+        lambda rows: [{'indirizzo': r.indirizzo} for r in rows]
+
+
+def api_indirizzi_scuole(codici_param):
+    codici = sorted({c for c in codici_param.split(',') if c})
+    if not codici:
+        return None, None, lambda rows: {}
+    return STMT_INDIRIZZI_SCUOLE, {'codici': codici}, lambda rows: payload_indirizzi_scuole(codici, rows)
+
+
+def payload_indirizzi_scuole(codici, rows):
+    """Raggruppa le righe (codice, indirizzo) per scuola; le scuole senza indirizzi hanno lista vuota."""
+    risultato = {c: [] for c in codici}
+    for r in rows:
+        risultato[r.codice_meccanografico].append({'indirizzo': r.indirizzo})
+    return risultato
+
+
+def api_cerca_attivita(term, struttura):
+    if not term or len(term) < 2:
+        return None, None, lambda rows: []
+    if struttura == ATENEO:
+        stmt, params = STMT_CERCA_ATTIVITA, {'pattern': f"%{term}%"}
+    else:
+        stmt, params = STMT_CERCA_ATTIVITA_STRUTTURA, {'pattern': f"%{term}%", 'struttura': struttura}
+    return stmt, params, \
+        lambda rows: [{'id': r.id_attivita, 'nome': r.nome, 'data': r.data_inizio.strftime('%d/%m/%Y'),
+                       'struttura': r.struttura_organizzante} for r in rows]
+
+
+def api_confronta_edizioni(ids_param):
+    if not ids_param:
+        return None, None, lambda rows: {'error': 'Nessun ID specificato'}
+    ids = ids_param.split(',')
+    if not all(x.isdigit() for x in ids):
+        return None, None, lambda rows: {'error': 'ID attività non validi'}
+    ids = [int(x) for x in ids]
+    return STMT_CONFRONTA_EDIZIONI, {'ids': ids}, _payload_confronta_edizioni
+
+
+def _payload_confronta_edizioni(rows):
+    data = sorted(rows, key=lambda x: x[1])
+    return {
+        'labels': [f"{d[0]} ({d[1].year})" for d in data],
+        'values': [d[2] or 0 for d in data],
+        'maschi': [d[3] for d in data],
+        'femmine': [d[4] for d in data],
+        'altro': [(d[2] or 0) - (d[3] + d[4]) for d in data]
+    }
+
+
+def api_serie_edizioni(id_param, struttura):
+    if not id_param.isdigit():
+        return None, None, lambda rows: {'error': 'ID attività non valido'}
+    if struttura == ATENEO:
+        stmt, params = STMT_SERIE_EDIZIONI, {'id_attivita': int(id_param)}
+    else:
+        stmt, params = STMT_SERIE_EDIZIONI_STRUTTURA, {'id_attivita': int(id_param), 'struttura': struttura}
+    return stmt, params, _payload_serie_edizioni
+
+
+def _payload_serie_edizioni(rows):
+    """Serie anno su anno delle edizioni; più edizioni nello stesso anno sono etichettate per mese."""
+    rows = list(rows)
+    anni = [r.data_inizio.year for r in rows]
+    variazione = [None] * min(len(rows), 1) + [
+        round((corr.studenti - prec.studenti) * 100 / prec.studenti, 1) if prec.studenti else None
+        for prec, corr in zip(rows, rows[1:])
+    ]
+    return {
+        'ids': [r.id_attivita for r in rows],
+        'nomi': [r.nome for r in rows],
+        'labels': [r.data_inizio.strftime('%m/%Y') if anni.count(r.data_inizio.year) > 1 else str(r.data_inizio.year)
+                   for r in rows],
+        'values': [r.studenti for r in rows],
+        'scuole': [r.scuole for r in rows],
+        'maschi': [r.maschi for r in rows],
+        'femmine': [r.femmine for r in rows],
+        'altro': [r.studenti - (r.maschi + r.femmine) for r in rows],
+        'variazione': variazione
+    }
@@ -0,0 +1,106 @@
+"""
+Cache stale-while-revalidate per i dati dei report.
+
+Un valore calcolato resta "fresco" per `fresco` secondi finché la versione
+dei dati da cui dipende non cambia; dopo, e fino a `max_stale` secondi, viene
+comunque servito subito mentre un thread in background lo ricalcola. Solo in
+assenza di un valore utilizzabile la richiesta attende il calcolo.
+
+Per ogni chiave è in corso al più un calcolo (single-flight): le richieste
+concorrenti sulla stessa chiave attendono o riusano quello già avviato,
+invece di ripetere le stesse query.
+"""
+import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+class CacheSWR:
+    """Cache LRU stale-while-revalidate con calcolo single-flight per chiave."""
+
+    def __init__(self, fresco=5, max_stale=300, max_voci=512, workers=2):
+        self.fresco = fresco
+        self.max_stale = max_stale
+        self.max_voci = max_voci
+        self.workers = workers
+        self._voci = OrderedDict()      # chiave -> (istante, versione, valore)
+        self._in_corso = {}             # chiave -> Future del calcolo avviato
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def get(self, chiave, versione, calcola, rivalida=False):
+        """
+        Restituisce (valore, età in secondi). `calcola()` non riceve argomenti
+        e può essere eseguita in un altro thread: deve aprirsi la propria
+        sessione del database. Con `rivalida` un valore calcolato su una
+        versione dei dati superata non viene servito: si attende il ricalcolo.
+        """
+        adesso = time.monotonic()
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is not None:
+                self._voci.move_to_end(chiave)
+
+        if voce is not None:
+            istante, versione_voce, valore = voce
+            eta = adesso - istante
+            if eta < self.max_stale and not (rivalida and versione_voce != versione):
+                if versione_voce != versione or eta >= self.fresco:
+                    self._avvia(chiave, versione, calcola, in_background=True)
+                return valore, int(eta)
+
+        return self._avvia(chiave, versione, calcola, in_background=False).result(), 0
+
+    def _avvia(self, chiave, versione, calcola, in_background):
+        with self._lock:
+            future = self._in_corso.get(chiave)
+            if future is not None:
+                return future
+            future = self._in_corso[chiave] = Future()
+
+        if in_background:
+            future.add_done_callback(lambda f: f.exception() and logger.error(
+                "Aggiornamento in background di %s fallito: %s", chiave, f.exception()))
+            self._pool().submit(self._calcola, chiave, versione, calcola, future)
+        else:
+            self._calcola(chiave, versione, calcola, future)
+        return future
+
+    def _calcola(self, chiave, versione, calcola, future):
+        try:
+            valore = calcola()
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            with self._lock:
+                self._voci[chiave] = (time.monotonic(), versione, valore)
+                self._voci.move_to_end(chiave)
+                while len(self._voci) > self.max_voci:
+                    self._voci.popitem(last=False)
+            future.set_result(valore)
+        finally:
+            with self._lock:
+                self._in_corso.pop(chiave, None)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='swr')
+            return self._executor
+
+    def clear(self):
+        with self._lock:
+            self._voci.clear()
+
+
+cache_report = CacheSWR(
+    fresco=float(os.environ.get('REPORT_CACHE_FRESCO', 5)),
+    max_stale=float(os.environ.get('REPORT_CACHE_MAX_STALE', 300)),
+    max_voci=int(os.environ.get('REPORT_CACHE_SIZE', 512)),
+)
@@ -0,0 +1,221 @@
+"""
+Eventi in tempo reale per le dashboard aperte (Server-Sent Events).
+
+Dopo il commit di un salvataggio o di una cancellazione di un'attività viene
+pubblicato un evento con il contributo dell'attività ai widget del resoconto
+prima e dopo la modifica; il browser ne ricava il delta per la propria
+struttura e il proprio anno, senza ricaricare la pagina.
+
+Backend (variabile EVENTI_BACKEND):
+- 'memoria': pub/sub nel processo; basta con un solo worker ed è il default
+  se WEB_CONCURRENCY non indica più worker.
+- 'postgres': gli eventi passano da NOTIFY sul canale `orienta_eventi` e
+  ogni processo li riceve con LISTEN da un thread dedicato, avviato
+  all'avvio del worker (post_fork di gunicorn, startup di asgi.py) e in
+  ogni caso alla prima iscrizione. Gli eventi di altri processi invalidano anche le
+  versioni dei dati locali (cache dei frammenti e dei widget). Default con
+  più worker; gunicorn.conf.py rifiuta di avviarne più d'uno con 'memoria'.
+
+Lo stream va servito da asgi.py, dove una connessione aperta non occupa un
+thread. La rotta Flask equivalente tiene occupato un thread del worker per
+tutta la durata della connessione: ne apre al più SSE_MAX_STREAM_WSGI per
+processo e oltre risponde 503, così le dashboard non esauriscono i thread
+che servono le altre richieste.
+"""
+import os
+import json
+import queue
+import select
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+
+from database.db_connection import Database
+from database.versioning import incrementa_versioni
+from database.visibility import ATENEO
+from services.resoconto import contributo_attivita
+
+
+logger = logging.getLogger(__name__)
+
+EVENTI_BACKEND = os.environ.get('EVENTI_BACKEND') or \
+    ('postgres' if int(os.environ.get('WEB_CONCURRENCY', 1)) > 1 else 'memoria')
+SSE_MAX_STREAM_WSGI = int(os.environ.get('SSE_MAX_STREAM_WSGI', 4))
+CANALE = 'orienta_eventi'
+# Intervallo dei commenti keep-alive sugli stream aperti (secondi)
+PING = 15
+
+# Tabelle il cui contenuto cambia con un'attività
+TABELLE_ATTIVITA = ('attivita_orientamento', 'supervisiona', 'collabora', 'partecipa', 'kpi_contatore')
+
+
+class BusEventi:
+    """
+    Pub/sub degli eventi. Gli iscritti sono funzioni `consegna(evento)`,
+    chiamate dal thread che pubblica (o dal listener PostgreSQL): devono
+    solo accodare l'evento, senza bloccare.
+    """
+
+    def __init__(self, backend=EVENTI_BACKEND):
+        self.backend = backend
+        self._iscritti = set()
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def avvia_listener(self):
+        """
+        Avvia il thread LISTEN del processo (solo backend 'postgres'). Va
+        chiamata all'avvio di ogni worker: senza listener un processo non
+        riceve gli eventi degli altri e non invalida le proprie cache.
+        """
+        with self._lock:
+            self._avvia_listener()
+
+    def _avvia_listener(self):
+        # Dopo un fork il thread del padre non esiste più nel figlio: is_alive() è False
+        if self.backend == 'postgres' and (self._listener is None or not self._listener.is_alive()):
+            self._listener = threading.Thread(target=self._ascolta, name='eventi-listen', daemon=True)
+            self._listener.start()
+
+    def iscrivi(self, consegna):
+        with self._lock:
+            self._iscritti.add(consegna)
+            self._avvia_listener()
+        return consegna
+
+    def annulla(self, consegna):
+        with self._lock:
+            self._iscritti.discard(consegna)
+
+    def pubblica(self, evento):
+        evento = dict(evento, pid=os.getpid())
+        if self.backend == 'postgres':
+            with Database().engine.begin() as conn:
+                conn.execute(text("SELECT pg_notify(:canale, :payload)"),
+                             {'canale': CANALE, 'payload': json.dumps(evento)})
+        else:
+            self._distribuisci(evento)
+
+    def _distribuisci(self, evento):
+        with self._lock:
+            iscritti = list(self._iscritti)
+        for consegna in iscritti:
+            try:
+                consegna(evento)
+            except Exception:
+                logger.exception("Consegna dell'evento fallita")
+
+    def _ascolta(self):
+        """LISTEN su una connessione dedicata (staccata dal pool), con riconnessione."""
+        while True:
+            try:
+                raw = Database().engine.raw_connection()
+                raw.detach()
+                conn = raw.driver_connection
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {CANALE}")
+                while True:
+                    if select.select([conn], [], [], PING) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        evento = json.loads(conn.notifies.pop(0).payload)
+                        if evento.get('pid') != os.getpid():
+                            incrementa_versioni(evento.get('tabelle', ()))
+                        self._distribuisci(evento)
+            except Exception:
+                logger.exception("Listener degli eventi interrotto, nuovo tentativo tra 5 secondi")
+                time.sleep(5)
+
+
+bus = BusEventi()
+
+
+def pubblica_attivita(session_db, id_attivita, prima):
+    """
+    Pubblica la modifica di un'attività già committata. `prima` è il
+    contributo letto prima della modifica (None per un inserimento); un
+    errore di pubblicazione non annulla il salvataggio.
+    """
+    try:
+        bus.pubblica({
+            'tipo': 'attivita',
+            'id': id_attivita,
+            'prima': prima,
+            'dopo': contributo_attivita(session_db, id_attivita),
+            'tabelle': TABELLE_ATTIVITA,
+        })
+    except Exception:
+        logger.exception("Pubblicazione dell'evento per l'attività %s fallita", id_attivita)
+
+
+def visibile(evento, struttura):
+    """Una struttura riceve solo gli eventi delle attività che può vedere."""
+    if struttura == ATENEO:
+        return True
+    return any(c and struttura in c['strutture'] for c in (evento.get('prima'), evento.get('dopo')))
+
+
+def formatta_sse(evento):
+    dati = {k: v for k, v in evento.items() if k not in ('pid', 'tabelle')}
+    return f"event: {evento['tipo']}\ndata: {json.dumps(dati)}\n\n"
+
+
+_posti_wsgi = threading.BoundedSemaphore(SSE_MAX_STREAM_WSGI)
+
+
+class _StreamWsgi:
+    """Corpo della risposta SSE: restituisce il posto alla chiusura, anche se mai iterato."""
+
+    def __init__(self, struttura):
+        self._generatore = _genera_sse(struttura)
+        self._chiuso = False
+
+    def __iter__(self):
+        return self._generatore
+
+    def close(self):
+        if not self._chiuso:
+            self._chiuso = True
+            self._generatore.close()
+            _posti_wsgi.release()
+
+
+def stream_sse(struttura):
+    """
+    Stream SSE per una struttura sul server WSGI (worker a thread), oppure
+    None se il processo ha già SSE_MAX_STREAM_WSGI stream aperti.
+    """
+    if not _posti_wsgi.acquire(blocking=False):
+        return None
+    return _StreamWsgi(struttura)
+
+
+def _genera_sse(struttura):
+    """
+    Gli eventi oltre i 100 in attesa vengono scartati: un client troppo lento
+    perde qualche aggiornamento invece di far crescere la memoria.
+    """
+    coda = queue.Queue(maxsize=100)
+
+    def consegna(evento):
+        try:
+            coda.put_nowait(evento)
+        except queue.Full:
+            pass
+
+    bus.iscrivi(consegna)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                evento = coda.get(timeout=PING)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            if visibile(evento, struttura):
+                yield formatta_sse(evento)
+    finally:
+        bus.annulla(consegna)
@@ -0,0 +1,225 @@
+import os
+import io
+import csv
+from collections import defaultdict
+
+from sqlalchemy import select, func, case, literal_column, and_
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import aliased
+
+from database.bulk import copy_disponibile, compila, stream_copy_to
+
+from database.periodi import filtro_anno
+from database.models import (
+    AttivitaOrientamento, PersonaleUniversitario, Supervisiona, Collabora, Partecipa, IndirizzoScolastico, Scuola
+)
+from services.resoconto_attivita import format_docenti
+
+
+HEADER_EXPORT = [
+    'ID Attivita', 'Nome Attivita', 'Data Inizio', 'Data Fine', 'Descrizione', 'Totale Ore',
+    'Dipartimento Organizzante', 'Dipartimenti Collaboranti', 'Docente Referente', 'Docenti Supervisori',
+    'Scuola Codice', 'Scuola Nome', 'Indirizzo', 'Classi', 'Totale Studenti', 'Totale Maschi', 'Totale Femmine',
+    'Altro'
+]
+
+STMT_EXPORT_ATTIVITA = select(
+    AttivitaOrientamento.id_attivita, AttivitaOrientamento.nome, AttivitaOrientamento.data_inizio,
+    AttivitaOrientamento.data_fine, AttivitaOrientamento.descrizione, AttivitaOrientamento.totale_ore,
+    AttivitaOrientamento.struttura_organizzante,
+    PersonaleUniversitario.cognome, PersonaleUniversitario.nome, PersonaleUniversitario.email
+).join(PersonaleUniversitario, AttivitaOrientamento.docente_presidente == PersonaleUniversitario.email) \
+    .order_by(AttivitaOrientamento.id_attivita)
+
+STMT_EXPORT_COLLABORATORI = select(Collabora.id_attivita, Collabora.nome_struttura)
+
+STMT_EXPORT_SUPERVISORI = select(
+    Supervisiona.id_attivita,
+    PersonaleUniversitario.cognome, PersonaleUniversitario.nome, PersonaleUniversitario.email
+).join(PersonaleUniversitario, Supervisiona.docente_supervisore == PersonaleUniversitario.email)
+
+STMT_EXPORT_PARTECIPAZIONI = select(
+    Partecipa.id_attivita, Partecipa.codice_meccanografico, Scuola.nome, Partecipa.indirizzo, Partecipa.classi,
+    Partecipa.totale_studenti, Partecipa.totale_maschi, Partecipa.totale_femmine
+).select_from(Partecipa).outerjoin(IndirizzoScolastico).outerjoin(Scuola) \
+    .order_by(Partecipa.id_attivita, Partecipa.codice_meccanografico, Partecipa.indirizzo)
+
+
+# Righe lette dal database per ogni lotto: la memoria resta limitata anche con
+# centinaia di migliaia di partecipazioni
+LOTTO_EXPORT = int(os.environ.get('EXPORT_LOTTO', 2000))
+
+
+def _filtra(stmt, colonna_id, anno, id_attivita, colonna_data=None):
+    """
+    Restringe uno statement dell'export alle attività iniziate nell'anno o a
+    una sola attività. `colonna_data` è la copia della data di inizio nella
+    tabella (partecipa), filtrata anch'essa per escludere le altre partizioni.
+    """
+    if id_attivita is not None:
+        stmt = stmt.where(colonna_id == id_attivita)
+    if anno is not None:
+        stmt = stmt.where(colonna_id.in_(
+            select(AttivitaOrientamento.id_attivita).where(filtro_anno(AttivitaOrientamento.data_inizio, anno))))
+        if colonna_data is not None:
+            stmt = stmt.where(filtro_anno(colonna_data, anno))
+    return stmt
+
+
+def righe_export(session_db, anno=None, id_attivita=None, lotto=LOTTO_EXPORT):
+    """
+    Righe del report (una per partecipazione, o una vuota per le attività
+    senza partecipanti), costruite da select di sole colonne: nessuna istanza
+    ORM e nessun prodotto cartesiano tra collaboratori, supervisori e scuole.
+    Con `anno` l'export comprende solo le attività iniziate in quell'anno,
+    con `id_attivita` una sola attività.
+
+    Attività e partecipazioni, entrambe ordinate per id, sono lette a lotti
+    di `lotto` righe e unite scorrendole in parallelo: in memoria restano
+    solo collaboratori e supervisori (poche righe per attività).
+    """
+    collaboratori = defaultdict(set)
+    for id_att, nome_struttura in session_db.execute(
+            _filtra(STMT_EXPORT_COLLABORATORI, Collabora.id_attivita, anno, id_attivita)):
+        collaboratori[id_att].add(nome_struttura)
+
+    supervisori = defaultdict(list)
+    for id_att, cognome, nome, email in session_db.execute(
+            _filtra(STMT_EXPORT_SUPERVISORI, Supervisiona.id_attivita, anno, id_attivita)):
+        supervisori[id_att].append((cognome, nome, email))
+
+    partecipazioni = iter(session_db.execute(
+        _filtra(STMT_EXPORT_PARTECIPAZIONI, Partecipa.id_attivita, anno, id_attivita, Partecipa.data_inizio)
+        .execution_options(yield_per=lotto)))
+    prossima = next(partecipazioni, None)
+
+    stmt_attivita = _filtra(STMT_EXPORT_ATTIVITA, AttivitaOrientamento.id_attivita, None, id_attivita)
+    if anno is not None:
+        stmt_attivita = stmt_attivita.where(filtro_anno(AttivitaOrientamento.data_inizio, anno))
+    for a in session_db.execute(stmt_attivita.execution_options(yield_per=lotto)):
+        base_row = [
+            a.id_attivita, a.nome, a.data_inizio.isoformat(), a.data_fine.isoformat(), a.descrizione, a.totale_ore,
+            a.struttura_organizzante, ", ".join(sorted(collaboratori[a.id_attivita])),
+            f"{a[7]} {a[8]} - {a[9]}", format_docenti(supervisori[a.id_attivita])
+        ]
+
+        # Partecipazioni di attività escluse dall'export (es. senza referente)
+        while prossima is not None and prossima[0] < a.id_attivita:
+            prossima = next(partecipazioni, None)
+
+        if prossima is None or prossima[0] != a.id_attivita:
+            yield base_row + [''] * 8
+            continue
+
+        while prossima is not None and prossima[0] == a.id_attivita:
+            _, scuola_codice, scuola_nome, indirizzo, classi, tot, m, f = prossima
+            m = m or 0
+            f = f or 0
+            yield base_row + [scuola_codice, scuola_nome or 'N/D', indirizzo, classi, tot, m, f, tot - (m + f)]
+            prossima = next(partecipazioni, None)
+
+
+# ------------------------------------------------------------------------------
+# Export CSV in streaming: COPY su PostgreSQL, righe_export a lotti altrove
+# ------------------------------------------------------------------------------
+
+def _testo_ordinato(colonna, ordine):
+    """string_agg in ordine di codepoint (come sorted() in Python), NULL se vuoto."""
+    return func.nullif(func.string_agg(colonna, aggregate_order_by(literal_column("', '"), ordine.collate('C'))), '')
+
+
+def stmt_export_sql(anno=None):
+    """
+    Le stesse righe di righe_export calcolate interamente da PostgreSQL, per
+    COPY ... TO STDOUT: collaboratori e supervisori aggregati con string_agg,
+    omonimi tra i supervisori distinti dall'email come in format_docenti.
+    """
+    collaboratori = (
+        select(Collabora.id_attivita,
+               _testo_ordinato(Collabora.nome_struttura, Collabora.nome_struttura).label('nomi'))
+        .group_by(Collabora.id_attivita)
+        .subquery()
+    )
+
+    docente = aliased(PersonaleUniversitario)
+    nome_completo = docente.cognome + ' ' + docente.nome
+    omonimi = func.count().over(partition_by=(Supervisiona.id_attivita, docente.cognome, docente.nome))
+    etichette = (
+        select(Supervisiona.id_attivita,
+               case((omonimi > 1, nome_completo + ' - ' + docente.email), else_=nome_completo).label('etichetta'))
+        .join(docente, Supervisiona.docente_supervisore == docente.email)
+        .distinct()
+        .subquery()
+    )
+    supervisori = (
+        select(etichette.c.id_attivita,
+               _testo_ordinato(etichette.c.etichetta, etichette.c.etichetta).label('nomi'))
+        .group_by(etichette.c.id_attivita)
+        .subquery()
+    )
+
+    su_partecipa = [Partecipa.id_attivita == AttivitaOrientamento.id_attivita,
+                    Partecipa.data_inizio == AttivitaOrientamento.data_inizio]
+    if anno is not None:
+        su_partecipa.append(filtro_anno(Partecipa.data_inizio, anno))
+    presente = Partecipa.id_attivita.isnot(None)
+    maschi = func.coalesce(Partecipa.totale_maschi, 0)
+    femmine = func.coalesce(Partecipa.totale_femmine, 0)
+    stmt = (
+        select(
+            AttivitaOrientamento.id_attivita, AttivitaOrientamento.nome,
+            func.to_char(AttivitaOrientamento.data_inizio, 'YYYY-MM-DD'),
+            func.to_char(AttivitaOrientamento.data_fine, 'YYYY-MM-DD'),
+            AttivitaOrientamento.descrizione, AttivitaOrientamento.totale_ore,
+            AttivitaOrientamento.struttura_organizzante, collaboratori.c.nomi,
+            PersonaleUniversitario.cognome + ' ' + PersonaleUniversitario.nome + ' - ' + PersonaleUniversitario.email,
+            supervisori.c.nomi,
+            Partecipa.codice_meccanografico, case((presente, func.coalesce(Scuola.nome, 'N/D'))),
+            Partecipa.indirizzo, Partecipa.classi, Partecipa.totale_studenti,
+            case((presente, maschi)), case((presente, femmine)),
+            case((presente, Partecipa.totale_studenti - (maschi + femmine))),
+        )
+        .join(PersonaleUniversitario, AttivitaOrientamento.docente_presidente == PersonaleUniversitario.email)
+        .outerjoin(collaboratori, collaboratori.c.id_attivita == AttivitaOrientamento.id_attivita)
+        .outerjoin(supervisori, supervisori.c.id_attivita == AttivitaOrientamento.id_attivita)
+        .outerjoin(Partecipa, and_(*su_partecipa))
+        .outerjoin(IndirizzoScolastico)
+        .outerjoin(Scuola)
+        .order_by(AttivitaOrientamento.id_attivita, Partecipa.codice_meccanografico, Partecipa.indirizzo)
+    )
+    if anno is not None:
+        stmt = stmt.where(filtro_anno(AttivitaOrientamento.data_inizio, anno))
+    return stmt
+
+
+def _csv(righe, fine_riga='\r\n'):
+    """Righe in formato CSV (separatore ';') come un'unica stringa."""
+    output = io.StringIO()
+    csv.writer(output, delimiter=';', lineterminator=fine_riga).writerows(righe)
+    return output.getvalue()
+
+
+def stream_export_csv(session_db, anno=None, righe=None, lotto=LOTTO_EXPORT):
+    """
+    Generatore del report CSV (intestazione compresa) a blocchi di byte.
+    Con `righe` (es. dallo snapshot di un anno chiuso) scrive quelle; su
+    PostgreSQL usa COPY ... TO STDOUT (righe terminate da LF invece di CRLF,
+    stesso contenuto); altrove serializza righe_export a lotti.
+    """
+    if righe is None and copy_disponibile(session_db):
+        sql = compila(stmt_export_sql(anno))
+        yield _csv([HEADER_EXPORT], '\n').encode('utf-8')
+        yield from stream_copy_to(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, DELIMITER ';')")
+        return
+
+    yield _csv([HEADER_EXPORT]).encode('utf-8')
+    if righe is None:
+        righe = righe_export(session_db, anno, lotto=lotto)
+    blocco = []
+    for riga in righe:
+        blocco.append(riga)
+        if len(blocco) >= lotto:
+            yield _csv(blocco).encode('utf-8')
+            blocco = []
+    if blocco:
+        yield _csv(blocco).encode('utf-8')
@@ -0,0 +1,303 @@
+"""
+Export in formato XLSX.
+
+I fogli sono scritti con xlsxwriter in modalità `constant_memory`: ogni riga
+viene scritta su disco appena completata, quindi la memoria occupata non
+dipende dal numero di righe. Il formato però non si può inviare mentre viene
+scritto (lo zip si chiude solo a fine file), quindi il client non riceve
+nulla finché il foglio non è completo.
+
+Per questo il report completo non viene generato durante la richiesta:
+`avvia_export` lo scrive in background in EXPORT_XLSX_DIR e la pagina di
+download (`stato_export`) risponde "in preparazione" finché il file non è
+pronto, così nessuna richiesta resta aperta oltre il timeout del proxy. Lo
+stato è solo su disco (marcatore .in_corso con host, pid e battito, .xlsx
+pronto, .errore), quindi qualunque worker può rispondere e un export del
+processo morto viene riconosciuto; i file restano EXPORT_XLSX_DURATA secondi.
+Il resoconto di una singola attività, poche righe, viene invece scritto e
+inviato nella stessa richiesta.
+
+xlsxwriter è una dipendenza opzionale: se non è installato l'export XLSX
+non è disponibile e resta quello CSV.
+"""
+import os
+import re
+import time
+import uuid
+import socket
+import logging
+import tempfile
+import threading
+from datetime import date
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+from database.db_connection import Database
+from services.export import HEADER_EXPORT, righe_export
+from services.snapshot import righe_export_snapshot
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_XLSX_DIR = os.environ.get('EXPORT_XLSX_DIR', os.path.join(tempfile.gettempdir(), 'orienta_export'))
+EXPORT_XLSX_DURATA = int(os.environ.get('EXPORT_XLSX_DURATA', 3600))
+# Intervallo del battito degli export in corso e assenza di battito oltre cui sono considerati interrotti
+EXPORT_XLSX_BATTITO = 30
+EXPORT_XLSX_SCADENZA = int(os.environ.get('EXPORT_XLSX_SCADENZA', 180))
+
+# Colonne dell'export con una data (ISO nelle righe, data vera nel foglio)
+_COLONNE_DATA = (2, 3)
+# Colonne di HEADER_EXPORT relative all'attività; le ultime 8 sono della partecipazione
+_COLONNE_ATTIVITA = len(HEADER_EXPORT) - 8
+_BLOCCO = 64 * 1024
+# Id di un export: anno (o "tutti") e parte casuale
+_ID_EXPORT = re.compile(r'^(\d{4}|tutti)-[0-9a-f]{32}$')
+
+_executor = None
+_lock = threading.Lock()
+_in_corso = set()       # export del processo non ancora conclusi
+_battito_pid = None
+
+
+def xlsx_disponibile():
+    return xlsxwriter is not None
+
+
+def file_temporaneo():
+    fd, percorso = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    return percorso
+
+
+def invia_file(percorso):
+    """Generatore che legge il file a blocchi e lo cancella al termine dell'invio."""
+    try:
+        with open(percorso, 'rb') as f:
+            while True:
+                blocco = f.read(_BLOCCO)
+                if not blocco:
+                    break
+                yield blocco
+    finally:
+        os.remove(percorso)
+
+
+def _workbook(percorso):
+    wb = xlsxwriter.Workbook(percorso, {'constant_memory': True, 'tmpdir': tempfile.gettempdir()})
+    formati = {
+        'intestazione': wb.add_format({'bold': True, 'bg_color': '#e8f5e9', 'border': 1}),
+        'etichetta': wb.add_format({'bold': True}),
+        'data': wb.add_format({'num_format': 'dd/mm/yyyy'}),
+    }
+    return wb, formati
+
+
+def _scrivi_riga(ws, riga, valori, formati, colonne_data=(), inizio=0):
+    """Scrive una riga rispettando i tipi: i testi non vengono mai interpretati come formule."""
+    for col, valore in enumerate(valori, start=inizio):
+        if valore is None or valore == '':
+            continue
+        if col in colonne_data:
+            ws.write_datetime(riga, col, date.fromisoformat(valore), formati['data'])
+        elif isinstance(valore, (int, float)):
+            ws.write_number(riga, col, valore)
+        else:
+            ws.write_string(riga, col, str(valore))
+
+
+def scrivi_export(righe, percorso):
+    """Scrive le righe del report (come righe_export) in un foglio XLSX; restituisce il numero di righe."""
+    wb, formati = _workbook(percorso)
+    ws = wb.add_worksheet('Attività')
+    ws.write_row(0, 0, HEADER_EXPORT, formati['intestazione'])
+    ws.freeze_panes(1, 0)
+    ws.set_column(0, len(HEADER_EXPORT) - 1, 18)
+
+    n = 0
+    for n, riga in enumerate(righe, start=1):
+        _scrivi_riga(ws, n, riga, formati, _COLONNE_DATA)
+    ws.autofilter(0, 0, max(n, 1), len(HEADER_EXPORT) - 1)
+    wb.close()
+    return n
+
+
+def scrivi_attivita(session_db, id_attivita, percorso):
+    """
+    Resoconto di una singola attività: dati generali in testa al foglio, poi
+    una riga per partecipazione. Restituisce il numero di partecipazioni,
+    o None se l'attività non esiste.
+    """
+    righe = righe_export(session_db, id_attivita=id_attivita)
+    prima = next(righe, None)
+    if prima is None:
+        return None
+
+    wb, formati = _workbook(percorso)
+    ws = wb.add_worksheet('Resoconto')
+    ws.set_column(0, 0, 26)
+    ws.set_column(1, 8, 18)
+
+    for riga, col in enumerate(range(1, _COLONNE_ATTIVITA)):
+        ws.write_string(riga, 0, HEADER_EXPORT[col], formati['etichetta'])
+        _scrivi_riga(ws, riga, [prima[col]], formati, (1,) if col in _COLONNE_DATA else (), inizio=1)
+
+    intestazione = _COLONNE_ATTIVITA  # dopo una riga vuota
+    ws.write_row(intestazione, 0, HEADER_EXPORT[_COLONNE_ATTIVITA:], formati['intestazione'])
+    ws.freeze_panes(intestazione + 1, 0)
+
+    n = 0
+    if prima[_COLONNE_ATTIVITA] != '':  # riga vuota: attività senza partecipanti
+        for n, r in enumerate(chain([prima], righe), start=1):
+            _scrivi_riga(ws, intestazione + n, r[_COLONNE_ATTIVITA:], formati)
+    wb.close()
+    return n
+
+
+# ------------------------------------------------------------------------------
+# Report completo in background
+# ------------------------------------------------------------------------------
+
+def _pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # Un export alla volta per processo: sono lunghi e usano una connessione ciascuno
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='export-xlsx')
+        return _executor
+
+
+def chiudi_pool():
+    """Ferma il pool di thread (es. dopo il fork)."""
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+def _file(id_export, estensione):
+    return os.path.join(EXPORT_XLSX_DIR, f'{id_export}.{estensione}')
+
+
+def _pulisci():
+    """Rimuove i file più vecchi di EXPORT_XLSX_DURATA, compresi i .tmp di processi terminati."""
+    limite = time.time() - EXPORT_XLSX_DURATA
+    for voce in os.scandir(EXPORT_XLSX_DIR):
+        try:
+            if voce.stat().st_mtime < limite:
+                os.remove(voce.path)
+        except FileNotFoundError:
+            pass
+
+
+def _genera(id_export, anno):
+    temporaneo = _file(id_export, 'tmp')
+    try:
+        righe = righe_export_snapshot(anno)
+        with Database().session_factory() as session_db:
+            if righe is None:
+                righe = righe_export(session_db, anno)
+            scrivi_export(righe, temporaneo)
+        os.replace(temporaneo, _file(id_export, 'xlsx'))
+    except Exception as e:
+        logger.exception("Export XLSX %s fallito", id_export)
+        with open(_file(id_export, 'errore'), 'w', encoding='utf-8') as f:
+            f.write(str(e))
+        if os.path.exists(temporaneo):
+            os.remove(temporaneo)
+    finally:
+        with _lock:
+            _in_corso.discard(id_export)
+        try:
+            os.remove(_file(id_export, 'in_corso'))
+        except FileNotFoundError:
+            pass
+
+
+def _battito():
+    """Aggiorna l'mtime dei marcatori degli export del processo, anche di quelli ancora in coda."""
+    while True:
+        time.sleep(EXPORT_XLSX_BATTITO)
+        with _lock:
+            ids = list(_in_corso)
+        for id_export in ids:
+            try:
+                os.utime(_file(id_export, 'in_corso'))
+            except FileNotFoundError:
+                pass
+
+
+def avvia_export(anno=None):
+    """Avvia in background l'export del report (di un anno o completo); restituisce l'id del file."""
+    global _battito_pid
+    os.makedirs(EXPORT_XLSX_DIR, exist_ok=True)
+    _pulisci()
+    id_export = f"{anno or 'tutti'}-{uuid.uuid4().hex}"
+    # Il marcatore segna l'export in corso anche per gli altri worker: contiene
+    # host e pid del processo che lo esegue e il suo mtime è il battito
+    with open(_file(id_export, 'in_corso'), 'w', encoding='utf-8') as f:
+        f.write(f"{socket.gethostname()} {os.getpid()}")
+    with _lock:
+        _in_corso.add(id_export)
+        if _battito_pid != os.getpid():
+            _battito_pid = os.getpid()
+            threading.Thread(target=_battito, name='export-xlsx-battito', daemon=True).start()
+    _pool().submit(_genera, id_export, anno)
+    return id_export
+
+
+def _proprietario_terminato(contenuto):
+    """True se il marcatore è di un processo di questo host che non esiste più."""
+    try:
+        host, pid = contenuto.split()
+        pid = int(pid)
+    except ValueError:
+        return True
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def stato_export(id_export):
+    """
+    ('pronto', percorso), ('in_corso', None) o ('errore', messaggio);
+    (None, None) per un id non valido, scaduto o sconosciuto. Un export il
+    cui processo è terminato (riavvio, OOM) o che non dà battito da
+    EXPORT_XLSX_SCADENZA secondi risulta in errore.
+    """
+    if not _ID_EXPORT.match(id_export):
+        return None, None
+    if os.path.exists(_file(id_export, 'xlsx')):
+        return 'pronto', _file(id_export, 'xlsx')
+    try:
+        with open(_file(id_export, 'errore'), encoding='utf-8') as f:
+            return 'errore', f.read()
+    except FileNotFoundError:
+        pass
+    try:
+        marcatore = _file(id_export, 'in_corso')
+        with open(marcatore, encoding='utf-8') as f:
+            contenuto = f.read()
+        fermo = time.time() - os.stat(marcatore).st_mtime
+    except FileNotFoundError:
+        # Nessun marcatore: export sconosciuto, scaduto o appena concluso
+        return ('pronto', _file(id_export, 'xlsx')) if os.path.exists(_file(id_export, 'xlsx')) else (None, None)
+    if _proprietario_terminato(contenuto) or fermo > EXPORT_XLSX_SCADENZA:
+        return 'errore', "l'export si è interrotto (processo terminato): avviarlo di nuovo"
+    return 'in_corso', None
+
+
+def nome_download(id_export):
+    anno = id_export.split('-', 1)[0]
+    return "report_attivita.xlsx" if anno == 'tutti' else f"report_attivita_{anno}.xlsx"
@@ -0,0 +1,176 @@
+"""
+Grafici del resoconto di un'attività renderizzati lato server (PNG o SVG),
+per la versione stampabile della pagina e per i documenti generati senza
+browser.
+
+I file stanno in una cache su disco indirizzata per contenuto: il nome è
+l'hash di grafico, formato, etichette e valori, quindi cambia da solo quando
+cambiano i dati dell'attività e non va mai invalidato; attività con gli
+stessi dati condividono lo stesso file. L'ETag invece deriva dalla versione
+dell'attività, così le richieste ripetute (304) e quelle di un file già
+renderizzato non caricano il dettaglio dell'attività. Il rendering gira su un pool di
+thread dedicato, al più uno per file; chi lo richiede attende fino a
+GRAFICI_ATTESA secondi, poi il rendering prosegue in background.
+
+matplotlib è una dipendenza opzionale: senza, restano i grafici Chart.js
+disegnati dal browser.
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+
+try:
+    from matplotlib.figure import Figure
+except ImportError:
+    Figure = None
+
+
+logger = logging.getLogger(__name__)
+
+# Nome del grafico -> prefisso delle chiavi in contesto_resoconto
+GRAFICI = {'scuole': 'chart_scuole', 'indirizzi': 'chart_indirizzi', 'sesso': 'chart_sesso'}
+FORMATI = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Stessi colori dei grafici Chart.js della pagina
+COLORI = ['#4bc0c0', '#ffcd56', '#ff9f40', '#9966ff', '#c9cbcf', '#36a2eb', '#ff6384']
+COLORI_SESSO = ['#36a2eb', '#ff6384', '#c9cbcf']
+# Da incrementare quando cambia l'aspetto dei grafici (cambiano tutte le chiavi)
+VERSIONE_STILE = 1
+
+GRAFICI_CACHE_DIR = os.environ.get('GRAFICI_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'orienta_grafici'))
+GRAFICI_WORKERS = int(os.environ.get('GRAFICI_WORKERS', 2))
+GRAFICI_ATTESA = float(os.environ.get('GRAFICI_ATTESA', 10))
+
+GRAFICI_MAX_ETAG = 4096
+
+_executor = None
+_in_corso = {}      # chiave -> Future del rendering avviato
+_per_etag = {}      # etag (versione dell'attività) -> chiave del file
+_lock = threading.Lock()
+
+
+def grafici_disponibili():
+    return Figure is not None
+
+
+def dati_grafico(contesto, nome):
+    """(etichette, valori) del grafico `nome` dal contesto di contesto_resoconto."""
+    prefisso = GRAFICI[nome]
+    return contesto[f'{prefisso}_labels'], contesto[f'{prefisso}_data']
+
+
+def chiave(nome, formato, etichette, valori):
+    contenuto = json.dumps([VERSIONE_STILE, nome, formato, etichette, valori], ensure_ascii=False)
+    return hashlib.sha256(contenuto.encode('utf-8')).hexdigest()
+
+
+def etag(id_attivita, versione, nome, formato):
+    """ETag di un grafico dalla versione dell'attività (versione_resoconto): si calcola senza caricare i dati."""
+    return '-'.join(map(str, (id_attivita, *versione, VERSIONE_STILE, nome, formato)))
+
+
+def file_per_etag(etag_grafico, formato):
+    """Percorso del file già renderizzato per questo ETag, None se sconosciuto o non più in cache."""
+    chiave_grafico = _per_etag.get(etag_grafico)
+    if chiave_grafico is None:
+        return None
+    destinazione = percorso(chiave_grafico, formato)
+    return destinazione if os.path.exists(destinazione) else None
+
+
+def registra_etag(etag_grafico, chiave_grafico):
+    with _lock:
+        if len(_per_etag) >= GRAFICI_MAX_ETAG:
+            _per_etag.clear()
+        _per_etag[etag_grafico] = chiave_grafico
+
+
+def percorso(chiave_grafico, formato):
+    return os.path.join(GRAFICI_CACHE_DIR, chiave_grafico[:2], f'{chiave_grafico}.{formato}')
+
+
+def _disegna(nome, formato, etichette, valori, destinazione):
+    """Ciambella con legenda (valore e percentuale), come nella pagina; scrittura atomica."""
+    totale = sum(valori)
+    colori = COLORI_SESSO if nome == 'sesso' else [COLORI[i % len(COLORI)] for i in range(len(valori))]
+
+    fig = Figure(figsize=(6, 4.5))
+    ax = fig.subplots()
+    ax.pie(valori, colors=colori, startangle=90, counterclock=False,
+           wedgeprops={'width': 0.45, 'edgecolor': 'white'})
+    ax.set_aspect('equal')
+    ax.legend([f"{e}: {v} ({v / totale * 100:.1f}%)" for e, v in zip(etichette, valori)],
+              loc='center left', bbox_to_anchor=(1, 0.5), frameon=False, fontsize=9)
+
+    os.makedirs(os.path.dirname(destinazione), exist_ok=True)
+    fd, temporaneo = tempfile.mkstemp(dir=os.path.dirname(destinazione), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            fig.savefig(f, format=formato, bbox_inches='tight', dpi=150)
+        os.replace(temporaneo, destinazione)
+    except BaseException:
+        os.remove(temporaneo)
+        raise
+
+
+def _pool():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=GRAFICI_WORKERS, thread_name_prefix='grafici')
+        return _executor
+
+
+def _renderizza(chiave_grafico, nome, formato, etichette, valori, future):
+    try:
+        _disegna(nome, formato, etichette, valori, percorso(chiave_grafico, formato))
+    except Exception as e:
+        logger.exception("Rendering del grafico %s fallito", nome)
+        future.set_exception(e)
+    else:
+        future.set_result(None)
+    finally:
+        with _lock:
+            _in_corso.pop(chiave_grafico, None)
+
+
+def file_grafico(nome, formato, etichette, valori, attesa=GRAFICI_ATTESA):
+    """
+    Restituisce (percorso, chiave) del file del grafico, renderizzandolo se
+    non è ancora in cache. Il percorso è None se il rendering non termina
+    entro `attesa` secondi (None: senza limite); gli errori di rendering
+    vengono rilanciati.
+    """
+    chiave_grafico = chiave(nome, formato, etichette, valori)
+    destinazione = percorso(chiave_grafico, formato)
+    if os.path.exists(destinazione):
+        return destinazione, chiave_grafico
+
+    with _lock:
+        future = _in_corso.get(chiave_grafico)
+        if future is None:
+            future = _in_corso[chiave_grafico] = Future()
+            avvia = True
+        else:
+            avvia = False
+    if avvia:
+        _pool().submit(_renderizza, chiave_grafico, nome, formato, etichette, valori, future)
+
+    try:
+        future.result(timeout=attesa)
+    except TimeoutError:
+        return None, chiave_grafico
+    return destinazione, chiave_grafico
+
+
+def chiudi_pool():
+    """Ferma il pool di thread (es. dopo il fork)."""
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
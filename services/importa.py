@@ -0,0 +1,126 @@
+"""
+Import massivo delle partecipazioni da CSV.
+
+Il file ha separatore ';', una riga di intestazione e le colonne di
+COLONNE_IMPORT in quest'ordine (le stesse dell'export, senza il nome della
+scuola). Le righe già presenti (stessa attività, scuola e indirizzo) vengono
+aggiornate.
+
+Su PostgreSQL il file passa con `COPY ... FROM STDIN` in una tabella di
+appoggio temporanea e da lì in `partecipa` con un'unica
+INSERT ... ON CONFLICT DO UPDATE: vincoli e trigger dei contatori restano
+quelli della tabella. Altrove le righe vengono lette con il modulo csv e
+inserite a lotti. In entrambi i casi la data di inizio copiata in ogni
+partecipazione viene letta dall'attività.
+
+Il chiamante fa commit o rollback; il registro delle modifiche riceve una
+sola voce riassuntiva invece di una per riga.
+"""
+import io
+import os
+import csv
+
+from sqlalchemy import select, table, column
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database.audit import registra
+from database.bulk import copy_disponibile, copy_from
+from database.counters import segna_attivita
+from database.models import Partecipa
+from database.partizioni import chiave_partecipa, data_attivita, date_attivita
+from database.versioning import segna_tabelle
+
+
+COLONNE_IMPORT = (
+    'id_attivita', 'codice_meccanografico', 'indirizzo', 'classi',
+    'totale_studenti', 'totale_maschi', 'totale_femmine', 'altro',
+)
+_COLONNE_INTERE = {'id_attivita', 'totale_studenti', 'totale_maschi', 'totale_femmine', 'altro'}
+LOTTO_IMPORT = int(os.environ.get('IMPORT_LOTTO', 1000))
+
+_APPOGGIO = 'import_partecipa'
+
+
+def _upsert(insert_dialetto, chiave, origine=None):
+    stmt = insert_dialetto(Partecipa.__table__)
+    if origine is not None:
+        stmt = stmt.from_select(COLONNE_IMPORT + ('data_inizio',), origine)
+    return stmt.on_conflict_do_update(
+        index_elements=chiave,
+        set_={c: stmt.excluded[c] for c in COLONNE_IMPORT if c not in chiave},
+    )
+
+
+def _importa_copy(session_db, file):
+    conn = session_db.connection()
+    conn.exec_driver_sql(
+        f"CREATE TEMP TABLE {_APPOGGIO} ON COMMIT DROP AS "
+        f"SELECT {', '.join(COLONNE_IMPORT)} FROM partecipa WITH NO DATA")
+    copy_from(session_db, f"COPY {_APPOGGIO} ({', '.join(COLONNE_IMPORT)}) FROM STDIN "
+                          f"WITH (FORMAT csv, DELIMITER ';', HEADER true)", file)
+    appoggio = table(_APPOGGIO, *[column(c) for c in COLONNE_IMPORT])
+    origine = select(*appoggio.c, data_attivita(appoggio.c.id_attivita))
+    return conn.execute(_upsert(postgresql.insert, chiave_partecipa(conn), origine)).rowcount
+
+
+def _valore(nome, testo):
+    testo = testo.strip()
+    if testo == '':
+        return None
+    return int(testo) if nome in _COLONNE_INTERE else testo
+
+
+def _righe(file):
+    lettore = csv.reader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''), delimiter=';')
+    next(lettore, None)  # intestazione
+    for n, riga in enumerate(lettore, start=2):
+        if not riga:
+            continue
+        if len(riga) != len(COLONNE_IMPORT):
+            raise ValueError(f"Riga {n}: attese {len(COLONNE_IMPORT)} colonne, trovate {len(riga)}")
+        try:
+            yield {c: _valore(c, v) for c, v in zip(COLONNE_IMPORT, riga)}
+        except ValueError:
+            raise ValueError(f"Riga {n}: valore numerico non valido") from None
+
+
+def _importa_lotti(session_db, file, lotto):
+    conn = session_db.connection()
+    stmt = _upsert(postgresql.insert if conn.dialect.name == 'postgresql' else sqlite.insert, chiave_partecipa(conn))
+    n = 0
+    blocco = []
+
+    def scrivi():
+        ids = {r['id_attivita'] for r in blocco}
+        segna_attivita(session_db, ids)
+        date = date_attivita(conn, ids)
+        for r in blocco:
+            r['data_inizio'] = date.get(r['id_attivita'])
+        session_db.execute(stmt, blocco)
+
+    for riga in _righe(file):
+        blocco.append(riga)
+        if len(blocco) >= lotto:
+            scrivi()
+            n += len(blocco)
+            blocco = []
+    if blocco:
+        scrivi()
+        n += len(blocco)
+    return n
+
+
+def importa_partecipazioni(session_db, file, lotto=LOTTO_IMPORT):
+    """
+    Importa le partecipazioni dal CSV in `file` (oggetto binario con read(),
+    es. il corpo della richiesta). Restituisce il numero di righe importate.
+    Solleva ValueError per un file malformato e gli errori del database per
+    righe che violano i vincoli.
+    """
+    if copy_disponibile(session_db):
+        n = _importa_copy(session_db, file)
+    else:
+        n = _importa_lotti(session_db, file, lotto)
+    segna_tabelle(session_db, 'partecipa', 'kpi_contatore')
+    registra(session_db, 'partecipa', '', 'IMPORT', {'righe': n})
+    return n
@@ -0,0 +1,217 @@
+"""
+Profiler a campionamento delle richieste, attivabile in produzione.
+
+Una richiesta viene profilata se:
+- un utente dell'Ufficio Orientamento invia l'header `X-Profila: 1`;
+- oppure rientra nella frazione casuale PROFILER_FRAZIONE (default 0).
+
+Un unico thread per processo legge ogni PROFILER_INTERVALLO secondi lo stack
+dei thread che stanno servendo richieste profilate (sys._current_frames):
+nessun costo per le richieste non profilate, un costo contenuto e
+indipendente dalla profondità delle chiamate per quelle profilate. La
+cattura dura fino alla chiusura della risposta, quindi comprende anche il
+corpo generato in streaming (export CSV, XLSX).
+
+Ogni cattura è un file in formato "collapsed stack" (una riga
+`funzione;funzione;... campioni` per stack) in PROFILER_DIR, da cui
+flamegraph.pl, speedscope o inferno disegnano il flame graph. Il nome del
+file contiene istante, durata ed endpoint; restano gli ultimi
+PROFILER_MAX_FILE file.
+"""
+import os
+import sys
+import time
+import random
+import logging
+import itertools
+import threading
+import tempfile
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request, session
+
+
+PROFILER_DIR = os.environ.get('PROFILER_DIR', os.path.join(tempfile.gettempdir(), 'orienta_profili'))
+PROFILER_FRAZIONE = float(os.environ.get('PROFILER_FRAZIONE', 0))
+PROFILER_INTERVALLO = float(os.environ.get('PROFILER_INTERVALLO', 0.005))
+PROFILER_MAX_FILE = int(os.environ.get('PROFILER_MAX_FILE', 200))
+
+HEADER = 'X-Profila'
+# Endpoint mai profilati: file statici e stream SSE che restano aperti a lungo
+ESCLUSI = {'static', 'reportistica.api_resoconto_eventi'}
+
+_ESTENSIONE = '.folded'
+_contatore = itertools.count()
+_etichette = {}
+
+logger = logging.getLogger(__name__)
+
+
+class Cattura:
+    """Campioni dello stack di un thread durante una richiesta."""
+
+    def __init__(self, thread_id, endpoint):
+        self.thread_id = thread_id
+        self.endpoint = endpoint or 'sconosciuto'
+        self.inizio = time.perf_counter()
+        self.istante = int(time.time() * 1000)
+        self.id = f"{self.istante}-{os.getpid()}-{next(_contatore)}"
+        self.durata = None
+        self.campioni = Counter()
+
+
+def _etichetta(codice):
+    """`funzione (cartella/file.py)`: le ultime due parti del percorso bastano a distinguere."""
+    etichetta = _etichette.get(codice)
+    if etichetta is None:
+        file = '/'.join(codice.co_filename.replace('\\', '/').split('/')[-2:])
+        etichetta = _etichette[codice] = f"{codice.co_name} ({file})".replace(';', ':')
+    return etichetta
+
+
+def _stack(frame):
+    etichette = []
+    while frame is not None:
+        etichette.append(_etichetta(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(etichette))
+
+
+class Campionatore:
+    """Thread unico del processo che campiona gli stack delle catture attive."""
+
+    def __init__(self, intervallo=PROFILER_INTERVALLO):
+        self.intervallo = intervallo
+        self._attive = {}
+        # Stesso lock per _attive e per l'attesa: un avvio non può andare perso
+        # tra il controllo "nessuna cattura" e l'attesa del thread
+        self._condizione = threading.Condition()
+        self._thread = None
+
+    def avvia(self, endpoint):
+        cattura = Cattura(threading.get_ident(), endpoint)
+        with self._condizione:
+            self._attive[cattura.id] = cattura
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._campiona, name='profiler', daemon=True)
+                self._thread.start()
+            self._condizione.notify()
+        return cattura
+
+    def termina(self, cattura):
+        with self._condizione:
+            self._attive.pop(cattura.id, None)
+        cattura.durata = time.perf_counter() - cattura.inizio
+        return cattura
+
+    def _campiona(self):
+        while True:
+            with self._condizione:
+                while not self._attive:
+                    self._condizione.wait()
+                attive = list(self._attive.values())
+            frames = sys._current_frames()
+            stack = [(c, _stack(frames[c.thread_id])) for c in attive if c.thread_id in frames]
+            del frames
+            # I campioni si aggiungono sotto il lock e solo alle catture ancora
+            # attive: dopo termina la cattura non viene più modificata
+            with self._condizione:
+                for cattura, s in stack:
+                    if cattura.id in self._attive:
+                        cattura.campioni[s] += 1
+            time.sleep(self.intervallo)
+
+
+campionatore = Campionatore()
+
+
+def salva(cattura, cartella=PROFILER_DIR):
+    """Scrive la cattura in formato collapsed stack e rimuove le più vecchie oltre PROFILER_MAX_FILE."""
+    if not cattura.campioni:
+        return None
+    os.makedirs(cartella, exist_ok=True)
+    nome = f"{cattura.id}_{cattura.durata * 1000:.0f}ms_{cattura.endpoint}{_ESTENSIONE}"
+    with open(os.path.join(cartella, nome), 'w', encoding='utf-8') as f:
+        for stack, n in cattura.campioni.most_common():
+            f.write(f"{stack} {n}\n")
+
+    file = sorted(os.scandir(cartella), key=lambda e: e.name)
+    file = [e for e in file if e.name.endswith(_ESTENSIONE)]
+    for vecchio in file[:max(len(file) - PROFILER_MAX_FILE, 0)]:
+        try:
+            os.remove(vecchio.path)
+        except FileNotFoundError:
+            pass
+    return nome
+
+
+def elenco_catture(cartella=PROFILER_DIR, limite=50):
+    """Catture presenti su disco, dalla più lenta: dizionari con nome, istante, durata_ms, endpoint, campioni."""
+    if not os.path.isdir(cartella):
+        return []
+    catture = []
+    for voce in os.scandir(cartella):
+        if not voce.name.endswith(_ESTENSIONE):
+            continue
+        try:
+            id_cattura, durata, endpoint = voce.name[:-len(_ESTENSIONE)].split('_', 2)
+            with open(voce.path, encoding='utf-8') as f:
+                campioni = sum(int(riga.rsplit(' ', 1)[1]) for riga in f if riga.strip())
+        except (ValueError, IndexError, OSError):
+            continue
+        catture.append({
+            'nome': voce.name,
+            'istante': datetime.fromtimestamp(int(id_cattura.split('-')[0]) / 1000),
+            'durata_ms': int(durata[:-2]),
+            'endpoint': endpoint,
+            'campioni': campioni,
+        })
+    catture.sort(key=lambda c: c['durata_ms'], reverse=True)
+    return catture[:limite]
+
+
+def percorso_cattura(nome, cartella=PROFILER_DIR):
+    """Percorso del file di una cattura, None se il nome non è valido o il file non esiste."""
+    if os.path.basename(nome) != nome or not nome.endswith(_ESTENSIONE):
+        return None
+    percorso = os.path.join(cartella, nome)
+    return percorso if os.path.isfile(percorso) else None
+
+
+def _da_profilare():
+    if request.endpoint in ESCLUSI:
+        return False
+    if request.headers.get(HEADER) == '1' and session.get('ruolo') == 'Ufficio Orientamento':
+        return True
+    return PROFILER_FRAZIONE > 0 and random.random() < PROFILER_FRAZIONE
+
+
+def configura_profiler(app):
+    """Registra gli hook che avviano e chiudono le catture delle richieste."""
+
+    @app.before_request
+    def _avvia_cattura():
+        if _da_profilare():
+            g.cattura = campionatore.avvia(request.endpoint)
+
+    def _concludi(cattura):
+        try:
+            salva(campionatore.termina(cattura))
+        except Exception:
+            logger.exception("Salvataggio della cattura %s fallito", cattura.id)
+
+    @app.after_request
+    def _chiudi_cattura(response):
+        cattura = g.pop('cattura', None)
+        if cattura is not None:
+            response.headers['X-Profilo'] = cattura.id
+            response.call_on_close(lambda: _concludi(cattura))
+        return response
+
+    @app.teardown_request
+    def _chiudi_cattura_errore(exception=None):
+        # Richiesta terminata con un'eccezione: after_request non è stato chiamato
+        cattura = g.pop('cattura', None)
+        if cattura is not None:
+            _concludi(cattura)
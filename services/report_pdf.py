@@ -0,0 +1,135 @@
+"""
+Generazione in blocco dei resoconti PDF delle attività di una struttura in
+un anno (comando `flask report pdf`).
+
+Il processo principale carica tutte le attività con le stesse opzioni di
+caricamento del resoconto (poche query con selectinload, non una per
+attività) e ne prepara l'HTML con il template della versione stampabile.
+La conversione in PDF con WeasyPrint, la parte costosa, gira su un pool di
+processi: le attività in lavorazione sono al più 2 × processi, così la
+memoria resta limitata anche con migliaia di attività, e i PDF vengono
+scritti nello zip man mano che arrivano.
+
+I grafici sono quelli di services.grafici: ogni processo li trova nella
+cache su disco o li renderizza, e WeasyPrint li legge come file locali.
+
+WeasyPrint è una dipendenza opzionale (richiede anche le librerie Pango
+del sistema).
+"""
+import os
+import re
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from flask import render_template
+from sqlalchemy import select
+
+try:
+    import weasyprint
+except (ImportError, OSError):
+    weasyprint = None
+
+from database.models import AttivitaOrientamento
+from database.periodi import filtro_anno
+from database.visibility import applica_visibilita
+from services import grafici
+from services.resoconto_attivita import opzioni_dettaglio, contesto_resoconto
+
+
+def pdf_disponibile():
+    return weasyprint is not None
+
+
+def nome_sicuro(testo, lunghezza=60):
+    """Testo utilizzabile come nome di file."""
+    return re.sub(r'[^\w-]+', '_', testo).strip('_')[:lunghezza] or 'senza_nome'
+
+
+def carica_attivita(session_db, struttura, anno):
+    """Attività visibili alla struttura iniziate nell'anno, con tutto ciò che serve al resoconto."""
+    stmt = (
+        select(AttivitaOrientamento)
+        .options(*opzioni_dettaglio())
+        .where(filtro_anno(AttivitaOrientamento.data_inizio, anno))
+        .order_by(AttivitaOrientamento.data_inizio, AttivitaOrientamento.id_attivita)
+    )
+    return session_db.execute(applica_visibilita(stmt, struttura)).scalars().all()
+
+
+def _lavoro(app, attivita, struttura):
+    """(nome del file, HTML, grafici da preparare) di un'attività; grafici come (nome, etichette, valori)."""
+    contesto = contesto_resoconto(attivita)
+    da_preparare = []
+    grafici_src = {}
+    if contesto['dati_disponibili']:
+        for nome in grafici.GRAFICI:
+            etichette, valori = grafici.dati_grafico(contesto, nome)
+            chiave = grafici.chiave(nome, 'svg', etichette, valori)
+            da_preparare.append((nome, etichette, valori))
+            grafici_src[nome] = 'file://' + grafici.percorso(chiave, 'svg')
+
+    with app.test_request_context():
+        html = render_template('resoconto_attivita.html', struttura=struttura, stampa=True,
+                               grafici_src=grafici_src, **contesto)
+    nome_file = f"{attivita.data_inizio:%Y-%m-%d}_{attivita.id_attivita}_{nome_sicuro(attivita.nome)}.pdf"
+    return nome_file, html, da_preparare
+
+
+def _converti(nome_file, html, da_preparare, cartella_static):
+    """Eseguita nei processi del pool: grafici in cache, poi HTML -> PDF."""
+    for nome, etichette, valori in da_preparare:
+        grafici.file_grafico(nome, 'svg', etichette, valori, attesa=None)
+
+    def risorse(url):
+        # /static/... del template -> file della cartella static; niente rete
+        if url.startswith('file:///static/'):
+            url = 'file://' + os.path.join(cartella_static, url[len('file:///static/'):])
+        if not url.startswith('file://'):
+            raise ValueError(f"Risorsa esterna non consentita: {url}")
+        return weasyprint.default_url_fetcher(url)
+
+    pdf = weasyprint.HTML(string=html, base_url='file:///', url_fetcher=risorse).write_pdf()
+    return nome_file, pdf
+
+
+def genera_zip(app, session_db, struttura, anno, destinazione, processi=None, avanzamento=None):
+    """
+    Scrive in `destinazione` uno zip con un PDF per attività e restituisce il
+    numero di PDF. `avanzamento(totale, fatti)` viene chiamata all'inizio e
+    dopo ogni PDF. Lo zip compare solo a lavoro completato.
+    """
+    processi = processi or os.cpu_count() or 1
+    attivita = carica_attivita(session_db, struttura, anno)
+    if avanzamento:
+        avanzamento(len(attivita), 0)
+
+    temporaneo = destinazione + '.tmp'
+    fatti = 0
+    try:
+        # I PDF sono già compressi: lo zip li archivia senza ricomprimerli
+        with zipfile.ZipFile(temporaneo, 'w', zipfile.ZIP_STORED) as zf, \
+                ProcessPoolExecutor(processi, mp_context=multiprocessing.get_context('spawn')) as pool:
+
+            def raccogli(completati):
+                nonlocal fatti
+                for future in completati:
+                    nome_file, pdf = future.result()
+                    zf.writestr(nome_file, pdf)
+                    fatti += 1
+                    if avanzamento:
+                        avanzamento(len(attivita), fatti)
+
+            in_corso = set()
+            for a in attivita:
+                if len(in_corso) >= 2 * processi:
+                    completati, in_corso = wait(in_corso, return_when=FIRST_COMPLETED)
+                    raccogli(completati)
+                in_corso.add(pool.submit(_converti, *_lavoro(app, a, struttura), app.static_folder))
+            raccogli(wait(in_corso).done)
+        os.replace(temporaneo, destinazione)
+    except BaseException:
+        if os.path.exists(temporaneo):
+            os.remove(temporaneo)
+        raise
+    return fatti
@@ -0,0 +1,255 @@
+from datetime import date
+from collections import defaultdict
+
+from sqlalchemy import func, distinct
+
+from database.counters import leggi_contatori
+from database.models import AttivitaOrientamento, Scuola, IndirizzoScolastico, Partecipa, Collabora
+from database.parallelo import esegui_in_parallelo
+from database.periodi import filtro_anno
+from database.visibility import ATENEO, applica_visibilita
+
+
+# Ogni widget del resoconto è calcolato da una funzione indipendente
+# (session_db, scope, anno) -> dato JSON, servita da /api/resoconto/<widget>
+# e messa in cache separatamente. Gli snapshot degli anni chiusi contengono
+# gli stessi dati, sotto la chiave indicata in WIDGET_RESOCONTO.
+
+def _query_base(session_db, scope, anno):
+    """
+    Attività visibili a `scope` nell'anno (o sull'intero storico) e loro
+    partecipazioni, filtrate anche sulla propria copia della data di inizio
+    (con le tabelle partizionate legge solo la partizione dell'anno).
+    """
+    base_query = applica_visibilita(session_db.query(AttivitaOrientamento), scope)
+    if anno is not None:
+        base_query = base_query.filter(filtro_anno(AttivitaOrientamento.data_inizio, anno))
+    stmt_ids = base_query.with_entities(AttivitaOrientamento.id_attivita)
+    partecipazioni_q = session_db.query(Partecipa).filter(Partecipa.id_attivita.in_(stmt_ids))
+    if anno is not None:
+        partecipazioni_q = partecipazioni_q.filter(filtro_anno(Partecipa.data_inizio, anno))
+    return base_query, partecipazioni_q
+
+
+def kpi_resoconto(session_db, scope, anno=None):
+    """Totali di attività (svolte e programmate), studenti, ore, scuole e indirizzi."""
+
+    # Totali dai contatori incrementali; le attività programmate dipendono dalla
+    # data odierna e si contano al volo (poche righe, indice su data_fine), nella
+    # stessa query dei contatori: le svolte, che ne sono la differenza, non
+    # possono mescolare due fotografie diverse dei dati.
+    def contatori(s):
+        base_query, _ = _query_base(s, scope, anno)
+        programmate = base_query.filter(AttivitaOrientamento.data_fine >= date.today()) \
+            .with_entities(func.count(AttivitaOrientamento.id_attivita)).scalar_subquery()
+        return leggi_contatori(s, scope, anno, programmate)
+
+    def scuole(s):
+        _, partecipazioni_q = _query_base(s, scope, anno)
+        return partecipazioni_q.with_entities(
+            func.count(func.distinct(Partecipa.codice_meccanografico))).scalar() or 0
+
+    def indirizzi(s):
+        _, partecipazioni_q = _query_base(s, scope, anno)
+        return partecipazioni_q.join(IndirizzoScolastico).with_entities(
+            func.count(func.distinct(IndirizzoScolastico.indirizzo))).scalar() or 0
+
+    (kpi_attivita, kpi_ore, kpi_studenti, kpi_programmate), kpi_scuole, kpi_indirizzi = esegui_in_parallelo(
+        [contatori, scuole, indirizzi], session_db)
+    kpi_svolte = kpi_attivita - kpi_programmate
+
+    return {'attivita': kpi_attivita, 'svolte': kpi_svolte, 'programmate': kpi_programmate,
+            'studenti': kpi_studenti, 'scuole': kpi_scuole, 'indirizzi': kpi_indirizzi, 'ore': kpi_ore}
+
+
+def scuole_resoconto(session_db, scope, anno=None):
+    """Prime 10 scuole per studenti coinvolti."""
+    _, partecipazioni_q = _query_base(session_db, scope, anno)
+    q_scuole = partecipazioni_q.join(IndirizzoScolastico).join(Scuola).with_entities(
+        Scuola.nome,
+        func.sum(func.coalesce(Partecipa.totale_maschi, 0)),
+        func.sum(func.coalesce(Partecipa.totale_femmine, 0)),
+        func.sum(func.coalesce(Partecipa.totale_studenti, 0)),
+        func.count(distinct(Partecipa.id_attivita))
+    ).group_by(Scuola.nome).order_by(func.sum(Partecipa.totale_studenti).desc()).limit(10).all()
+
+    return {
+        'labels': [s[0] for s in q_scuole],
+        'maschi': [s[1] for s in q_scuole],
+        'femmine': [s[2] for s in q_scuole],
+        'altro': [(s[3] - (s[1] + s[2])) for s in q_scuole],
+        'attivita': [s[4] for s in q_scuole]
+    }
+
+
+def indirizzi_resoconto(session_db, scope, anno=None):
+    """Primi 10 indirizzi per studenti coinvolti."""
+    _, partecipazioni_q = _query_base(session_db, scope, anno)
+    q_indirizzi = partecipazioni_q.join(IndirizzoScolastico).with_entities(
+        IndirizzoScolastico.indirizzo,
+        func.sum(func.coalesce(Partecipa.totale_maschi, 0)),
+        func.sum(func.coalesce(Partecipa.totale_femmine, 0)),
+        func.sum(func.coalesce(Partecipa.totale_studenti, 0)),
+        func.count(distinct(Partecipa.id_attivita))
+    ).group_by(IndirizzoScolastico.indirizzo).order_by(func.sum(Partecipa.totale_studenti).desc()).limit(10).all()
+
+    return {
+        'labels': [i[0] for i in q_indirizzi],
+        'maschi': [i[1] for i in q_indirizzi],
+        'femmine': [i[2] for i in q_indirizzi],
+        'altro': [(i[3] - (i[1] + i[2])) for i in q_indirizzi],
+        'attivita': [i[4] for i in q_indirizzi]
+    }
+
+
+def trend_resoconto(session_db, scope, anno=None):
+    """Attività e studenti per mese di inizio."""
+    base_query, _ = _query_base(session_db, scope, anno)
+    all_attivita = base_query.order_by(AttivitaOrientamento.data_inizio).all()
+    trend_data = defaultdict(lambda: {'studenti': 0, 'm': 0, 'f': 0, 'alt': 0, 'attivita': 0})
+
+    all_ids = [a.id_attivita for a in all_attivita]
+    part_data = {}
+    if all_ids:
+        q_part = session_db.query(
+            Partecipa.id_attivita,
+            func.sum(Partecipa.totale_studenti),
+            func.sum(Partecipa.totale_maschi),
+            func.sum(Partecipa.totale_femmine)
+        ).filter(Partecipa.id_attivita.in_(all_ids))
+        if anno is not None:
+            q_part = q_part.filter(filtro_anno(Partecipa.data_inizio, anno))
+        q_part = q_part.group_by(Partecipa.id_attivita).all()
+
+        for row in q_part:
+            t, m, f = row[1] or 0, row[2] or 0, row[3] or 0
+            part_data[row[0]] = {'tot': t, 'm': m, 'f': f, 'alt': t - (m + f)}
+
+    for att in all_attivita:
+        k = att.data_inizio.strftime('%Y-%m')
+        trend_data[k]['attivita'] += 1
+        if att.id_attivita in part_data:
+            d = part_data[att.id_attivita]
+            trend_data[k]['studenti'] += d['tot']
+            trend_data[k]['m'] += d['m']
+            trend_data[k]['f'] += d['f']
+            trend_data[k]['alt'] += d['alt']
+
+    sorted_keys = sorted(trend_data.keys())
+
+    return {
+        'labels': sorted_keys,
+        'attivita': [trend_data[k]['attivita'] for k in sorted_keys],
+        'studenti': [trend_data[k]['studenti'] for k in sorted_keys],
+        'maschi': [trend_data[k]['m'] for k in sorted_keys],
+        'femmine': [trend_data[k]['f'] for k in sorted_keys],
+        'altro': [trend_data[k]['alt'] for k in sorted_keys]
+    }
+
+
+def sesso_resoconto(session_db, scope, anno=None):
+    """Studenti per genere: [maschi, femmine, altro]."""
+    _, partecipazioni_q = _query_base(session_db, scope, anno)
+    q_tot_sesso = partecipazioni_q.with_entities(
+        func.sum(func.coalesce(Partecipa.totale_studenti, 0)),
+        func.sum(func.coalesce(Partecipa.totale_maschi, 0)),
+        func.sum(func.coalesce(Partecipa.totale_femmine, 0))
+    ).first()
+    ts, tm, tf = q_tot_sesso[0] or 0, q_tot_sesso[1] or 0, q_tot_sesso[2] or 0
+
+    return [tm, tf, ts - (tm + tf)]
+
+
+# nome del widget -> (chiave nello snapshot, funzione di calcolo)
+WIDGET_RESOCONTO = {
+    'kpi': ('kpi', kpi_resoconto),
+    'trend': ('chart_trend', trend_resoconto),
+    'scuole': ('chart_scuole', scuole_resoconto),
+    'indirizzi': ('chart_indirizzi', indirizzi_resoconto),
+    'sesso': ('chart_sesso', sesso_resoconto),
+}
+
+
+def aggregati_resoconto(session_db, scope, anno=None):
+    """
+    Tutti i widget del resoconto per `scope` e anno, come dizionario di soli
+    tipi JSON (è il contenuto salvato negli snapshot degli anni chiusi).
+    I widget sono calcolati in parallelo.
+    """
+    widget = list(WIDGET_RESOCONTO.values())
+    risultati = esegui_in_parallelo(
+        [lambda s, calcola=calcola: calcola(s, scope, anno) for _, calcola in widget], session_db)
+    return {chiave: risultato for (chiave, _), risultato in zip(widget, risultati)}
+
+
+def contributo_attivita(session_db, id_attivita):
+    """
+    Quanto una singola attività pesa sui widget del resoconto (None se non
+    esiste): strutture che la vedono, anno e mese di inizio, stato e totali.
+    La differenza tra il contributo dopo e prima di una modifica è il delta
+    inviato alle dashboard aperte.
+    """
+    attivita = session_db.query(
+        AttivitaOrientamento.struttura_organizzante,
+        AttivitaOrientamento.data_inizio,
+        AttivitaOrientamento.data_fine,
+        AttivitaOrientamento.totale_ore,
+    ).filter(AttivitaOrientamento.id_attivita == id_attivita).first()
+    if attivita is None:
+        return None
+
+    collaboratori = session_db.query(Collabora.nome_struttura).filter(
+        Collabora.id_attivita == id_attivita).all()
+    ts, tm, tf = session_db.query(
+        func.sum(func.coalesce(Partecipa.totale_studenti, 0)),
+        func.sum(func.coalesce(Partecipa.totale_maschi, 0)),
+        func.sum(func.coalesce(Partecipa.totale_femmine, 0))
+    ).filter(Partecipa.id_attivita == id_attivita).first()
+    ts, tm, tf = ts or 0, tm or 0, tf or 0
+
+    return {
+        'strutture': sorted({attivita[0], ATENEO, *(c[0] for c in collaboratori)}),
+        'organizzante': attivita[0],
+        'anno': attivita[1].year,
+        'mese': attivita[1].strftime('%Y-%m'),
+        'programmata': attivita[2] >= date.today(),
+        'ore': attivita[3] or 0,
+        'studenti': ts,
+        'maschi': tm,
+        'femmine': tf,
+        'altro': ts - (tm + tf),
+    }
+
+
+def confronto_strutture(session_db):
+    """Grafici di confronto tra strutture organizzanti (solo Ateneo, intero storico)."""
+    def studenti(s):
+        return s.query(
+            AttivitaOrientamento.struttura_organizzante,
+            func.sum(func.coalesce(Partecipa.totale_maschi, 0)),
+            func.sum(func.coalesce(Partecipa.totale_femmine, 0)),
+            func.sum(func.coalesce(Partecipa.totale_studenti, 0))
+        ).outerjoin(Partecipa).group_by(AttivitaOrientamento.struttura_organizzante).order_by(
+            AttivitaOrientamento.struttura_organizzante).all()
+
+    def attivita(s):
+        return s.query(
+            AttivitaOrientamento.struttura_organizzante,
+            func.count(AttivitaOrientamento.id_attivita)
+        ).group_by(AttivitaOrientamento.struttura_organizzante).order_by(
+            AttivitaOrientamento.struttura_organizzante).all()
+
+    q_comp_stud, q_comp_att = esegui_in_parallelo([studenti, attivita], session_db)
+
+    chart_comp_stud_stacked = {
+        'labels': [r[0] for r in q_comp_stud],
+        'maschi': [r[1] or 0 for r in q_comp_stud],
+        'femmine': [r[2] or 0 for r in q_comp_stud],
+        'altro': [((r[3] or 0) - ((r[1] or 0) + (r[2] or 0))) for r in q_comp_stud]
+    }
+
+    chart_comp_att_line = {
+        'labels': [r[0] for r in q_comp_att],
+        'data': [r[1] for r in q_comp_att]
+    }
+    return chart_comp_stud_stacked, chart_comp_att_line
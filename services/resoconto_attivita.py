@@ -0,0 +1,124 @@
+from collections import Counter
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import joinedload, selectinload
+
+from database.models import AttivitaOrientamento, Supervisiona, Partecipa, IndirizzoScolastico, Scuola
+
+
+def opzioni_dettaglio():
+    """
+    Opzioni di caricamento per il resoconto di un'attività.
+    Le collezioni usano selectinload (una query ciascuna, niente prodotto
+    cartesiano); le relazioni molti-a-uno restano in joinedload.
+    """
+    return (
+        joinedload(AttivitaOrientamento.docente_presidente_rel),
+        selectinload(AttivitaOrientamento.supervisioni).joinedload(Supervisiona.docente_supervisore_rel),
+        selectinload(AttivitaOrientamento.collaborazioni),
+        selectinload(AttivitaOrientamento.partecipazioni).joinedload(Partecipa.indirizzi).options(
+            joinedload(IndirizzoScolastico.scuola).joinedload(Scuola.info_personali_dirigente),
+            joinedload(IndirizzoScolastico.info_personali_referente)
+        ),
+    )
+
+
+def carica_dettaglio(session_db, id_attivita):
+    """Carica l'attività con tutto ciò che serve al resoconto (None se non esiste)."""
+    stmt = select(AttivitaOrientamento).options(*opzioni_dettaglio()).where(
+        AttivitaOrientamento.id_attivita == id_attivita)
+    return session_db.execute(stmt).scalars().first()
+
+
+def versione_resoconto(session_db, id_attivita):
+    """
+    (versione dell'attività, somma delle versioni delle sue scuole) senza
+    caricare il dettaglio, None se l'attività non esiste. Cambia a ogni
+    modifica dell'attività o dei partecipanti e a ogni modifica dei dati di
+    una scuola partecipante (il nome compare nei grafici).
+    """
+    scuole = select(func.coalesce(func.sum(Scuola.versione), 0)).where(
+        Scuola.codice_meccanografico.in_(
+            select(Partecipa.codice_meccanografico).where(Partecipa.id_attivita == id_attivita))
+    ).scalar_subquery()
+    stmt = select(AttivitaOrientamento.versione, scuole).where(AttivitaOrientamento.id_attivita == id_attivita)
+    riga = session_db.execute(stmt).first()
+    return tuple(riga) if riga is not None else None
+
+
+def format_supervisori(supervisioni):
+    return format_docenti([(s.docente_supervisore_rel.cognome, s.docente_supervisore_rel.nome,
+                            s.docente_supervisore_rel.email) for s in supervisioni])
+
+
+def format_docenti(docenti):
+    """Elenco (cognome, nome, email) come stringa; l'email compare solo per gli omonimi."""
+    if not docenti:
+        return ""
+
+    counts = Counter(f"{cognome} {nome}" for cognome, nome, _ in docenti)
+
+    output = []
+    for cognome, nome, email in docenti:
+        nome_completo = f"{cognome} {nome}"
+        if counts[nome_completo] > 1:
+            output.append(f"{nome_completo} - {email}")
+        else:
+            output.append(nome_completo)
+    return ", ".join(sorted(list(set(output))))
+
+
+def contesto_resoconto(attivita):
+    """
+    Calcola in un solo passaggio sulle partecipazioni già caricate il
+    raggruppamento per scuola e i dati dei grafici (scuole, indirizzi, genere).
+    """
+    part_map = {}
+    scuole = {}
+    indirizzi = Counter()
+    tot_studenti = tot_m = tot_f = 0
+
+    for p in attivita.partecipazioni:
+        studenti = p.totale_studenti or 0
+        tot_studenti += studenti
+        tot_m += p.totale_maschi or 0
+        tot_f += p.totale_femmine or 0
+
+        if not p.indirizzi or not p.indirizzi.scuola:
+            continue
+
+        scuola = p.indirizzi.scuola
+        if scuola.codice_meccanografico not in part_map:
+            part_map[scuola.codice_meccanografico] = {
+                'scuola_data': scuola,
+                'indirizzi': []
+            }
+            scuole[scuola.codice_meccanografico] = [scuola.nome, 0]
+        part_map[scuola.codice_meccanografico]['indirizzi'].append(p)
+        scuole[scuola.codice_meccanografico][1] += studenti
+        indirizzi[p.indirizzo] += studenti
+
+    counts_nomi = Counter(nome for nome, _ in scuole.values())
+    chart_scuole_labels = [f"{nome} - {cm}" if counts_nomi[nome] > 1 else nome for cm, (nome, _) in scuole.items()]
+    chart_scuole_data = [totale for _, totale in scuole.values()]
+
+    q_indirizzi = indirizzi.most_common()
+    tot_altro = tot_studenti - (tot_m + tot_f)
+
+    return {
+        'attivita': attivita,
+        'supervisori_str': format_supervisori(attivita.supervisioni),
+        'collaboratori_str': ", ".join(sorted(list(set([c.nome_struttura for c in attivita.collaborazioni])))),
+        'part_map': part_map,
+        'dati_disponibili': tot_studenti > 0,
+        'chart_scuole_labels': chart_scuole_labels,
+        'chart_scuole_data': chart_scuole_data,
+        'chart_indirizzi_labels': [i for i, _ in q_indirizzi],
+        'chart_indirizzi_data': [t for _, t in q_indirizzi],
+        'chart_sesso_labels': ['Maschi', 'Femmine', 'Altro'],
+        'chart_sesso_data': [tot_m, tot_f, tot_altro],
+        'tot_studenti': tot_studenti,
+        'tot_m': tot_m,
+        'tot_f': tot_f,
+        'tot_altro': tot_altro,
+    }
@@ -0,0 +1,129 @@
+"""
+Snapshot degli anni chiusi.
+
+Gli anni passati non cambiano più: `flask anno chiudi <anno>` calcola una
+volta sola gli aggregati del resoconto per ogni struttura (più l'Ateneo)
+e le righe dell'export, e li salva in un file JSON compresso con gzip.
+Le viste storiche e l'export di quell'anno vengono poi serviti dal file,
+senza interrogare le tabelle. In caso di correzioni tardive si rigenera lo
+snapshot con `--ricostruisci`, oppure si riapre l'anno con `flask anno riapri`.
+"""
+import gzip
+import json
+import os
+import threading
+from datetime import date, datetime
+
+from sqlalchemy import select
+
+from database.models import Struttura
+from database.visibility import ATENEO
+from services.export import righe_export
+from services.resoconto import aggregati_resoconto
+
+
+SNAPSHOT_DIR = os.environ.get(
+    'SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'snapshot'))
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _percorso(anno):
+    return os.path.join(SNAPSHOT_DIR, f"anno_{anno}.json.gz")
+
+
+def anni_chiusi():
+    """Anni per cui esiste uno snapshot, in ordine crescente."""
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    anni = []
+    for nome in os.listdir(SNAPSHOT_DIR):
+        if nome.startswith('anno_') and nome.endswith('.json.gz'):
+            try:
+                anni.append(int(nome[len('anno_'):-len('.json.gz')]))
+            except ValueError:
+                pass
+    return sorted(anni)
+
+
+def chiudi_anno(session_db, anno, ricostruisci=False):
+    """
+    Calcola e scrive lo snapshot dell'anno. Solo anni già conclusi; se lo
+    snapshot esiste va richiesto esplicitamente `ricostruisci`.
+    """
+    if anno >= date.today().year:
+        raise ValueError(f"L'anno {anno} non è ancora concluso.")
+    percorso = _percorso(anno)
+    if os.path.exists(percorso) and not ricostruisci:
+        raise FileExistsError(f"L'anno {anno} è già chiuso (usare --ricostruisci).")
+
+    strutture = session_db.execute(select(Struttura.nome).order_by(Struttura.nome)).scalars().all()
+    scope = [ATENEO] + [s for s in strutture if s != ATENEO]
+    snapshot = {
+        'anno': anno,
+        'creato_il': datetime.now().isoformat(timespec='seconds'),
+        'resoconto': {s: aggregati_resoconto(session_db, s, anno) for s in scope},
+        'export': list(righe_export(session_db, anno)),
+    }
+
+    # Scrittura atomica: i lettori vedono il file vecchio o quello nuovo, mai a metà
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    temporaneo = percorso + '.tmp'
+    with gzip.open(temporaneo, 'wt', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(temporaneo, percorso)
+    return snapshot
+
+
+def riapri_anno(anno):
+    """Elimina lo snapshot: l'anno torna a essere calcolato dalle tabelle."""
+    try:
+        os.remove(_percorso(anno))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def leggi_snapshot(anno):
+    """
+    Snapshot dell'anno (None se l'anno non è chiuso). Il contenuto resta in
+    memoria finché il file non cambia, così ogni worker lo decomprime una volta.
+    """
+    percorso = _percorso(anno)
+    try:
+        mtime = os.stat(percorso).st_mtime_ns
+    except FileNotFoundError:
+        with _lock:
+            _cache.pop(anno, None)
+        return None
+
+    with _lock:
+        voce = _cache.get(anno)
+        if voce is not None and voce[0] == mtime:
+            return voce[1]
+
+    with gzip.open(percorso, 'rt', encoding='utf-8') as f:
+        snapshot = json.load(f)
+    with _lock:
+        _cache[anno] = (mtime, snapshot)
+    return snapshot
+
+
+def aggregati_snapshot(anno, scope):
+    """Aggregati del resoconto dallo snapshot, o None se non disponibili."""
+    if anno is None:
+        return None
+    snapshot = leggi_snapshot(anno)
+    if snapshot is None:
+        return None
+    return snapshot['resoconto'].get(scope)
+
+
+def righe_export_snapshot(anno):
+    """Righe dell'export dallo snapshot, o None se l'anno non è chiuso."""
+    if anno is None:
+        return None
+    snapshot = leggi_snapshot(anno)
+    return snapshot['export'] if snapshot is not None else None
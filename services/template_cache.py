@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+from database.versioning import data_version
+
+
+class FragmentCache:
+    """
+    Cache LRU dei frammenti HTML già renderizzati.
+    Le chiavi contengono la versione dei dati da cui il frammento dipende;
+    il TTL limita la durata di un frammento quando i dati vengono modificati
+    da un altro worker (le versioni sono tenute per processo).
+    """
+
+    def __init__(self, max_voci=512, ttl=10):
+        self.max_voci = max_voci
+        self.ttl = ttl
+        self._voci = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, chiave, render):
+        adesso = time.monotonic()
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is not None and adesso - voce[0] < self.ttl:
+                self._voci.move_to_end(chiave)
+                return voce[1]
+
+        html = render()
+
+        with self._lock:
+            self._voci[chiave] = (adesso, html)
+            self._voci.move_to_end(chiave)
+            while len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._voci.clear()
+
+
+fragment_cache = FragmentCache(
+    max_voci=int(os.environ.get('FRAGMENT_CACHE_SIZE', 512)),
+    ttl=float(os.environ.get('FRAGMENT_CACHE_TTL', 10)),
+)
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Aggiunge il tag {% cache chiave, ... %} ... {% endcache %}.
+    Il contenuto del blocco viene renderizzato una sola volta per ogni
+    combinazione di argomenti e poi servito dalla cache.
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_cached', [nodes.Const(parser.name), nodes.List(args)]),
+            [], [], body
+        ).set_lineno(lineno)
+
+    def _render_cached(self, template, chiave, caller):
+        return fragment_cache.get_or_render((template, *chiave), caller)
+
+
+def configura_template(app):
+    """
+    Attiva la cache del bytecode Jinja, il tag {% cache %} e la funzione
+    data_version() nei template, poi precompila tutti i template.
+    """
+    cartella = os.environ.get('JINJA_BYTECODE_DIR')
+    if cartella:
+        os.makedirs(cartella, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cartella)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.globals['data_version'] = data_version
+    precompila_template(app)
+
+
+def precompila_template(app):
+    """
+    Compila (o carica dal bytecode) ogni template all'avvio, così la prima
+    richiesta servita da ciascun worker non paga il costo di compilazione.
+    """
+    for nome in app.jinja_env.list_templates(extensions=('html',)):
+        app.jinja_env.get_template(nome)
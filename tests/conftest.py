@@ -0,0 +1,90 @@
+"""
+Fixture comuni: app e database SQLite temporaneo, ricreato per ogni test con
+un piccolo insieme di anagrafiche e attività.
+"""
+import os
+import sys
+import tempfile
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+_CARTELLA = tempfile.mkdtemp(prefix='orienta_test_')
+# Prima di importare l'app: l'engine legge DATABASE_URL alla prima istanza. Con
+# TEST_DATABASE_URL i test girano su un database PostgreSQL usa e getta (trigger KPI)
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or \
+    'sqlite:///' + os.path.join(_CARTELLA, 'test.db')
+os.environ.setdefault('SLOW_QUERY_MS', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from database import counters  # noqa: E402
+from database.db_connection import Database, Base  # noqa: E402
+from database.models import (  # noqa: E402
+    Struttura, PersonaleUniversitario, PersonaleScolastico, Scuola, IndirizzoScolastico,
+    AttivitaOrientamento, Collabora
+)
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    app.testing = True
+    return app
+
+
+@event.listens_for(Database().engine, 'connect')
+def _chiavi_esterne_sqlite(dbapi_connection, connection_record):
+    # Cascate delle chiavi esterne (es. partecipa.data_inizio) come su PostgreSQL
+    if Database().engine.dialect.name == 'sqlite':
+        dbapi_connection.execute('PRAGMA foreign_keys = ON')
+
+
+@pytest.fixture
+def session_db(app):
+    engine = Database().engine
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        counters.installa_trigger(conn)
+    s = Database().session_factory()
+    s.info['utente'] = 'test'
+    s.add_all([Struttura(nome=n) for n in ('Ateneo di Verona', 'Informatica', 'Lettere', 'Medicina')])
+    s.add(PersonaleUniversitario(email='anna@univr.it', nome='Anna', cognome='Rossi'))
+    s.add(PersonaleScolastico(email='dirigente@scuola.it', nome='Dario', cognome='Bianchi'))
+    s.flush()
+    s.add(Scuola(codice_meccanografico='VRPS01000A', nome='Liceo Fracastoro', email='info@scuola.it',
+                 numero_telefonico='+39 045 000000', via='Via Roma', numero_civico=1, comune='Verona',
+                 dirigente='dirigente@scuola.it'))
+    s.flush()
+    s.add(IndirizzoScolastico(codice_meccanografico='VRPS01000A', indirizzo='Scientifico',
+                              referente='dirigente@scuola.it'))
+
+    # 1: organizzata da Informatica; 2: Lettere con la collaborazione di Informatica;
+    # 3: Informatica con la collaborazione di Lettere e Medicina; 4: Medicina, senza collaborazioni
+    for id_attivita, struttura in ((1, 'Informatica'), (2, 'Lettere'), (3, 'Informatica'), (4, 'Medicina')):
+        s.add(AttivitaOrientamento(id_attivita=id_attivita, nome=f'Attività {id_attivita}',
+                                   data_inizio=date(2024, 3, id_attivita), data_fine=date(2024, 3, id_attivita),
+                                   totale_ore=2, struttura_organizzante=struttura,
+                                   docente_presidente='anna@univr.it'))
+    s.flush()
+    s.add_all([
+        Collabora(id_attivita=2, nome_struttura='Informatica'),
+        Collabora(id_attivita=3, nome_struttura='Lettere'),
+        Collabora(id_attivita=3, nome_struttura='Medicina'),
+    ])
+    s.commit()
+    yield s
+    s.close()
+
+
+@pytest.fixture
+def client_ufficio(app, session_db):
+    """Client autenticato come Ufficio Orientamento."""
+    client = app.test_client()
+    with client.session_transaction() as sessione:
+        sessione['user'] = 'anna@univr.it'
+        sessione['ruolo'] = 'Ufficio Orientamento'
+        sessione['struttura'] = 'Ateneo di Verona'
+    return client
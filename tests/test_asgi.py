@@ -0,0 +1,68 @@
+"""
+Entry point ASGI: sessione letta dal cookie firmato da Flask, redirect per
+gli utenti anonimi e stesse risposte JSON delle rotte Flask.
+"""
+import asyncio
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+pytest.importorskip('aiosqlite')
+
+import asgi  # noqa: E402
+from database.async_db import AsyncDatabase  # noqa: E402
+from database.models import Partecipa  # noqa: E402
+
+URL = [
+    '/api/indirizzi/VRPS01000A',
+    '/api/indirizzi?scuole=VRPS01000A,XX',
+    '/api/cerca_attivita?q=Attivit',
+    '/api/confronta_edizioni?ids=1,3',
+    '/api/confronta_edizioni?ids=1,x',
+    '/api/confronta_edizioni?ids=',
+    '/api/serie_edizioni?id=3',
+    '/api/serie_edizioni?id=abc',
+]
+
+
+def _client_flask(struttura):
+    client = asgi.flask_app.test_client()
+    with client.session_transaction() as sessione:
+        sessione['user'] = 'anna@univr.it'
+        sessione['ruolo'] = 'Ufficio Orientamento' if struttura == 'Ateneo di Verona' else 'Personale'
+        sessione['struttura'] = struttura
+    return client
+
+
+def _get_asgi(percorsi, cookie=None):
+    async def esegui():
+        trasporto = httpx.ASGITransport(app=asgi.app)
+        try:
+            async with httpx.AsyncClient(transport=trasporto, base_url='http://test', cookies=cookie) as client:
+                return [await client.get(p) for p in percorsi]
+        finally:
+            await AsyncDatabase().dispose()
+    return asyncio.run(esegui())
+
+
+@pytest.mark.parametrize('struttura', ['Ateneo di Verona', 'Lettere'])
+def test_stesso_json_delle_rotte_flask(session_db, struttura):
+    session_db.add(Partecipa(id_attivita=1, codice_meccanografico='VRPS01000A', indirizzo='Scientifico',
+                             totale_studenti=20, totale_maschi=12, totale_femmine=8))
+    session_db.commit()
+
+    client = _client_flask(struttura)
+    cookie = {asgi.flask_app.config['SESSION_COOKIE_NAME']:
+              client.get_cookie(asgi.flask_app.config['SESSION_COOKIE_NAME']).value}
+    for url, risposta in zip(URL, _get_asgi(URL, cookie)):
+        attesa = client.get(url)
+        assert attesa.status_code == 200, url
+        assert risposta.status_code == 200, url
+        assert risposta.headers['content-type'] == 'application/json'
+        assert risposta.json() == attesa.get_json(), url
+
+
+def test_anonimo_reindirizzato(session_db):
+    percorsi = ['/api/indirizzi/VRPS01000A', '/api/cerca_attivita?q=x', '/api/resoconto/eventi']
+    risposte = _get_asgi(percorsi) + _get_asgi(percorsi, {asgi.flask_app.config['SESSION_COOKIE_NAME']: 'falso'})
+    assert [(r.status_code, r.headers['location']) for r in risposte] == [(302, '/')] * 6
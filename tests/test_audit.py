@@ -0,0 +1,45 @@
+"""Registro delle modifiche: le modifiche fatte dalle rotte arrivano in registro_modifiche."""
+from sqlalchemy import select
+
+from database.models import RegistroModifica, PersonaleUniversitario
+
+
+def _voci(session_db, entita):
+    """Voci scritte dalle richieste (esclusi i dati iniziali della fixture, con utente 'test')."""
+    session_db.expire_all()
+    return session_db.execute(
+        select(RegistroModifica)
+        .where(RegistroModifica.entita == entita, RegistroModifica.utente != 'test')
+        .order_by(RegistroModifica.id)
+    ).scalars().all()
+
+
+def test_modifica_personale_registrata(client_ufficio, session_db):
+    r = client_ufficio.post('/personale/modifica/anna@univr.it', data={'nome': 'Annalisa', 'cognome': 'Rossi'})
+    assert r.status_code == 302
+    voci = _voci(session_db, 'personale_universitario')
+    assert [(v.operazione, v.chiave, v.utente) for v in voci] == [('UPDATE', 'anna@univr.it', 'anna@univr.it')]
+    assert '"Annalisa"' in voci[0].valori
+
+
+def test_inserisci_e_cancella_personale_registrati(client_ufficio, session_db):
+    r = client_ufficio.post('/personale/inserisci',
+                            data={'email': 'bruno@univr.it', 'nome': 'Bruno', 'cognome': 'Verdi'})
+    assert r.status_code == 302
+    assert session_db.get(PersonaleUniversitario, 'bruno@univr.it') is not None
+    r = client_ufficio.post('/personale/cancella/bruno@univr.it')
+    assert r.status_code == 200
+    voci = _voci(session_db, 'personale_universitario')
+    assert [(v.operazione, v.chiave) for v in voci] == [('INSERT', 'bruno@univr.it'), ('DELETE', 'bruno@univr.it')]
+
+
+def test_modifica_scuola_registrata(client_ufficio, session_db):
+    r = client_ufficio.post('/scuole/modifica/VRPS01000A', data={
+        'nome': 'Liceo Fracastoro', 'email': 'segreteria@scuola.it', 'numero_telefonico': '+39 045 000000',
+        'via': 'Via Roma', 'numero_civico': '1', 'comune': 'Verona', 'dirigente_email': 'dirigente@scuola.it',
+        'dirigente_nome': 'Dario', 'dirigente_cognome': 'Bianchi', 'versione': '1',
+    })
+    assert r.status_code == 302
+    voci = _voci(session_db, 'scuola')
+    assert [v.operazione for v in voci] == ['UPDATE']
+    assert 'segreteria@scuola.it' in voci[0].valori
@@ -0,0 +1,93 @@
+"""
+Contatori KPI mantenuti con i delta: dopo modifiche, cancellazioni massive e
+spostamenti tra anni coincidono con il ricalcolo completo.
+"""
+import io
+from datetime import date
+
+import pytest
+from sqlalchemy import delete, text, update
+
+from database.counters import differenze, leggi_contatori
+from database.models import AttivitaOrientamento, Collabora, IndirizzoScolastico, Partecipa
+from services.importa import importa_partecipazioni
+
+
+def _verifica(session_db):
+    assert differenze(session_db.connection()) == []
+    session_db.commit()
+
+
+def _partecipa(id_attivita, indirizzo, studenti):
+    return Partecipa(id_attivita=id_attivita, codice_meccanografico='VRPS01000A', indirizzo=indirizzo,
+                     totale_studenti=studenti, totale_maschi=studenti - 1, totale_femmine=1)
+
+
+def test_contatori_incrementali(client_ufficio, session_db):
+    session_db.add(IndirizzoScolastico(codice_meccanografico='VRPS01000A', indirizzo='Classico',
+                                       referente='dirigente@scuola.it'))
+    session_db.add_all([_partecipa(1, 'Scientifico', 20), _partecipa(1, 'Classico', 5),
+                        _partecipa(3, 'Scientifico', 30)])
+    session_db.commit()
+    _verifica(session_db)
+    assert leggi_contatori(session_db, 'Lettere', 2024) == (2, 4, 30)
+    assert leggi_contatori(session_db, 'Ateneo di Verona', 2024) == (4, 8, 55)
+
+    # Modifica: ore, organizzante già collaboratore e partecipanti
+    attivita = session_db.get(AttivitaOrientamento, 3)
+    attivita.totale_ore = 5
+    attivita.struttura_organizzante = 'Lettere'
+    session_db.get(Partecipa, (1, 'VRPS01000A', 'Classico')).totale_studenti = 8
+    session_db.commit()
+    _verifica(session_db)
+    assert leggi_contatori(session_db, 'Lettere', 2024) == (2, 7, 30)
+    assert leggi_contatori(session_db, 'Informatica', 2024) == (2, 4, 28)
+
+    # Spostamento tra anni, anche di un'attività con collaborazioni e partecipanti
+    for id_attivita, giorno in ((3, date(2023, 11, 20)), (2, date(2025, 1, 10))):
+        attivita = session_db.get(AttivitaOrientamento, id_attivita)
+        attivita.data_inizio = attivita.data_fine = giorno
+    session_db.commit()
+    _verifica(session_db)
+    assert leggi_contatori(session_db, 'Medicina', 2023) == (1, 5, 30)
+    assert leggi_contatori(session_db, 'Lettere', 2024) == (0, 0, 0)
+
+    # Cancellazioni e modifiche massive
+    session_db.execute(delete(Partecipa).where(Partecipa.id_attivita == 1))
+    session_db.execute(delete(Collabora).where(Collabora.nome_struttura == 'Medicina'))
+    session_db.execute(update(AttivitaOrientamento).where(AttivitaOrientamento.id_attivita.in_([1, 4]))
+                       .values(data_inizio=date(2023, 5, 1), data_fine=date(2023, 5, 1), totale_ore=1))
+    session_db.commit()
+    _verifica(session_db)
+    assert leggi_contatori(session_db, 'Medicina', 2023) == (1, 1, 0)
+
+    # Import massivo (statement Core) e cancellazione di un'attività con le sue righe
+    importa_partecipazioni(session_db, io.BytesIO(
+        "id;cm;indirizzo;classi;tot;m;f;altro\n"
+        "2;VRPS01000A;Scientifico;;12;6;6;\n"
+        "3;VRPS01000A;Scientifico;;40;20;20;\n".encode('utf-8')))
+    session_db.commit()
+    _verifica(session_db)
+    assert client_ufficio.post('/cancella_attivita/3').get_json() == {'success': True}
+    _verifica(session_db)
+    assert leggi_contatori(session_db, 'Lettere') == (1, 2, 12)
+
+
+def test_trigger_cascate(session_db):
+    """Solo PostgreSQL: cancellazioni e cambi di id in cascata dalle chiavi esterne."""
+    if session_db.get_bind().dialect.name != 'postgresql':
+        pytest.skip("cascate gestite dai trigger PostgreSQL")
+    session_db.add_all([_partecipa(2, 'Scientifico', 20), _partecipa(3, 'Scientifico', 30)])
+    session_db.commit()
+    _verifica(session_db)
+
+    for sql in (
+        "UPDATE attivita_orientamento SET id_attivita = 30, totale_ore = 6 WHERE id_attivita = 3",
+        "UPDATE collabora SET nome_struttura = 'Informatica' WHERE id_attivita = 30 AND nome_struttura = 'Medicina'",
+        "UPDATE collabora SET id_attivita = 4 WHERE id_attivita = 30 AND nome_struttura = 'Lettere'",
+        "DELETE FROM attivita_orientamento WHERE id_attivita = 2",
+        "DELETE FROM indirizzo_scolastico WHERE indirizzo = 'Scientifico'",
+    ):
+        session_db.execute(text(sql))
+        _verifica(session_db)
+    assert leggi_contatori(session_db, 'Lettere', 2024) == (1, 2, 0)
@@ -0,0 +1,42 @@
+"""Stream SSE sulla rotta Flask: numero limitato di stream per processo."""
+from services import eventi
+
+
+def test_stream_oltre_il_limite_rifiutati(client_ufficio):
+    aperti = [client_ufficio.get('/api/resoconto/eventi', buffered=False)
+              for _ in range(eventi.SSE_MAX_STREAM_WSGI)]
+    try:
+        assert [r.status_code for r in aperti] == [200] * eventi.SSE_MAX_STREAM_WSGI
+        assert next(aperti[0].response) == b'retry: 5000\n\n'
+        rifiutato = client_ufficio.get('/api/resoconto/eventi')
+        assert rifiutato.status_code == 503
+    finally:
+        for r in aperti:
+            r.close()
+    # Chiusi gli stream (anche quelli mai letti), i posti tornano disponibili
+    risposta = client_ufficio.get('/api/resoconto/eventi', buffered=False)
+    assert risposta.status_code == 200
+    risposta.close()
+
+
+def test_evento_consegnato_allo_stream(client_ufficio):
+    risposta = client_ufficio.get('/api/resoconto/eventi', buffered=False)
+    try:
+        corpo = iter(risposta.response)
+        assert next(corpo) == b'retry: 5000\n\n'
+        eventi.bus.pubblica({'tipo': 'attivita', 'id': 1, 'prima': None, 'dopo': {'strutture': ['Informatica']}})
+        assert next(corpo).startswith(b'event: attivita\ndata: {"tipo": "attivita", "id": 1')
+    finally:
+        risposta.close()
+    assert not eventi.bus._iscritti
+
+
+def test_listener_avviato_senza_iscritti(monkeypatch):
+    ascolto = eventi.threading.Event()
+    monkeypatch.setattr(eventi.BusEventi, '_ascolta', lambda self: ascolto.set())
+    bus = eventi.BusEventi(backend='postgres')
+    bus.avvia_listener()
+    assert ascolto.wait(1)
+    memoria = eventi.BusEventi(backend='memoria')
+    memoria.avvia_listener()
+    assert memoria._listener is None
@@ -0,0 +1,59 @@
+"""Export XLSX del report generato in background e scaricato dalla pagina di stato."""
+import os
+import time
+import zipfile
+import io
+import socket
+
+import pytest
+
+
+def _attendi(client, percorso, secondi=10):
+    fine = time.monotonic() + secondi
+    while True:
+        risposta = client.get(percorso)
+        if risposta.status_code != 202 or time.monotonic() > fine:
+            return risposta
+        assert risposta.headers['Refresh'] == '2'
+        time.sleep(0.05)
+
+
+def test_export_in_background(client_ufficio, tmp_path, monkeypatch):
+    pytest.importorskip('xlsxwriter')
+    from services import export_xlsx
+    monkeypatch.setattr(export_xlsx, 'EXPORT_XLSX_DIR', str(tmp_path))
+
+    avvio = client_ufficio.get('/export/report.xlsx?year=2024')
+    assert avvio.status_code == 303
+    risposta = _attendi(client_ufficio, avvio.headers['Location'])
+    assert risposta.status_code == 200
+    assert 'report_attivita_2024.xlsx' in risposta.headers['Content-Disposition']
+    assert 'xl/workbook.xml' in zipfile.ZipFile(io.BytesIO(risposta.data)).namelist()
+
+
+def test_export_sconosciuto(client_ufficio):
+    assert client_ufficio.get('/export/xlsx/2024-' + '0' * 32).status_code == 404
+    assert client_ufficio.get('/export/xlsx/non-valido').status_code == 404
+
+
+def _marcatore(cartella, id_export, pid, eta=0):
+    percorso = os.path.join(cartella, id_export + '.in_corso')
+    with open(percorso, 'w', encoding='utf-8') as f:
+        f.write(f"{socket.gethostname()} {pid}")
+    mtime = time.time() - eta
+    os.utime(percorso, (mtime, mtime))
+
+
+def test_export_processo_terminato(client_ufficio, tmp_path, monkeypatch):
+    from services import export_xlsx
+    monkeypatch.setattr(export_xlsx, 'EXPORT_XLSX_DIR', str(tmp_path))
+    vivo, morto, fermo = ('2024-' + c * 32 for c in 'abc')
+
+    _marcatore(tmp_path, vivo, os.getpid())
+    # pid oltre pid_max: nessun processo lo può avere
+    _marcatore(tmp_path, morto, 2 ** 22 + 1)
+    _marcatore(tmp_path, fermo, os.getpid(), eta=export_xlsx.EXPORT_XLSX_SCADENZA + 1)
+
+    assert client_ufficio.get(f'/export/xlsx/{vivo}').status_code == 202
+    assert client_ufficio.get(f'/export/xlsx/{morto}').status_code == 500
+    assert client_ufficio.get(f'/export/xlsx/{fermo}').status_code == 500
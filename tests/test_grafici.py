@@ -0,0 +1,47 @@
+"""Grafici del resoconto: ETag dalla versione dell'attività, senza caricarne il dettaglio."""
+from database.models import Partecipa, Scuola
+from routes import reportistica
+from services import grafici
+
+
+def test_etag_senza_dettaglio(client_ufficio, session_db, tmp_path, monkeypatch):
+    session_db.add(Partecipa(id_attivita=1, codice_meccanografico='VRPS01000A', indirizzo='Scientifico',
+                             totale_studenti=20, totale_maschi=12, totale_femmine=8))
+    session_db.commit()
+
+    def file_grafico(nome, formato, etichette, valori):
+        file = tmp_path / f'{nome}.{formato}'
+        file.write_text(repr((etichette, valori)))
+        return str(file), nome
+
+    caricati = []
+
+    def carica_dettaglio(session_db, id_attivita):
+        caricati.append(id_attivita)
+        return carica(session_db, id_attivita)
+
+    carica = reportistica.carica_dettaglio
+    monkeypatch.setattr(grafici, 'grafici_disponibili', lambda: True)
+    monkeypatch.setattr(grafici, 'file_grafico', file_grafico)
+    monkeypatch.setattr(grafici, 'percorso', lambda chiave, formato: str(tmp_path / f'{chiave}.{formato}'))
+    monkeypatch.setattr(reportistica, 'carica_dettaglio', carica_dettaglio)
+
+    url = '/resoconto_attivita/1/grafico/scuole.png'
+    risposta = client_ufficio.get(url)
+    assert risposta.status_code == 200 and caricati == [1]
+    etag = risposta.headers['ETag']
+
+    # Richieste ripetute: 304 o file già renderizzato, senza caricare l'attività
+    assert client_ufficio.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert client_ufficio.get(url).status_code == 200
+    assert caricati == [1]
+
+    # Il nome della scuola compare nel grafico: cambiarlo cambia l'ETag
+    session_db.get(Scuola, 'VRPS01000A').nome = 'Liceo Messedaglia'
+    session_db.commit()
+    risposta = client_ufficio.get(url, headers={'If-None-Match': etag})
+    assert risposta.status_code == 200 and risposta.headers['ETag'] != etag
+    assert b'Liceo Messedaglia' in risposta.data
+    assert caricati == [1, 1]
+
+    assert client_ufficio.get('/resoconto_attivita/99/grafico/scuole.png').status_code == 404
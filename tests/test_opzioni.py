@@ -0,0 +1,44 @@
+"""Le opzioni dei select del modulo attività vengono dalla cache finché le tabelle non cambiano."""
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from database.db_connection import Database
+from database.models import Struttura
+from services.template_cache import fragment_cache
+
+
+@contextmanager
+def statement_eseguiti():
+    eseguiti = []
+
+    def registra(conn, cursor, statement, parameters, context, executemany):
+        eseguiti.append(statement)
+
+    engine = Database().engine
+    event.listen(engine, 'before_cursor_execute', registra)
+    try:
+        yield eseguiti
+    finally:
+        event.remove(engine, 'before_cursor_execute', registra)
+
+
+def test_opzioni_senza_query_con_cache_valida(client_ufficio):
+    fragment_cache.clear()
+    assert client_ufficio.get('/inserisci_attivita').status_code == 200
+    with statement_eseguiti() as eseguiti:
+        risposta = client_ufficio.get('/inserisci_attivita')
+    assert risposta.status_code == 200
+    assert 'Rossi Anna' in risposta.get_data(as_text=True)
+    assert eseguiti == []
+
+
+def test_opzioni_ricaricate_dopo_una_modifica(client_ufficio, session_db):
+    fragment_cache.clear()
+    client_ufficio.get('/inserisci_attivita')
+    session_db.add(Struttura(nome='Giurisprudenza'))
+    session_db.commit()
+    with statement_eseguiti() as eseguiti:
+        risposta = client_ufficio.get('/inserisci_attivita')
+    assert 'Giurisprudenza' in risposta.get_data(as_text=True)
+    assert len(eseguiti) == 1
@@ -0,0 +1,94 @@
+"""
+Data di inizio copiata nelle partecipazioni e partizionamento per anno
+(quest'ultimo solo su PostgreSQL 15 o successivo).
+"""
+import io
+from datetime import date
+
+import pytest
+from sqlalchemy import select, text
+
+from database import partizioni
+from database.counters import differenze, leggi_contatori
+from database.models import AttivitaOrientamento, Partecipa
+from services.importa import importa_partecipazioni
+from services.resoconto import kpi_resoconto, sesso_resoconto
+
+_CSV = "id;cm;indirizzo;classi;tot;m;f;altro\n2;VRPS01000A;Scientifico;;12;6;6;\n"
+
+
+def _partecipa(id_attivita, studenti):
+    return Partecipa(id_attivita=id_attivita, codice_meccanografico='VRPS01000A', indirizzo='Scientifico',
+                     totale_studenti=studenti, totale_maschi=studenti - 1, totale_femmine=1)
+
+
+def _date(session_db):
+    return dict(session_db.execute(select(Partecipa.id_attivita, Partecipa.data_inizio)).all())
+
+
+def _sposta(session_db, id_attivita, giorno):
+    attivita = session_db.get(AttivitaOrientamento, id_attivita)
+    attivita.data_inizio = attivita.data_fine = giorno
+    session_db.commit()
+
+
+def test_data_inizio_segue_attivita(session_db):
+    session_db.add(_partecipa(1, 20))
+    session_db.commit()
+    importa_partecipazioni(session_db, io.BytesIO(_CSV.encode('utf-8')))
+    session_db.commit()
+    assert _date(session_db) == {1: date(2024, 3, 1), 2: date(2024, 3, 2)}
+
+    _sposta(session_db, 1, date(2025, 2, 1))
+    assert _date(session_db) == {1: date(2025, 2, 1), 2: date(2024, 3, 2)}
+    assert sesso_resoconto(session_db, 'Ateneo di Verona', 2025) == [19, 1, 0]
+    assert kpi_resoconto(session_db, 'Ateneo di Verona', 2024)['scuole'] == 1
+
+
+def test_partiziona(session_db):
+    conn = session_db.connection()
+    if conn.dialect.name != 'postgresql' or conn.dialect.server_version_info < (15,):
+        pytest.skip("partizionamento solo su PostgreSQL 15 o successivo")
+    session_db.add_all([_partecipa(1, 20), _partecipa(3, 30)])
+    session_db.commit()
+
+    with session_db.get_bind().begin() as c:
+        create, saltati = partizioni.partiziona(c)
+    anno = date.today().year
+    assert 'attivita_orientamento_2024' in create and f'partecipa_{anno + 1}' in create
+    assert saltati == []
+    conn = session_db.connection()
+    assert partizioni.partizionata(conn, 'partecipa')
+    assert differenze(conn) == []
+    session_db.commit()
+
+    # Le query per anno leggono solo le partizioni dell'anno
+    piano = '\n'.join(session_db.execute(text(
+        "EXPLAIN SELECT sum(totale_studenti) FROM partecipa JOIN attivita_orientamento USING (id_attivita) "
+        "WHERE partecipa.data_inizio >= '2024-01-01' AND partecipa.data_inizio < '2025-01-01' "
+        "AND attivita_orientamento.data_inizio >= '2024-01-01' "
+        "AND attivita_orientamento.data_inizio < '2025-01-01'")).scalars())
+    assert 'partecipa_2024' in piano and 'attivita_orientamento_2024' in piano
+    assert 'partecipa_2025' not in piano and '_altri' not in piano
+    session_db.commit()
+
+    # Spostamento tra partizioni, import, cambio di id e cancellazione restano coerenti
+    _sposta(session_db, 3, date(2025, 6, 1))
+    importa_partecipazioni(session_db, io.BytesIO(_CSV.encode('utf-8')))
+    session_db.add(AttivitaOrientamento(id_attivita=5, nome='Nuova', data_inizio=date(2025, 1, 7),
+                                        data_fine=date(2025, 1, 7), totale_ore=3, struttura_organizzante='Lettere',
+                                        docente_presidente='anna@univr.it'))
+    session_db.commit()
+    assert session_db.execute(text("SELECT id_attivita FROM partecipa_2025")).scalars().all() == [3]
+    assert session_db.execute(
+        text("SELECT data_inizio FROM collabora WHERE id_attivita = 3")).scalars().all() == [date(2025, 6, 1)] * 2
+    assert sesso_resoconto(session_db, 'Ateneo di Verona', 2025) == [29, 1, 0]
+    for sql in ("UPDATE attivita_orientamento SET id_attivita = 30 WHERE id_attivita = 3",
+                "DELETE FROM attivita_orientamento WHERE id_attivita = 2"):
+        session_db.execute(text(sql))
+        assert differenze(session_db.connection()) == []
+        session_db.commit()
+    assert leggi_contatori(session_db, 'Lettere', 2025) == (2, 5, 30)
+
+    with session_db.get_bind().begin() as c:
+        assert partizioni.partiziona(c) == ([], [])
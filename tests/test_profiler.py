@@ -0,0 +1,17 @@
+"""Campionatore del profiler: nessun campione aggiunto a una cattura dopo termina."""
+import time
+
+from services.profiler import Campionatore
+
+
+def test_cattura_ferma_dopo_termina():
+    campionatore = Campionatore(intervallo=0.001)
+    cattura = campionatore.avvia('test')
+    fine = time.monotonic() + 0.05
+    while time.monotonic() < fine:
+        pass
+    campionatore.termina(cattura)
+    campioni = dict(cattura.campioni)
+    assert campioni
+    time.sleep(0.05)
+    assert dict(cattura.campioni) == campioni
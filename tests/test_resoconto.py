@@ -0,0 +1,18 @@
+"""KPI del resoconto: attività svolte e programmate lette dalla stessa query dei contatori."""
+from datetime import date, timedelta
+
+from database.models import AttivitaOrientamento
+from services.resoconto import kpi_resoconto
+
+
+def test_svolte_e_programmate(session_db):
+    futura = date.today() + timedelta(days=30)
+    session_db.add(AttivitaOrientamento(id_attivita=5, nome='Open Day', data_inizio=futura, data_fine=futura,
+                                        totale_ore=4, struttura_organizzante='Lettere',
+                                        docente_presidente='anna@univr.it'))
+    session_db.commit()
+
+    kpi = kpi_resoconto(session_db, 'Lettere')
+    assert (kpi['attivita'], kpi['programmate'], kpi['svolte']) == (3, 1, 2)
+    kpi = kpi_resoconto(session_db, 'Informatica', 2024)
+    assert (kpi['attivita'], kpi['programmate'], kpi['svolte']) == (3, 0, 3)
@@ -0,0 +1,87 @@
+"""
+Controllo di concorrenza ottimistico sui moduli di modifica: versione
+superata (409 con il modulo ripresentato), UPDATE concorrente che non trova
+la versione letta (409) e versione mancante (400).
+"""
+import pytest
+from sqlalchemy import text
+
+from database.db_connection import Database
+from database.models import AttivitaOrientamento, Scuola, IndirizzoScolastico
+from routes import anagrafiche, attivita
+
+ATTIVITA = {
+    'titolo': 'Attività modificata', 'data_inizio': '2024-03-01', 'data_fine': '2024-03-01', 'totale_ore': '3',
+    'referente': 'anna@univr.it', 'dip_organizzante': 'Informatica',
+    'scuole[0][id]': 'VRPS01000A', 'scuole[0][indirizzi][0][id]': 'Scientifico',
+    'scuole[0][indirizzi][0][tot]': '20', 'scuole[0][indirizzi][0][maschi]': '12',
+    'scuole[0][indirizzi][0][femmine]': '8',
+}
+SCUOLA = {
+    'nome': 'Liceo Messedaglia', 'email': 'info@scuola.it', 'numero_telefonico': '+39 045 000000',
+    'via': 'Via Roma', 'numero_civico': '1', 'comune': 'Verona', 'dirigente_email': 'dirigente@scuola.it',
+    'dirigente_nome': 'Dario', 'dirigente_cognome': 'Bianchi',
+}
+INDIRIZZO = {'referente_email': 'prof@scuola.it', 'referente_nome': 'Paola', 'referente_cognome': 'Neri'}
+
+# (url, dati del modulo, modulo delle rotte, UPDATE concorrente, lettura del record)
+CASI = {
+    'attivita': ('/modifica_attivita/1', ATTIVITA, attivita,
+                 "UPDATE attivita_orientamento SET versione = versione + 1 WHERE id_attivita = 1",
+                 lambda s: s.get(AttivitaOrientamento, 1)),
+    'scuola': ('/scuole/modifica/VRPS01000A', SCUOLA, anagrafiche,
+               "UPDATE scuola SET versione = versione + 1 WHERE codice_meccanografico = 'VRPS01000A'",
+               lambda s: s.get(Scuola, 'VRPS01000A')),
+    'indirizzo': ('/indirizzi/modifica/VRPS01000A/Scientifico', INDIRIZZO, anagrafiche,
+                  "UPDATE indirizzo_scolastico SET versione = versione + 1 WHERE indirizzo = 'Scientifico'",
+                  lambda s: s.get(IndirizzoScolastico, ('VRPS01000A', 'Scientifico'))),
+}
+
+
+def _versione(session_db, leggi):
+    session_db.expire_all()
+    return leggi(session_db).versione
+
+
+@pytest.mark.parametrize('caso', CASI)
+def test_versione_superata(client_ufficio, session_db, caso):
+    url, dati, _, _, leggi = CASI[caso]
+    r = client_ufficio.post(url, data=dict(dati, versione='0'))
+    assert r.status_code == 409
+    pagina = r.get_data(as_text=True)
+    # Il modulo torna con i dati inviati e la versione attuale, pronto per un nuovo invio
+    assert 'modificato da un altro utente' in pagina
+    assert 'name="versione" value="1"' in pagina
+    assert next(v for k, v in dati.items() if 'nome' in k or 'titolo' in k) in pagina
+    assert _versione(session_db, leggi) == 1
+
+    r = client_ufficio.post(url, data=dict(dati, versione='1'))
+    assert r.status_code == 302
+    assert _versione(session_db, leggi) == 2
+
+
+@pytest.mark.parametrize('caso', CASI)
+def test_update_concorrente(client_ufficio, session_db, monkeypatch, caso):
+    url, dati, modulo, update, leggi = CASI[caso]
+    verifica = modulo.verifica_versione
+
+    def verifica_e_modifica(record, form):
+        # Un altro utente salva dopo il controllo sul modulo e prima del commit
+        verifica(record, form)
+        with Database().engine.begin() as conn:
+            conn.execute(text(update))
+
+    monkeypatch.setattr(modulo, 'verifica_versione', verifica_e_modifica)
+    r = client_ufficio.post(url, data=dict(dati, versione='1'))
+    assert r.status_code == 409
+    assert 'name="versione" value="2"' in r.get_data(as_text=True)
+    assert _versione(session_db, leggi) == 2
+
+
+@pytest.mark.parametrize('caso', CASI)
+@pytest.mark.parametrize('versione', [None, '', 'abc'])
+def test_versione_mancante(client_ufficio, session_db, caso, versione):
+    url, dati, _, _, leggi = CASI[caso]
+    r = client_ufficio.post(url, data=dati if versione is None else dict(dati, versione=versione))
+    assert r.status_code == 400
+    assert _versione(session_db, leggi) == 1
@@ -0,0 +1,54 @@
+"""
+La visibilità con UNION (database/visibility.py) restituisce le stesse
+attività del vecchio filtro OUTER JOIN collabora + OR, senza duplicati.
+"""
+import pytest
+from sqlalchemy import select, func
+
+from database.models import AttivitaOrientamento, Collabora
+from database.visibility import ATENEO, applica_visibilita
+
+
+def _ids_or(session_db, struttura):
+    """Filtro precedente: OUTER JOIN collabora con OR sulle due strutture."""
+    stmt = select(AttivitaOrientamento.id_attivita).outerjoin(Collabora).where(
+        (AttivitaOrientamento.struttura_organizzante == struttura) | (Collabora.nome_struttura == struttura)
+    )
+    return session_db.execute(stmt).scalars().all()
+
+
+def _ids_union(session_db, struttura):
+    stmt = applica_visibilita(select(AttivitaOrientamento.id_attivita), struttura)
+    return session_db.execute(stmt).scalars().all()
+
+
+@pytest.mark.parametrize('struttura, attese', [
+    ('Informatica', {1, 2, 3}),   # organizza 1 e 3, collabora a 2
+    ('Lettere', {2, 3}),          # organizza 2, collabora a 3
+    ('Medicina', {3, 4}),         # organizza 4, collabora a 3
+    ('Economia', set()),          # né organizza né collabora
+])
+def test_stesse_attivita_del_filtro_or(session_db, struttura, attese):
+    ids = _ids_union(session_db, struttura)
+    assert set(ids) == set(_ids_or(session_db, struttura)) == attese
+    assert len(ids) == len(set(ids))
+
+
+def test_organizzatrice_e_collaboratrice(session_db):
+    # Informatica organizza anche un'attività a cui collabora: compare una volta sola
+    session_db.add(Collabora(id_attivita=1, nome_struttura='Informatica'))
+    session_db.commit()
+    ids = _ids_union(session_db, 'Informatica')
+    assert sorted(ids) == [1, 2, 3]
+    assert sorted(set(_ids_or(session_db, 'Informatica'))) == [1, 2, 3]
+
+
+def test_nessun_duplicato_con_piu_collaboratori(session_db):
+    # L'attività 3 ha due collaboratori: il vecchio filtro la contava due volte per l'Ateneo-organizzatore
+    conteggio = select(func.count()).select_from(
+        applica_visibilita(select(AttivitaOrientamento.id_attivita), 'Informatica').subquery())
+    assert session_db.execute(conteggio).scalar_one() == 3
+
+
+def test_ateneo_vede_tutto(session_db):
+    assert sorted(_ids_union(session_db, ATENEO)) == [1, 2, 3, 4]